@@ -0,0 +1,135 @@
+"""
+Micro-benchmarks for the backend, runnable without Tk.
+
+Usage (from the DataBase directory):
+    python DBBenchmark.py
+"""
+import os
+import tempfile
+import threading
+import time
+import tracemalloc
+from dataclasses import fields, make_dataclass
+from Database import Cart, Database, GroupCommitWriter, Part, PartSold, TransactionDetails
+
+
+def bench_cart(lines=1000, changes=10000):
+    """Time line changes and totals reads on a cart with `lines` lines."""
+    parts = [Part(pno, f"Part {pno}", 125 + pno % 7 * 100, 1, 1_000_000) for pno in range(1, lines + 1)]
+    cart = Cart(tax_rate=0.08)
+    cart.set_discount(1, 'percentage', 5)
+    for part in parts:
+        cart.add(part, 1)
+
+    start = time.perf_counter()
+    for i in range(changes):
+        cart.add(parts[i % lines], 1)
+        cart.totals()
+    elapsed = time.perf_counter() - start
+    print(f"cart: {changes} changes on {lines} lines in {elapsed * 1000:.1f} ms "
+          f"({elapsed / changes * 1e6:.2f} us per change + totals)")
+
+
+def seed_sales(db, transactions=5000, parts=50, lines_per_transaction=3):
+    """Fill an empty database with one store, one employee and `transactions` sales."""
+    db.add_store('Bench Store', tax_rate=0.08)
+    db.add_employee('Bench', 'Cashier', 'cashier', 1, 'password')
+    db.cursor.executemany(
+        "INSERT INTO parts (name, price_cents, store_id, quantity) VALUES (?, ?, 1, 1000000)",
+        [(f"Part {i}", 100 + i * 37) for i in range(parts)]
+    )
+    db.cursor.executemany(
+        "INSERT INTO transactions (employee_id, store_id, total_cents) VALUES (1, 1, 0)",
+        [()] * transactions
+    )
+    db.cursor.executemany(
+        "INSERT INTO transaction_details (transaction_id, part_id, quantity) VALUES (?, ?, ?)",
+        [(t, (t * 7 + line) % parts + 1, line + 1)
+         for t in range(1, transactions + 1) for line in range(lines_per_transaction)]
+    )
+    db.conn.commit()
+
+
+def _measure(build):
+    tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0]
+    result = build()
+    retained = tracemalloc.get_traced_memory()[0] - baseline
+    tracemalloc.stop()
+    return result, retained
+
+
+def bench_report_memory(transactions=5000):
+    """
+    Bytes per transaction held by a SalesReport, and by its row objects alone with
+    dict-backed dataclasses (before) versus the slotted ones (after).
+    """
+    db = Database(':memory:', bcrypt_rounds=4)
+    seed_sales(db, transactions)
+    report, retained = _measure(lambda: db.SalesReport(1))
+    db.close_connection()
+    print(f"SalesReport: {len(report)} transactions, {retained / len(report):.0f} bytes per transaction")
+
+    # Same field values, so only the per-object overhead differs
+    PlainPartSold = make_dataclass("PlainPartSold", [f.name for f in fields(PartSold)])
+    PlainTransaction = make_dataclass("PlainTransaction", [f.name for f in fields(TransactionDetails)])
+
+    def rebuild(part_type, transaction_type):
+        return [
+            transaction_type(*[
+                [part_type(*(getattr(p, f.name) for f in fields(PartSold))) for p in t.parts_sold]
+                if f.name == "parts_sold" else getattr(t, f.name)
+                for f in fields(TransactionDetails)
+            ])
+            for t in report
+        ]
+
+    _, before = _measure(lambda: rebuild(PlainPartSold, PlainTransaction))
+    _, after = _measure(lambda: rebuild(PartSold, TransactionDetails))
+    print(f"row objects: {before / len(report):.0f} bytes per transaction with __dict__, "
+          f"{after / len(report):.0f} slotted")
+
+
+def bench_group_commit(registers=8, sales=100):
+    """Sales per second from concurrent registers, committing alone versus in groups."""
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, 'bench.db')
+    db = Database(path, bcrypt_rounds=4)
+    seed_sales(db, transactions=0)
+    sale = [PartSold('Part 0', 1, 100, 100, part_id=1)]
+
+    def run(sell):
+        threads = [threading.Thread(target=sell) for _ in range(registers)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return registers * sales / (time.perf_counter() - start)
+
+    def alone():
+        register = Database(path, events=db.events)
+        for _ in range(sales):
+            register.create_purchase(sale, 1)
+        register.close_connection()
+
+    writer = GroupCommitWriter(path, events=db.events).start()
+
+    def grouped():
+        for _ in range(sales):
+            writer.submit(sale, 1).result()  # a register waits for each receipt
+
+    print(f"checkout: {run(alone):.0f} sales/s committing alone, {run(grouped):.0f} sales/s with group commit "
+          f"({writer.purchases / writer.groups:.1f} sales per commit)")
+    writer.stop()
+    db.close_connection()
+    for name in os.listdir(directory):
+        os.remove(os.path.join(directory, name))
+    os.rmdir(directory)
+
+
+if __name__ == '__main__':
+    for size in (10, 1000, 100000):
+        bench_cart(lines=size)
+    bench_report_memory()
+    bench_group_commit()
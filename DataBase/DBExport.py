@@ -0,0 +1,34 @@
+"""
+Export transactions, line items, returns and discounts for accounting and BI.
+
+Usage (from the DataBase directory):
+    python DBExport.py ../pos_system.db exports/ --format csv --since-last --workers 4
+"""
+import argparse
+from Database import Database, EXPORT_FORMATS
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("database", help="path of the SQLite database file")
+    parser.add_argument("directory", help="output directory")
+    parser.add_argument("--format", choices=EXPORT_FORMATS, default="csv")
+    parser.add_argument("--store", type=int, action="append", dest="store_ids", help="store to export (repeatable)")
+    parser.add_argument("--since-last", action="store_true", help="only rows added since the previous export")
+    parser.add_argument("--name", default="default", help="watermark name of this export target")
+    parser.add_argument("--chunk-size", type=int, default=5000)
+    parser.add_argument("--workers", type=int, default=0, help="export stores in this many processes")
+    args = parser.parse_args(argv)
+
+    db = Database(args.database)
+    try:
+        files = db.export(args.directory, fmt=args.format, store_ids=args.store_ids, since_last=args.since_last,
+                          export_name=args.name, chunk_size=args.chunk_size, workers=args.workers)
+    finally:
+        db.close_connection()
+    for exported in files:
+        print(f"{exported.path}: {exported.rows} rows")
+
+
+if __name__ == '__main__':
+    main()
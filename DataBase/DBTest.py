@@ -1,5 +1,33 @@
+import csv
+import gc
+import importlib.util
+import io
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import tracemalloc
 import unittest
+import weakref
 from Database import Database, TransactionDetails, PartSold  # Assuming Database.py is in the same directory
+from Database import EventSink, StreamRoute, DEBUG, INFO, WARNING, ERROR
+from Database import LoginService, bcrypt_rounds_of
+from Database import PartIndex, Part, Cart
+from Database import to_cents, price_totals, line_total
+from Database import downsample_minmax
+from Database import SaleJournal, JournalSyncer
+from Database import ShardedDatabase, shard_of
+from Database import BackupScheduler
+from Database import STATEMENTS
+from Database import GroupCommitWriter, PurchaseRequest
+
+def temporary_directory(test: unittest.TestCase) -> str:
+    """A new directory that is removed, with everything in it, after the test and its tearDown."""
+    directory = tempfile.TemporaryDirectory()
+    test.addCleanup(directory.cleanup)
+    return directory.name
 
 class TestDatabase(unittest.TestCase):
     def setUp(self):
@@ -32,7 +60,7 @@ class TestDatabase(unittest.TestCase):
         stores = self.db.get_stores()
         self.assertEqual(len(stores), 1)
         self.assertEqual(stores[0][1], 'Test Store')  # store_name
-        self.assertEqual(stores[0][2], 100.0)  # balance
+        self.assertEqual(stores[0].balance, 100.0)  # balance
 
     def test_add_employee(self):
         """Test adding an employee."""
@@ -72,7 +100,7 @@ class TestDatabase(unittest.TestCase):
         self.assertEqual(parts[0].quantity, 5)  # New quantity
         
         stores = self.db.get_stores()
-        self.assertEqual(stores[0][2], 250.0)  # New balance
+        self.assertEqual(stores[0].balance, 250.0)  # New balance
 
     def test_get_stores(self):
         """Test retrieving all stores."""
@@ -95,6 +123,126 @@ class TestDatabase(unittest.TestCase):
         self.assertEqual(employees[0][1], 'Alice')
         self.assertEqual(employees[1][1], 'Bob')
 
+    def test_get_store_employees(self):
+        """Test that store-scoped employee queries filter in SQL and omit password hashes."""
+        self.db.add_store('Store 1')
+        self.db.add_store('Store 2')
+        store1_id, store2_id = [store.store_id for store in self.db.get_stores()]
+
+        self.db.add_employee('Alice', 'Smith', 'Clerk', store1_id, "password")
+        self.db.add_employee('Bob', 'Johnson', 'Technician', store2_id, "password")
+        employees = self.db.get_store_employees(store2_id)
+        self.assertEqual(len(employees), 1)
+        self.assertEqual(employees[0].first_name, 'Bob')
+        self.assertEqual(employees[0].store_id, store2_id)
+        self.assertNotIn('password_hash', employees[0]._fields)
+
+        plan = self.db.cursor.execute(
+            "EXPLAIN QUERY PLAN SELECT id, first_name, last_name, role, store_id FROM employees WHERE store_id IS ?",
+            (store2_id,)
+        ).fetchall()
+        self.assertIn('idx_employees_store', str(plan))
+
+    def test_get_store_summaries(self):
+        """Test that store summaries include tax rate and inventory value."""
+        self.db.add_store('Store 1', tax_rate=0.08)
+        self.db.add_store('Store 2')
+        store1_id, store2_id = [store.store_id for store in self.db.get_stores()]
+        self.db.add_part_to_store('Widget', 10.0, store1_id, 3)
+        self.db.add_part_to_store('Gadget', 2.5, store1_id, 4)
+
+        summaries = self.db.get_store_summaries()
+        self.assertEqual([s.store_id for s in summaries], [store1_id, store2_id])
+        self.assertEqual(summaries[0].inventory_value, 40.0)
+        self.assertEqual(summaries[0].tax_rate, 0.08)
+        self.assertEqual(summaries[1].inventory_value, 0)
+
+    def test_sales_frame(self):
+        """The sales frame has one typed row per transaction line, filtered by date."""
+        self.db.add_store('Test Store', tax_rate=0.08)
+        self.db.add_employee('Alice', 'Smith', 'cashier', 1, 'password')
+        self.db.add_part_to_store('Widget', 10.0, 1, 10)
+        self.db.add_part_to_store('Gadget', 15.0, 1, 10)
+        first = self.db.create_purchase([
+            PartSold(name='Widget', quantity=3, unit_cents=1000, total_cents=3000),
+            PartSold(name='Gadget', quantity=1, unit_cents=1500, total_cents=1500)
+        ], 1)
+        second = self.db.create_purchase([PartSold(name='Widget', quantity=2, unit_cents=1000, total_cents=2000)], 1)
+        self.db.cursor.execute("UPDATE transactions SET transaction_date = '2024-01-05 12:00:00' WHERE transaction_id = ?", (first,))
+        self.db.conn.commit()
+
+        frame = self.db.sales_frame(1)
+        self.assertEqual(list(frame.columns), list(self.db.SALES_FRAME_COLUMNS))
+        self.assertEqual(str(frame["date"].dtype), "datetime64[s]")
+        self.assertEqual(str(frame["amount_cents"].dtype), "int64")
+        self.assertEqual(list(frame["transaction_id"]), [first, first, second])
+        self.assertEqual(list(frame["amount_cents"]), [3000, 1500, 2000])
+        self.assertEqual(frame["total_cents"].iloc[0], 4860)
+
+        january = self.db.sales_frame(1, start='2024-01-01', end='2024-01-05')
+        self.assertEqual(list(january["pno"]), [1, 2])
+        self.assertEqual(len(self.db.sales_frame(2)), 0)
+
+    def test_report_aggregates(self):
+        """Top items and sales over time are grouped in SQL by part and time bucket."""
+        self.db.add_store('Test Store')
+        self.db.add_employee('Alice', 'Smith', 'cashier', 1, 'password')
+        self.db.add_part_to_store('Widget', 10.0, 1, 100)
+        self.db.add_part_to_store('Gadget', 15.0, 1, 100)
+        sales = [
+            ('2024-01-01 09:15:00', 'Widget', 2),
+            ('2024-01-01 09:45:00', 'Gadget', 5),
+            ('2024-01-01 14:00:00', 'Widget', 1),
+            ('2024-01-03 10:00:00', 'Widget', 4),
+            ('2024-01-08 10:00:00', 'Gadget', 1),
+        ]
+        prices = {'Widget': 1000, 'Gadget': 1500}
+        for date, name, quantity in sales:
+            line = PartSold(name=name, quantity=quantity, unit_cents=prices[name], total_cents=prices[name] * quantity)
+            transaction_id = self.db.create_purchase([line], 1)
+            self.db.cursor.execute("UPDATE transactions SET transaction_date = ? WHERE transaction_id = ?", (date, transaction_id))
+        self.db.conn.commit()
+
+        top = self.db.top_items(1)
+        self.assertEqual([(item.name, item.quantity) for item in top], [('Widget', 7), ('Gadget', 6)])
+        self.assertEqual(len(self.db.top_items(1, limit=1)), 1)
+
+        daily = self.db.sales_over_time(1, 'daily')
+        self.assertEqual([(b.period, b.transactions) for b in daily], [('2024-01-01', 3), ('2024-01-03', 1), ('2024-01-08', 1)])
+        self.assertEqual(daily[0].total, 20.0 + 75.0 + 10.0)
+        hourly = self.db.sales_over_time(1, 'hourly', start='2024-01-01', end='2024-01-01')
+        self.assertEqual([b.period for b in hourly], ['2024-01-01 09:00:00', '2024-01-01 14:00:00'])
+        weekly = self.db.sales_over_time(1, 'weekly')
+        self.assertEqual([(b.period, b.transactions) for b in weekly], [('2024-01-01', 4), ('2024-01-08', 1)])
+        with self.assertRaises(ValueError):
+            self.db.sales_over_time(1, 'monthly')
+
+    def test_sales_report_lines(self):
+        """The streamed report matches the report built from SalesReport."""
+        self.db.add_store('Test Store', tax_rate=0.08)
+        self.db.add_employee('Alice', 'Smith', 'cashier', 1, 'password')
+        self.db.add_part_to_store('Widget', 10.0, 1, 100)
+        self.db.add_part_to_store('Gadget', 15.0, 1, 100)
+        discount_id = self.db.add_discount('Ten Off', 'percentage', 10)
+        widget = PartSold(name='Widget', quantity=3, unit_cents=1000, total_cents=3000)
+        gadget = PartSold(name='Gadget', quantity=2, unit_cents=1500, total_cents=3000)
+        for day, (parts, discount) in enumerate([([widget, gadget], discount_id), ([gadget], None), ([widget], None)]):
+            transaction_id = self.db.create_purchase(parts, 1, discount_id=discount)
+            self.db.cursor.execute("UPDATE transactions SET transaction_date = ? WHERE transaction_id = ?",
+                                   (f"2024-01-0{day + 1} 10:00:00", transaction_id))
+        self.db.conn.commit()
+
+        expected = f"Sales Report for Store ID 1\n\n"
+        for transaction in self.db.SalesReport(1):
+            expected += f"Transaction ID: {transaction.transaction_id}, Date: {transaction.date}, Total: ${transaction.total_price:.2f}, Employee: {transaction.employee}\n"
+            if transaction.discount_name:
+                expected += f"  Discount: {transaction.discount_name} (-${transaction.discount_amount:.2f})\n"
+            for part in transaction.parts_sold:
+                expected += f"  - {part.name}: {part.quantity} @ ${part.unit_price:.2f} each (Total: ${part.total_price:.2f})\n"
+            expected += "\n"
+        self.assertEqual("".join(self.db.sales_report_lines(1, chunk_size=2)), expected)
+        self.assertIn("  Discount: Ten Off (-$6.00)\n", expected)
+
     def test_get_parts(self):
         """Test retrieving all parts for a specific store."""
         self.db.add_store('Test Store')
@@ -120,8 +268,8 @@ class TestDatabase(unittest.TestCase):
 
         # Create a purchase transaction
         parts_to_purchase = [
-            PartSold(name='Widget', quantity=3, unit_price=10.0, total_price=30.0),
-            PartSold(name='Gadget', quantity=2, unit_price=15.0, total_price=30.0)
+            PartSold(name='Widget', quantity=3, unit_cents=1000, total_cents=3000),
+            PartSold(name='Gadget', quantity=2, unit_cents=1500, total_cents=3000)
         ]
         transaction_id = self.db.create_purchase(parts_to_purchase, store_id)
 
@@ -182,8 +330,8 @@ class TestDatabase(unittest.TestCase):
 
         # Create a purchase transaction
         parts_to_purchase = [
-            PartSold(name='Widget', quantity=3, unit_price=10.0, total_price=30.0),
-            PartSold(name='Gadget', quantity=2, unit_price=15.0, total_price=30.0)
+            PartSold(name='Widget', quantity=3, unit_cents=1000, total_cents=3000),
+            PartSold(name='Gadget', quantity=2, unit_cents=1500, total_cents=3000)
         ]
         transaction_id = self.db.create_purchase(parts_to_purchase, store_id)
 
@@ -236,7 +384,7 @@ class TestDatabase(unittest.TestCase):
         # Step 5: Verify updated store balance
         stores = self.db.get_stores()
         self.assertEqual(len(stores), 1)  # Ensure one store exists
-        self.assertEqual(stores[0][2], 445.0)  # Original 500 - Refund (40 + 15)
+        self.assertEqual(stores[0].balance, 445.0)  # Original 500 - Refund (40 + 15)
 
         print("test_return_part passed successfully.")
 
@@ -254,8 +402,8 @@ class TestDatabase(unittest.TestCase):
 
         # Step 3: Create a purchase transaction
         parts_to_purchase = [
-            PartSold(name='Widget', quantity=3, unit_price=20.0, total_price=60.0),
-            PartSold(name='Gadget', quantity=2, unit_price=15.0, total_price=30.0)
+            PartSold(name='Widget', quantity=3, unit_cents=2000, total_cents=6000),
+            PartSold(name='Gadget', quantity=2, unit_cents=1500, total_cents=3000)
         ]
         transaction_id = self.db.create_purchase(parts_to_purchase, store_id)
 
@@ -264,7 +412,7 @@ class TestDatabase(unittest.TestCase):
         self.assertEqual(parts[0].quantity, 7)  # Widget: 10 - 3
         self.assertEqual(parts[1].quantity, 6)  # Gadget: 8 - 2
         stores = self.db.get_stores()
-        self.assertEqual(stores[0][2], 590.0)  # Initial 500 + Purchase (60 + 30)
+        self.assertEqual(stores[0].balance, 590.0)  # Initial 500 + Purchase (60 + 30)
 
         # Step 5: Process return by transaction ID
         return_transaction_id = self.db.return_by_transaction_id(transaction_id, admin_id)
@@ -276,7 +424,7 @@ class TestDatabase(unittest.TestCase):
         self.assertEqual(parts[1].quantity, 8)   # Gadget: 6 + 2
 
         stores = self.db.get_stores()
-        self.assertEqual(stores[0][2], 500.0)  # Back to initial balance
+        self.assertEqual(stores[0].balance, 500.0)  # Back to initial balance
 
         # Step 7: Verify return transaction details
         return_details = self.db.get_transaction_details(return_transaction_id)
@@ -311,8 +459,8 @@ class TestDatabase(unittest.TestCase):
 
         # Step 3: Create a purchase transaction
         parts_to_purchase = [
-            PartSold(name='Widget', quantity=3, unit_price=20.0, total_price=60.0),
-            PartSold(name='Gadget', quantity=2, unit_price=15.0, total_price=30.0)
+            PartSold(name='Widget', quantity=3, unit_cents=2000, total_cents=6000),
+            PartSold(name='Gadget', quantity=2, unit_cents=1500, total_cents=3000)
         ]
         transaction_id = self.db.create_purchase(parts_to_purchase, store_id)
 
@@ -325,7 +473,7 @@ class TestDatabase(unittest.TestCase):
 
         # Step 5: Verify store balance after purchase with tax
         stores = self.db.get_stores()
-        self.assertEqual(stores[0][2], 500.0 + expected_total)
+        self.assertEqual(stores[0].balance, 500.0 + expected_total)
 
         # Step 6: Process return by transaction ID
         return_transaction_id = self.db.return_by_transaction_id(transaction_id, admin_id)
@@ -337,7 +485,7 @@ class TestDatabase(unittest.TestCase):
 
         # Step 8: Verify store balance after return with tax
         stores = self.db.get_stores()
-        self.assertEqual(stores[0][2], 500.0)  # Back to initial balance
+        self.assertEqual(stores[0].balance, 500.0)  # Back to initial balance
 
         # Step 9: Verify part quantities after complete cycle
         parts = self.db.get_parts_by_store(store_id)
@@ -363,8 +511,8 @@ class TestDatabase(unittest.TestCase):
         gadget_price = 50.0 * 0.8   # Gadget price after 20% discount
         
         parts_to_purchase = [
-            PartSold(name='Widget', quantity=1, unit_price=100.0, total_price=widget_price, discount_percent=0.20),
-            PartSold(name='Gadget', quantity=2, unit_price=50.0, total_price=gadget_price * 2, discount_percent=0.20)
+            PartSold(name='Widget', quantity=1, unit_cents=10000, total_cents=8000, discount_percent=0.20),
+            PartSold(name='Gadget', quantity=2, unit_cents=5000, total_cents=8000, discount_percent=0.20)
         ]
         transaction_id = self.db.create_purchase(parts_to_purchase, store_id, admin_id)
 
@@ -381,7 +529,7 @@ class TestDatabase(unittest.TestCase):
 
         # Verify store balance
         stores = self.db.get_stores()
-        self.assertEqual(stores[0][2], 500.0 + expected_total)
+        self.assertEqual(stores[0].balance, 500.0 + expected_total)
 
         # Verify inventory was updated
         parts = self.db.get_parts_by_store(store_id)
@@ -402,8 +550,8 @@ class TestDatabase(unittest.TestCase):
 
         # Create initial purchase
         purchase_parts = [
-            PartSold(name='Widget', quantity=3, unit_price=20.0, total_price=60.0),
-            PartSold(name='Gadget', quantity=2, unit_price=15.0, total_price=30.0)
+            PartSold(name='Widget', quantity=3, unit_cents=2000, total_cents=6000),
+            PartSold(name='Gadget', quantity=2, unit_cents=1500, total_cents=3000)
         ]
         transaction_id = self.db.create_purchase(purchase_parts, store_id, admin_id)
 
@@ -471,7 +619,7 @@ class TestDatabase(unittest.TestCase):
         # Add parts and create purchase
         self.db.add_part_to_store('Widget', 20.0, store_id, 10)
         parts_to_purchase = [
-            PartSold(name='Widget', quantity=3, unit_price=20.0, total_price=60.0)
+            PartSold(name='Widget', quantity=3, unit_cents=2000, total_cents=6000)
         ]
         transaction_id = self.db.create_purchase(parts_to_purchase, store_id)
 
@@ -487,5 +635,1149 @@ class TestDatabase(unittest.TestCase):
             self.db.return_by_transaction_id(transaction_id, clerk_id)
         self.assertEqual(str(context.exception), "Admin access required for returns")
 
+class TestPartIndex(unittest.TestCase):
+    def setUp(self):
+        self.db = Database(':memory:')
+        self.db.add_store('Store 1', 500.0)
+        self.db.add_store('Store 2')
+        self.store_id, self.other_store_id = [store.store_id for store in self.db.get_stores()]
+        self.db.add_employee('Alice', 'Smith', 'Clerk', self.store_id, 'password')
+        self.widget = self.db.add_part_to_store('Widget', 20.0, self.store_id, 10)
+        self.db.add_part_to_store('Widget', 25.0, self.other_store_id, 10)
+        self.index = PartIndex(self.db)
+        self.index.load(self.store_id)
+
+    def tearDown(self):
+        self.db.close_connection()
+
+    def test_lookups(self):
+        """Parts can be found by name and by pno."""
+        self.assertEqual(self.index.find('Widget').part_id, self.widget)
+        self.assertEqual(self.index.get(self.widget).price, 20.0)
+        self.assertEqual(self.index.names(), ['Widget'])
+        self.assertIsNone(self.index.find('Missing'))
+
+    def test_follows_database_changes(self):
+        """Adds, sales, edits and removals are reflected without reloading."""
+        gadget = self.db.add_part_to_store('Gadget', 15.0, self.store_id, 8)
+        self.db.add_part_to_store('Gizmo', 5.0, self.other_store_id, 1)
+        self.assertEqual(self.index.names(), ['Widget', 'Gadget'])
+
+        self.db.create_purchase([PartSold(name='Gadget', quantity=3, unit_cents=1500, total_cents=4500)], self.store_id)
+        self.assertEqual(self.index.get(gadget).quantity, 5)
+
+        self.assertTrue(self.db.update_part(gadget, name='Gadget Pro', price=17.5))
+        self.assertIsNone(self.index.find('Gadget'))
+        self.assertEqual(self.index.find('Gadget Pro').price, 17.5)
+
+        self.assertTrue(self.db.remove_part(self.widget))
+        self.assertNotIn(self.widget, self.index)
+        self.assertEqual(self.index.names(), ['Gadget Pro'])
+
+    def test_update_part_is_keyed_by_pno(self):
+        """Editing a part does not touch parts with the same name in other stores."""
+        self.db.update_part(self.widget, price=30.0)
+        other = self.db.get_part_by_name('Widget', self.other_store_id)
+        self.assertEqual(other.price, 25.0)
+        self.assertEqual(self.db.get_part_by_id(self.widget).price, 30.0)
+
+class TestCart(unittest.TestCase):
+    def setUp(self):
+        self.cart = Cart(tax_rate=0.08)
+        self.widget = Part(1, 'Widget', 1000, 1, 5)
+        self.gadget = Part(2, 'Gadget', 250, 1, 100)
+
+    def test_running_subtotal(self):
+        """The subtotal follows each line change without recomputing the cart."""
+        self.cart.add(self.widget, 2)
+        self.cart.add(self.gadget, 4)
+        self.assertEqual(self.cart.subtotal, 30.0)
+        self.cart.set_quantity(self.widget, 1)
+        self.assertEqual(self.cart.subtotal, 20.0)
+        self.cart.remove(1)
+        self.assertEqual(self.cart.subtotal, 10.0)
+        self.assertEqual(self.cart.position(2), 0)
+        self.cart.add(self.widget, 1)
+        self.assertEqual((self.cart.position(1), self.cart.pno_at(0)), (1, 2))
+
+    def test_totals_with_discount(self):
+        """Discount and tax are applied the same way as Database.create_purchase."""
+        self.cart.add(self.widget, 3)
+        self.cart.set_discount(1, 'percentage', 10)
+        totals = self.cart.totals()
+        self.assertEqual(totals.discount, 3.0)
+        self.assertEqual(totals.tax, 2.16)
+        self.assertEqual(totals.total, 29.16)
+        self.cart.set_discount(2, 'fixed', 50)
+        self.assertEqual(self.cart.totals().total, 0.0)
+
+    def test_stock_limit(self):
+        """Quantities above the part's stock are rejected."""
+        self.cart.add(self.widget, 5)
+        with self.assertRaises(ValueError):
+            self.cart.add(self.widget, 1)
+        self.assertEqual(self.cart.lines[1].quantity, 5)
+
+    def test_checkout_matches_database(self):
+        """A purchase from the cart records the totals the cart showed."""
+        db = Database(':memory:')
+        db.create_tables()
+        db.add_store('Test Store', tax_rate=0.08)
+        db.add_employee('Alice', 'Smith', 'cashier', 1, 'password')
+        db.add_part_to_store('Widget', 10.0, 1, 5)
+        self.cart.add(db.get_parts_by_store(1)[0], 3)
+        transaction_id = db.create_purchase(self.cart.to_parts_sold(), 1)
+        details = db.get_transaction_details(transaction_id)
+        db.close_connection()
+        self.assertEqual(details.total_price, self.cart.totals().total)
+
+class TestCents(unittest.TestCase):
+    def test_to_cents_rounds_half_up(self):
+        """Dollar amounts that are not exact in binary still convert to the intended cents."""
+        self.assertEqual(to_cents(1.005), 101)
+        self.assertEqual(to_cents(0.1 + 0.2), 30)
+        self.assertEqual(to_cents("19.99"), 1999)
+
+    def test_totals_are_exact(self):
+        """Sums of many prices do not drift and tax rounds half up once."""
+        subtotal = sum(line_total(10, 1) for _ in range(1000))
+        self.assertEqual(subtotal, 10000)
+        totals = price_totals(1050, 0.0825)
+        self.assertEqual(totals.tax_cents, 87)  # 86.625 cents
+        self.assertEqual(totals.total, 11.37)
+
+    def test_migrates_dollar_columns(self):
+        """A database with DECIMAL dollar columns is converted to cents when opened."""
+        fd, path = tempfile.mkstemp(suffix='.db')
+        os.close(fd)
+        self.addCleanup(os.remove, path)
+        conn = sqlite3.connect(path)
+        conn.executescript("""
+        CREATE TABLE stores (store_id INTEGER PRIMARY KEY AUTOINCREMENT, store_name TEXT NOT NULL,
+                             balance DECIMAL(10,2) NOT NULL DEFAULT 0.00, tax_rate DECIMAL(5,2) NOT NULL DEFAULT 0.00);
+        CREATE TABLE parts (pno INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT NOT NULL, price DECIMAL(10,2) NOT NULL,
+                            store_id INTEGER, quantity INTEGER NOT NULL);
+        INSERT INTO stores (store_name, balance, tax_rate) VALUES ('Old Store', 1234.56, 0.08);
+        INSERT INTO parts (name, price, store_id, quantity) VALUES ('Widget', 19.99, 1, 3);
+        """)
+        conn.commit()
+        conn.close()
+
+        db = Database(path)
+        stores = db.get_stores()
+        parts = db.get_parts()
+        version = db.cursor.execute("PRAGMA user_version").fetchone()[0]
+        db.close_connection()
+        self.assertEqual(stores[0].balance_cents, 123456)
+        self.assertEqual(parts[0].price_cents, 1999)
+        self.assertEqual(parts[0].price, 19.99)
+        self.assertEqual(version, 1)
+
+class TestDownsample(unittest.TestCase):
+    def test_keeps_extremes(self):
+        """Each bucket keeps its minimum and maximum, so spikes stay visible."""
+        x = list(range(100000))
+        y = [0.0] * 100000
+        y[31337] = 500.0
+        y[77777] = -20.0
+        dx, dy = downsample_minmax(x, y, 100)
+        self.assertLessEqual(len(dx), 202)
+        self.assertIn(500.0, list(dy))
+        self.assertIn(-20.0, list(dy))
+        self.assertEqual((dx[0], dx[-1]), (0, 99999))
+        self.assertTrue(all(a < b for a, b in zip(dx, dx[1:])))
+
+    def test_short_series_unchanged(self):
+        dx, dy = downsample_minmax([1, 2, 3], [3, 1, 2], 100)
+        self.assertEqual(list(dy), [3, 1, 2])
+
+class TestBulkAdjust(unittest.TestCase):
+    def setUp(self):
+        self.db = Database(':memory:')
+        self.db.add_store('Store 1')
+        self.db.add_store('Store 2')
+        self.bolt = self.db.add_part_to_store('Bolt M4', 0.10, 1, 100)
+        self.nut = self.db.add_part_to_store('Nut M4', 0.05, 1, 100)
+        self.other_bolt = self.db.add_part_to_store('Bolt M4', 0.20, 2, 10)
+        self.changes = []
+        self.db.add_listener(self.changes.append)
+
+    def tearDown(self):
+        self.db.close_connection()
+
+    def prices(self):
+        return {part.part_id: part.price_cents for part in self.db.get_parts()}
+
+    def test_adjust_prices_by_prefix_across_stores(self):
+        """A percentage change applies to every matching part in one statement."""
+        self.assertEqual(self.db.adjust_prices(5, name_prefix='Bolt'), 2)
+        self.assertEqual(self.prices(), {self.bolt: 11, self.nut: 5, self.other_bolt: 21})
+        self.assertEqual(self.changes[-1].pnos, (self.bolt, self.other_bolt))
+
+    def test_adjust_prices_by_store(self):
+        self.assertEqual(self.db.adjust_prices(-50, store_id=1), 2)
+        self.assertEqual(self.prices(), {self.bolt: 5, self.nut: 3, self.other_bolt: 20})
+        self.assertEqual(self.db.adjust_prices(10, pnos=[]), 0)
+
+    def test_update_parts(self):
+        """Mixed per-part changes are applied together."""
+        updated = self.db.update_parts({
+            self.bolt: {"price": 0.12},
+            self.nut: {"name": "Hex Nut M4", "quantity": 50},
+            999: {"quantity": 1},
+        })
+        self.assertEqual(updated, 2)
+        nut = self.db.get_part_by_id(self.nut)
+        self.assertEqual((nut.name, nut.quantity), ("Hex Nut M4", 50))
+        self.assertEqual(self.db.get_part_by_id(self.bolt).price_cents, 12)
+
+    def test_adjust_stock_is_all_or_nothing(self):
+        self.assertEqual(self.db.adjust_stock({self.bolt: -40, self.nut: 25}), 2)
+        with self.assertRaises(ValueError):
+            self.db.adjust_stock({self.bolt: 10, self.other_bolt: -11})
+        quantities = {part.part_id: part.quantity for part in self.db.get_parts()}
+        self.assertEqual(quantities, {self.bolt: 60, self.nut: 125, self.other_bolt: 10})
+
+class TestImportParts(unittest.TestCase):
+    def setUp(self):
+        self.db = Database(':memory:')
+        self.db.add_store('Store 1')
+        self.db.add_store('Store 2')
+        self.db.add_part_to_store('Widget', 10.0, 1, 5)
+
+    def tearDown(self):
+        self.db.close_connection()
+
+    def test_import_csv(self):
+        """Valid rows are inserted or update the existing part; invalid rows are reported."""
+        catalog = io.StringIO(
+            "name,price,quantity,store_id\n"
+            "Widget,12.50,40,1\n"
+            "Gadget,3.99,100,\n"
+            "Gadget,3.99,7,2\n"
+            ",1.00,1,1\n"
+            "Bolt,abc,1,1\n"
+            "Nut,0.10,1,9\n"
+        )
+        report = self.db.import_parts(catalog, store_id=1, fmt='csv', batch_size=2)
+        self.assertEqual((report.inserted, report.updated), (2, 1))
+        self.assertEqual([rejected.line for rejected in report.rejected], [5, 6, 7])
+        self.assertEqual(report.rejected[1].reason, 'invalid price')
+        self.assertIn('store 9', report.rejected[2].reason)
+        widget = self.db.get_part_by_name('Widget', 1)
+        self.assertEqual((widget.price, widget.quantity), (12.5, 40))
+        self.assertEqual(self.db.get_part_by_name('Gadget', 2).quantity, 7)
+
+    def test_import_jsonl_updates_index(self):
+        """Imported parts reach listeners such as the part index."""
+        index = PartIndex(self.db)
+        index.load(1)
+        catalog = io.StringIO('{"name": "Gadget", "price": 2, "quantity": 3}\nnot json\n{"name": "Gadget", "price": 2.5, "quantity": 4}\n')
+        report = self.db.import_parts(catalog, store_id=1, fmt='jsonl', batch_size=1)
+        self.assertEqual((report.inserted, report.updated, len(report.rejected)), (1, 1, 1))
+        self.assertEqual(index.find('Gadget').price, 2.5)
+
+    def test_import_rejects_fractional_quantities(self):
+        """A quantity that is not a whole number is rejected the same way from JSON and CSV."""
+        catalog = io.StringIO('[{"name": "A", "price": 1, "quantity": 2.9}, {"name": "B", "price": 1, "quantity": true},'
+                              ' {"name": "C", "price": 1, "quantity": 2.0}]')
+        report = self.db.import_parts(catalog, store_id=1, fmt='json')
+        self.assertEqual([(rejected.line, rejected.reason) for rejected in report.rejected],
+                         [(1, 'invalid quantity'), (2, 'invalid quantity')])
+        report = self.db.import_parts(io.StringIO("name,price,quantity\nA,1,2.9\nD,1,3\n"), store_id=1, fmt='csv')
+        self.assertEqual([(rejected.line, rejected.reason) for rejected in report.rejected], [(2, 'invalid quantity')])
+        self.assertEqual(self.db.get_part_by_name('C', 1).quantity, 2)
+
+class TestExport(unittest.TestCase):
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp(suffix='.db')
+        os.close(fd)
+        self.out = temporary_directory(self)
+        self.db = Database(self.path, bcrypt_rounds=4)
+        self.db.add_store('Store 1')
+        self.db.add_store('Store 2')
+        self.db.add_employee('Alice', 'Smith', 'cashier', 1, 'password')
+        self.db.add_part_to_store('Widget', 10.0, 1, 100)
+        self.db.add_part_to_store('Gadget', 15.0, 2, 100)
+        self.db.add_discount('Ten Off', 'percentage', 10)
+
+    def tearDown(self):
+        self.db.close_connection()
+        os.remove(self.path)
+
+    def sell(self, name, store_id, quantity=1):
+        cents = {'Widget': 1000, 'Gadget': 1500}[name]
+        return self.db.create_purchase([PartSold(name, quantity, cents, cents * quantity)], store_id)
+
+    def rows(self, name):
+        with open(os.path.join(self.out, name), newline='') as file:
+            return list(csv.DictReader(file))
+
+    def test_export_csv_since_last(self):
+        """A second export with since_last only contains rows added after the first."""
+        first = self.sell('Widget', 1, 2)
+        self.sell('Gadget', 2)
+        files = self.db.export(self.out, chunk_size=1)
+        self.assertEqual(len(files), 7)
+        self.assertEqual([row['transaction_id'] for row in self.rows('transactions_store1.csv')], [str(first)])
+        self.assertEqual(self.rows('transaction_details_store1.csv')[0]['quantity'], '2')
+        self.assertEqual(self.rows('discounts.csv')[0]['name'], 'Ten Off')
+
+        second = self.sell('Widget', 1)
+        files = self.db.export(self.out, since_last=True)
+        self.assertEqual([row['transaction_id'] for row in self.rows('transactions_store1.csv')], [str(second)])
+        self.assertEqual(self.rows('transactions_store2.csv'), [])
+        rows = {(f.table, f.store_id): f.rows for f in files}
+        self.assertEqual(rows[('transactions', 1)], 1)
+        self.assertEqual(rows[('transactions', 2)], 0)
+
+    def test_export_streams_in_chunks(self):
+        """Memory held by an export does not grow with the rows exported."""
+        self.db.cursor.executemany(
+            "INSERT INTO transactions (employee_id, store_id, total_cents) VALUES (1, 1, 0)", [()] * 2000)
+        self.db.cursor.executemany(
+            "INSERT INTO transaction_details (transaction_id, part_id, quantity) VALUES (?, 1, 1)",
+            [(t,) for t in range(1, 2001) for _ in range(10)])
+        self.db.conn.commit()
+        tracemalloc.start()
+        try:
+            files = self.db.export(self.out, chunk_size=200)
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        self.assertEqual(sum(f.rows for f in files if f.table == 'transaction_details'), 20000)
+        self.assertLess(peak, 1_000_000)
+        self.assertIsNone(self.db._snapshot)
+
+    def test_export_refuses_pending_changes(self):
+        """An export never commits changes the caller has not committed."""
+        self.db.cursor.execute("INSERT INTO transactions (employee_id, store_id, total_cents) VALUES (1, 1, 0)")
+        with self.assertRaises(RuntimeError):
+            self.db.export(self.out)
+        self.db.conn.rollback()
+        self.assertEqual(self.db.cursor.execute("SELECT COUNT(*) FROM transactions").fetchone()[0], 0)
+        self.assertEqual(len(self.db.export(self.out)), 7)
+
+    def test_export_with_worker_processes(self):
+        """Stores can be exported in parallel processes with the same result."""
+        self.sell('Widget', 1)
+        self.sell('Gadget', 2, 3)
+        files = self.db.export(self.out, workers=2)
+        self.assertEqual(sum(f.rows for f in files if f.table == 'transaction_details'), 2)
+        self.assertEqual(self.rows('transaction_details_store2.csv')[0]['quantity'], '3')
+
+    @unittest.skipUnless(importlib.util.find_spec('pyarrow'), "pyarrow is not installed")
+    def test_export_parquet(self):
+        import pyarrow.parquet as pq
+        self.sell('Widget', 1, 2)
+        self.db.export(self.out, fmt='parquet')
+        table = pq.read_table(os.path.join(self.out, 'transaction_details_store1.parquet'))
+        self.assertEqual(table.column('quantity').to_pylist(), [2])
+
+    def test_unknown_format(self):
+        with self.assertRaises(ValueError):
+            self.db.export(self.out, fmt='xlsx')
+
+class TestOfflineJournal(unittest.TestCase):
+    def setUp(self):
+        self.dir = temporary_directory(self)
+        self.path = os.path.join(self.dir, 'pos.db')
+        self.db = Database(self.path, bcrypt_rounds=4)
+        self.db.add_store('Store 1')
+        self.db.add_employee('Alice', 'Smith', 'cashier', 1, 'password')
+        self.widget = self.db.add_part_to_store('Widget', 10.0, 1, 5)
+        self.journal = SaleJournal(os.path.join(self.dir, 'journal.db'))
+
+    def tearDown(self):
+        self.journal.close()
+        self.db.close_connection()
+
+    def sell(self, quantity):
+        return self.journal.record([PartSold('Widget', quantity, 1000, 1000 * quantity, part_id=self.widget)], 1)
+
+    def stock(self):
+        return self.db.get_parts_by_ids([self.widget])[0].quantity
+
+    def test_replay_in_one_batch(self):
+        """Journaled sales become purchases, and the journal is settled."""
+        self.sell(1)
+        self.sell(2)
+        self.assertEqual(self.journal.backlog(), 2)
+        result = self.db.replay_sales(self.journal.pending())
+        self.journal.settle(result)
+        self.assertEqual(len(result.synced), 2)
+        self.assertEqual(result.pnos, (self.widget,))
+        self.assertEqual(self.stock(), 2)
+        self.assertEqual(self.journal.backlog(), 0)
+        self.assertEqual(self.db.get_stores()[0].balance, 30.0)
+
+    def test_replay_is_idempotent(self):
+        """Replaying a batch that was applied but not settled does not sell twice."""
+        self.sell(1)
+        entries = self.journal.pending()
+        first = self.db.replay_sales(entries)
+        second = self.db.replay_sales(entries)
+        self.assertEqual(first.synced, second.synced)
+        self.assertEqual(second.pnos, ())
+        self.assertEqual(self.stock(), 4)
+
+    def test_short_stock_rejects_only_that_sale(self):
+        self.sell(4)
+        self.sell(4)
+        self.sell(1)
+        result = self.db.replay_sales(self.journal.pending())
+        self.journal.settle(result)
+        self.assertEqual(len(result.synced), 2)
+        self.assertEqual(len(result.rejected), 1)
+        self.assertIn('Insufficient quantity', self.journal.rejected()[0][3])
+        self.assertEqual(self.stock(), 0)
+
+    def test_locked_database_keeps_backlog(self):
+        """A locked database fails the whole batch; it is replayed once the lock is gone."""
+        self.sell(1)
+        self.db.conn.execute("PRAGMA busy_timeout = 0")
+        other = sqlite3.connect(self.path)
+        other.execute("BEGIN IMMEDIATE")
+        with self.assertRaises(sqlite3.OperationalError):
+            self.db.replay_sales(self.journal.pending())
+        self.assertEqual(self.journal.backlog(), 1)
+        other.rollback()
+        other.close()
+        self.journal.settle(self.db.replay_sales(self.journal.pending()))
+        self.assertEqual(self.journal.backlog(), 0)
+        self.assertEqual(self.stock(), 4)
+
+    def test_syncer_thread(self):
+        for _ in range(3):
+            self.sell(1)
+        syncer = JournalSyncer(self.path, self.journal.path, batch_size=2, interval=0.05, events=self.db.events)
+        syncer.start()
+        synced = []
+        while len(synced) < 3:
+            synced += syncer.results.get(timeout=5).synced
+        syncer.stop()
+        self.assertEqual(self.stock(), 2)
+        self.assertEqual(self.journal.backlog(), 0)
+
+class TestShardedDatabase(unittest.TestCase):
+    def setUp(self):
+        self.dir = temporary_directory(self)
+        self.db = ShardedDatabase(self.dir, bcrypt_rounds=4, workers=2)
+        self.store1 = self.db.add_store('Store 1', 100.0)
+        self.store2 = self.db.add_store('Store 2', tax_rate=0.1)
+        self.db.add_employee('Alice', 'Smith', 'cashier', self.store1, 'password')
+        self.employee_id = self.db.get_employees()[0].id
+        self.widget = self.db.add_part_to_store('Widget', 10.0, self.store1, 10)
+        self.gadget = self.db.add_part_to_store('Gadget', 20.0, self.store2, 10)
+
+    def tearDown(self):
+        self.db.close_connection()
+
+    def sell(self, pno, store_id, cents, quantity=1):
+        return self.db.create_purchase([PartSold('', quantity, cents, cents * quantity, part_id=pno)], store_id,
+                                       employee_id=self.employee_id)
+
+    def test_one_file_per_store(self):
+        self.assertEqual(sorted(os.listdir(self.dir)), ['catalog.db', 'store_1.db', 'store_2.db'])
+        self.assertEqual(shard_of(self.widget), self.store1)
+        self.assertEqual(shard_of(self.gadget), self.store2)
+        self.assertEqual([p.name for p in self.db.get_parts_by_store(self.store2)], ['Gadget'])
+
+    def test_calls_route_by_store_pno_and_transaction(self):
+        first = self.sell(self.widget, self.store1, 1000, 2)
+        second = self.sell(self.gadget, self.store2, 2000)
+        self.assertEqual((shard_of(first), shard_of(second)), (self.store1, self.store2))
+        self.assertEqual(self.db.get_part_by_id(self.widget).quantity, 8)
+        self.assertEqual(self.db.get_transaction_details(second).total_cents, 2200)
+        self.assertTrue(self.db.update_part(self.gadget, price=25.0))
+        self.assertEqual(self.db.get_parts_by_ids([self.gadget, self.widget])[1].price, 25.0)
+
+    def test_cross_store_queries_merge_shards(self):
+        self.sell(self.widget, self.store1, 1000)
+        self.sell(self.gadget, self.store2, 2000)
+        balances = {store.store_id: store.balance for store in self.db.get_stores()}
+        self.assertEqual(balances, {self.store1: 110.0, self.store2: 22.0})
+        log = self.db.get_transaction_log()
+        self.assertEqual(sorted(entry['store'] for entry in log), ['Store 1', 'Store 2'])
+        self.assertEqual(len(self.db.get_parts()), 2)
+
+    def test_catalog_writes_reach_shards(self):
+        self.db.add_employee('Bob', 'Jones', 'cashier', self.store2, 'password')
+        bob = self.db.get_employees()[1].id
+        self.db.set_store_tax_rate(self.store2, 0.2)
+        sale = self.db.create_purchase([PartSold('', 1, 2000, 2000, part_id=self.gadget)], self.store2, employee_id=bob)
+        self.assertEqual(self.db.get_transaction_details(sale).total_cents, 2400)
+        discount_id = self.db.add_discount('Ten Off', 'percentage', 10)
+        self.assertEqual(len(self.db.shard(self.store1).get_active_discounts(self.store1)), 1)
+        self.db.remove_discount(discount_id)
+        self.assertEqual(self.db.shard(self.store1).get_active_discounts(self.store1), [])
+
+    def test_bulk_calls_split_by_shard(self):
+        self.assertEqual(self.db.update_parts({self.widget: {"price": 11.0}, self.gadget: {"quantity": 7}}), 2)
+        self.assertEqual(self.db.adjust_stock({self.widget: -1, self.gadget: 3}), 2)
+        self.assertEqual([part.quantity for part in self.db.get_parts_by_ids([self.widget, self.gadget])], [9, 10])
+        with self.assertRaises(ValueError):
+            self.db.adjust_stock({self.widget: 5, self.gadget: -50})
+        self.assertEqual([part.quantity for part in self.db.get_parts_by_ids([self.widget, self.gadget])], [9, 10])
+        self.assertEqual(self.db.adjust_prices(100), 2)
+        self.assertEqual([part.price for part in self.db.get_parts_by_ids([self.widget, self.gadget])], [22.0, 40.0])
+
+    def test_store_calls_reach_the_shard(self):
+        self.db.update_store_balance(self.store2, 500)
+        self.assertEqual(self.db.store_balance_cents(self.store2), 500)
+        self.assertEqual({store.store_id: store.balance for store in self.db.get_stores()}[self.store2], 5.0)
+        outcomes = self.db.record_purchases([
+            PurchaseRequest([PartSold('', 1, 2000, 2000, part_id=self.gadget)], self.store2, self.employee_id),
+            PurchaseRequest([PartSold('', 1, 1000, 1000, part_id=self.widget)], self.store1, self.employee_id),
+        ])
+        self.assertEqual([shard_of(outcome.transaction_id) for outcome in outcomes], [self.store2, self.store1])
+        self.assertEqual(self.db.rollup_balances(), 3)
+        with self.assertRaises(AttributeError):
+            self.db.reset_db()
+
+    def test_import_routes_rows_by_their_store(self):
+        source = io.StringIO(f"name,price,quantity,store_id\nBolt,1.00,5,{self.store2}\nNut,0.50,9,\n")
+        report = self.db.import_parts(source, store_id=self.store1, fmt="csv")
+        self.assertEqual((report.inserted, report.rejected), (2, []))
+        bolt = self.db.get_part_by_name('Bolt', self.store2)
+        self.assertEqual(shard_of(bolt.part_id), self.store2)
+        self.assertEqual(shard_of(self.db.get_part_by_name('Nut', self.store1).part_id), self.store1)
+
+        source = io.StringIO(f"name,price,quantity,store_id\nBolt,1.00,6,{self.store2}\nWasher,0.05,1,\n"
+                             f"Washer,0.05,2,\nBolt,1.10,7,{self.store2}\nPin,x,1,\n")
+        report = self.db.import_parts(source, store_id=self.store1, fmt="csv", batch_size=1)
+        self.assertEqual((report.inserted, report.updated), (1, 3))
+        self.assertEqual([(rejected.line, rejected.reason) for rejected in report.rejected], [(6, 'invalid price')])
+        self.assertEqual(self.db.get_part_by_name('Bolt', self.store2).quantity, 7)
+        self.assertEqual(self.db.get_part_by_name('Washer', self.store1).quantity, 2)
+
+    def test_export_and_fan_out_reuse_shards(self):
+        self.sell(self.gadget, self.store2, 2000)
+        connected = []
+        self.db.events.level = INFO
+        self.db.events.add_route(lambda events: connected.extend(e for e in events if e.name == "connected"))
+        export_dir = os.path.join(self.dir, 'export')
+        files = self.db.export(export_dir, workers=2)
+        self.assertEqual(sorted(f.path for f in files if f.table == 'discounts'),
+                         [os.path.join(export_dir, 'discounts.csv')])
+        details = next(f for f in files if f.table == 'transaction_details' and f.store_id == self.store2)
+        self.assertEqual(details.rows, 1)
+        self.assertEqual(self.db.export(export_dir, since_last=True)[0].rows, 0)
+
+        # Each store has one fan-out worker, which opened the shard once for the export
+        self.db.get_stores()
+        self.db.get_stores()
+        self.db.events.flush()
+        self.assertEqual(sorted(event.fields['db'] for event in connected),
+                         [self.db.shard_path(self.store1), self.db.shard_path(self.store2)])
+
+    def test_fan_out_reads_do_not_write(self):
+        lock = sqlite3.connect(self.db.shard_path(self.store1), isolation_level=None, timeout=0)
+        try:
+            lock.execute("BEGIN IMMEDIATE")
+            self.assertEqual(len(self.db.get_stores()), 2)
+        finally:
+            lock.close()
+
+class TestReportingSnapshot(unittest.TestCase):
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp(suffix='.db')
+        os.close(fd)
+        self.db = Database(self.path, bcrypt_rounds=4)
+        self.db.add_store('Store 1')
+        self.db.add_employee('Alice', 'Smith', 'cashier', 1, 'password')
+        self.widget = self.db.add_part_to_store('Widget', 10.0, 1, 100)
+        for _ in range(3):
+            self.sell()
+
+    def tearDown(self):
+        self.db.close_connection()
+        os.remove(self.path)
+
+    def sell(self):
+        return self.db.create_purchase([PartSold('Widget', 1, 1000, 1000, part_id=self.widget)], 1)
+
+    def test_snapshot_is_reused_until_max_age(self):
+        snapshot = self.db.reporting()
+        self.sell()
+        self.assertIs(self.db.reporting(), snapshot)
+        self.assertEqual(len(snapshot.SalesReport(1)), 3)
+        self.assertEqual(len(self.db.reporting(max_age=0).SalesReport(1)), 4)
+        self.assertIsNone(self.db.snapshot_age)
+        self.assertLess(snapshot.snapshot_age, 5)
+
+    def test_snapshot_is_read_only(self):
+        with self.assertRaises(sqlite3.OperationalError):
+            self.db.reporting().conn.execute("DELETE FROM transactions")
+
+    def test_report_header_shows_age(self):
+        header = next(self.db.reporting().sales_report_lines(1)).splitlines()
+        self.assertTrue(header[1].startswith("Data as of "))
+        self.assertIn("snapshot", header[1])
+        self.assertEqual(next(self.db.sales_report_lines(1)), "Sales Report for Store ID 1\n\n")
+
+    def test_open_report_does_not_block_checkout(self):
+        """A half-read report holds no lock on the file other registers write to."""
+        lines = self.db.reporting().sales_report_lines(1, chunk_size=1)
+        next(lines)
+        other = sqlite3.connect(self.path, timeout=0)
+        other.execute("UPDATE parts SET quantity = 50")
+        other.commit()
+        other.close()
+        lines.close()
+
+class TestBackupScheduler(unittest.TestCase):
+    def setUp(self):
+        self.dir = temporary_directory(self)
+        self.path = os.path.join(self.dir, 'pos.db')
+        self.db = Database(self.path, bcrypt_rounds=4)
+        self.db.add_store('Store 1')
+        self.db.cursor.executemany(
+            "INSERT INTO parts (name, price_cents, store_id, quantity) VALUES (?, 100, 1, 10)",
+            [(f"Part {i} " + "x" * 200,) for i in range(2000)]
+        )
+        self.db.conn.commit()
+        self.backup_dir = os.path.join(self.dir, 'backups')
+        self.scheduler = BackupScheduler(self.path, self.backup_dir, keep=2, pages=8, sleep=0, events=self.db.events)
+
+    def tearDown(self):
+        self.db.close_connection()
+
+    def test_backup_is_complete_and_checked(self):
+        result = self.scheduler.backup_now()
+        self.assertTrue(result.ok)
+        self.assertGreater(result.pages, 8)
+        self.assertEqual(self.scheduler.progress, (result.pages, result.pages))
+        copy = sqlite3.connect(result.path)
+        self.assertEqual(copy.execute("SELECT COUNT(*) FROM parts").fetchone()[0], 2000)
+        copy.close()
+
+    def test_rotation_keeps_newest(self):
+        results = [self.scheduler.backup_now() for _ in range(3)]
+        self.assertEqual(self.scheduler.backups(), [results[1].path, results[2].path])
+
+    def test_writes_proceed_during_backup(self):
+        """Between steps the source is unlocked, so a register can commit a sale."""
+        def write_once(status, remaining, total):
+            progress(status, remaining, total)
+            if not written:
+                other = sqlite3.connect(self.path, timeout=0)
+                other.execute("UPDATE parts SET quantity = 9 WHERE pno = 1")
+                other.commit()
+                other.close()
+                written.append(True)
+        written = []
+        progress, self.scheduler._on_progress = self.scheduler._on_progress, write_once
+        result = self.scheduler.backup_now()
+        self.assertTrue(result.ok and written)
+        copy = sqlite3.connect(result.path)
+        self.assertEqual(copy.execute("SELECT quantity FROM parts WHERE pno = 1").fetchone()[0], 9)
+        copy.close()
+
+    def test_scheduled_backup(self):
+        self.scheduler.interval = 60
+        self.scheduler.start()
+        self.scheduler.request_backup()
+        deadline = time.time() + 5
+        while self.scheduler.last_result is None and time.time() < deadline:
+            time.sleep(0.01)
+        self.scheduler.stop()
+        self.assertTrue(self.scheduler.last_result.ok)
+
+class TestStatementRegistry(unittest.TestCase):
+    def setUp(self):
+        self.db = Database(':memory:', bcrypt_rounds=4)
+        self.db.add_store('Store 1')
+        self.db.add_employee('Alice', 'Smith', 'cashier', 1, 'password')
+        self.widget = self.db.add_part_to_store('Widget', 10.0, 1, 100)
+
+    def tearDown(self):
+        self.db.close_connection()
+
+    def test_repeated_checkouts_hit_the_cache(self):
+        sale = [PartSold('Widget', 1, 1000, 1000, part_id=self.widget)]
+        self.db.create_purchase(sale, 1)
+        first_uses = self.db.statement_stats().first_uses
+        for _ in range(5):
+            self.db.create_purchase(sale, 1)
+        stats = self.db.statement_stats()
+        self.assertEqual(stats.first_uses, first_uses)
+        self.assertGreater(stats.runs, 5)
+
+    def test_transaction_log_variants_are_static(self):
+        self.db.create_purchase([PartSold('Widget', 1, 1000, 1000, part_id=self.widget)], 1)
+        first_uses = self.db.statement_stats().first_uses
+        for _ in range(2):
+            self.assertEqual(len(self.db.get_transaction_log()), 1)
+            self.assertEqual(len(self.db.get_transaction_log(store_id=1, start_date='2000-01-01')), 1)
+            self.assertEqual(self.db.get_transaction_log(end_date='2000-01-01'), [])
+        self.assertEqual(self.db.statement_stats().first_uses, first_uses + 3)
+
+    def test_parts_by_ids_is_one_statement(self):
+        pnos = [self.db.add_part_to_store(f'Part {i}', 1.0, 1, 1) for i in range(5)]
+        first_uses = self.db.statement_stats().first_uses
+        self.assertEqual([p.part_id for p in self.db.get_parts_by_ids(pnos[::-1] + pnos[:1])], pnos)
+        self.db.get_parts_by_ids(pnos[:2])
+        self.assertEqual(self.db.statement_stats().first_uses, first_uses + 1)
+
+    def test_price_filters_are_static(self):
+        gadget = self.db.add_part_to_store('Gadget', 20.0, 1, 100)
+        first_uses = self.db.statement_stats().first_uses
+        self.assertEqual(self.db.adjust_prices(10, pnos=[self.widget]), 1)
+        self.assertEqual(self.db.adjust_prices(10, pnos=[self.widget, gadget]), 2)
+        self.assertEqual(self.db.adjust_prices(10, pnos=[]), 0)
+        self.assertEqual(self.db.statement_stats().first_uses, first_uses + 1)
+        self.assertEqual([p.price for p in self.db.get_parts_by_ids([self.widget, gadget])], [12.1, 22.0])
+
+    def test_registry_fits_the_cache(self):
+        self.assertLessEqual(len(STATEMENTS), self.db.statement_stats().cache_size)
+
+class TestGroupCommitWriter(unittest.TestCase):
+    def setUp(self):
+        self.dir = temporary_directory(self)
+        self.path = os.path.join(self.dir, 'pos.db')
+        self.db = Database(self.path, bcrypt_rounds=4)
+        self.db.add_store('Store 1')
+        self.db.add_employee('Alice', 'Smith', 'cashier', 1, 'password')
+        self.widget = self.db.add_part_to_store('Widget', 10.0, 1, 100)
+        self.writer = GroupCommitWriter(self.path, window=0.05, events=self.db.events).start()
+
+    def tearDown(self):
+        self.writer.stop()
+        self.db.close_connection()
+
+    def sale(self, quantity=1):
+        return [PartSold('Widget', quantity, 1000, 1000 * quantity, part_id=self.widget)]
+
+    def test_concurrent_purchases_share_commits(self):
+        futures = []
+        def register():
+            for _ in range(10):
+                futures.append(self.writer.submit(self.sale(), 1))
+        threads = [threading.Thread(target=register) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        ids = [future.result(timeout=5) for future in futures]
+        self.assertEqual(len(set(ids)), 40)
+        self.assertLess(self.writer.groups, 40)
+        self.assertEqual(self.db.get_part_by_id(self.widget).quantity, 60)
+        self.assertEqual(self.db.get_stores()[0].balance, 400.0)
+
+    def test_failure_is_per_purchase(self):
+        ok = self.writer.submit(self.sale(), 1)
+        short = self.writer.submit(self.sale(1000), 1)
+        with self.assertRaises(Exception):
+            short.result(timeout=5)
+        self.assertIsNotNone(ok.result(timeout=5))
+        self.assertEqual(self.db.get_part_by_id(self.widget).quantity, 99)
+
+    def test_stop_drains_queue(self):
+        futures = [self.writer.submit(self.sale(), 1) for _ in range(5)]
+        self.writer.stop()
+        self.assertTrue(all(future.done() for future in futures))
+        with self.assertRaises(RuntimeError):
+            self.writer.submit(self.sale(), 1)
+
+    def test_submit_racing_stop_is_never_lost(self):
+        accepted = []
+        def register():
+            try:
+                while True:
+                    accepted.append(self.writer.submit(self.sale(), 1))
+            except RuntimeError:
+                pass
+        threads = [threading.Thread(target=register) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        time.sleep(0.02)
+        self.writer.stop()
+        for thread in threads:
+            thread.join()
+        self.assertTrue(accepted)
+        self.assertTrue(all(future.done() for future in accepted))
+
+class TestConcurrentStock(unittest.TestCase):
+    def setUp(self):
+        self.dir = temporary_directory(self)
+        self.path = os.path.join(self.dir, 'pos.db')
+        self.db = Database(self.path, bcrypt_rounds=4)
+        self.db.add_store('Store 1')
+        self.db.add_employee('Alice', 'Smith', 'cashier', 1, 'password')
+        self.widget = self.db.add_part_to_store('Widget', 10.0, 1, 50)
+
+    def tearDown(self):
+        self.db.close_connection()
+
+    def test_registers_never_oversell(self):
+        """Eight registers race for 50 units; stock ends at 0 and exactly 50 units were paid for."""
+        seen = []
+        def register(by_name):
+            db = Database(self.path, events=self.db.events)
+            for _ in range(20):
+                if by_name:
+                    db.purchase_part('Widget', 1, 1)
+                else:
+                    db.create_purchase([PartSold('Widget', 1, 1000, 1000, part_id=self.widget)], 1)
+                seen.append(db.get_part_by_id(self.widget).quantity)
+            db.close_connection()
+        threads = [threading.Thread(target=register, args=(i % 2 == 0,)) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(seen), 160)
+        self.assertGreaterEqual(min(seen), 0)
+        self.assertEqual(self.db.get_part_by_id(self.widget).quantity, 0)
+        self.assertEqual(self.db.get_stores()[0].balance, 500.0)
+
+    def test_short_stock_changes_nothing(self):
+        self.db.purchase_part_by_pno([{'pno': self.widget, 'quantity': 51}], 1)
+        self.assertEqual(self.db.get_part_by_id(self.widget).quantity, 50)
+        self.assertEqual(self.db.get_stores()[0].balance, 0.0)
+
+class TestBalanceLedger(unittest.TestCase):
+    def setUp(self):
+        self.db = Database(':memory:', bcrypt_rounds=4)
+        self.db.add_store('Store 1', 100.0)
+        self.db.add_store('Store 2')
+        self.db.add_employee('Admin', 'User', 'admin', 1, 'password')
+        self.widget = self.db.add_part_to_store('Widget', 10.0, 1, 100)
+
+    def tearDown(self):
+        self.db.close_connection()
+
+    def sell(self, quantity=1):
+        return self.db.create_purchase([PartSold('Widget', quantity, 1000, 1000 * quantity, part_id=self.widget)], 1)
+
+    def rolled_up(self, store_id):
+        return self.db.cursor.execute(
+            "SELECT balance_cents, ledger_rolled_up_to FROM stores WHERE store_id = ?", (store_id,)
+        ).fetchone()
+
+    def test_sales_append_instead_of_rewriting_the_store(self):
+        sale = self.sell(2)
+        self.sell()
+        self.assertEqual(self.rolled_up(1), (10000, 0))
+        entries = self.db.cursor.execute("SELECT store_id, amount_cents, transaction_id FROM balance_ledger").fetchall()
+        self.assertEqual(entries[0], (1, 2000, sale))
+        self.assertEqual(self.db.store_balance_cents(1), 13000)
+        self.assertEqual(self.db.get_stores()[0].balance, 130.0)
+
+    def test_rollup_plus_tail(self):
+        self.sell()
+        self.assertEqual(self.db.rollup_balances(), 1)
+        self.assertEqual(self.rolled_up(1), (11000, 1))
+        self.db.return_by_transaction_id(self.sell(3), 1)
+        self.assertEqual(self.db.store_balance_cents(1), 11000)
+        self.assertEqual(self.db.rollup_balances(), 2)
+        self.assertEqual(self.db.rollup_balances(), 0)
+        self.assertEqual(self.rolled_up(1), (11000, 3))
+        self.assertEqual([store.balance for store in self.db.get_stores()], [110.0, 0.0])
+
+    def test_reads_never_fold_the_ledger(self):
+        for _ in range(3):
+            self.sell()
+        self.assertEqual([store.balance for store in self.db.get_stores()], [130.0, 0.0])
+        self.assertEqual(self.rolled_up(1), (10000, 0))
+
+    def test_rollup_leaves_open_and_read_only_transactions_alone(self):
+        self.sell()
+        self.db.cursor.execute("INSERT INTO stores (store_name) VALUES ('Pending')")
+        self.assertEqual(self.db.rollup_balances(), 0)
+        self.assertTrue(self.db.conn.in_transaction)
+        self.db.conn.rollback()
+        self.assertEqual(len(self.db.get_stores()), 2)
+
+        failures = []
+        self.db.events.add_route(lambda events: failures.extend(e for e in events if e.level >= ERROR))
+        self.assertEqual(self.db.reporting().rollup_balances(), 0)
+        self.db.events.flush()
+        self.assertEqual(failures, [])
+        self.assertEqual(self.db.rollup_balances(), 1)
+
+    def test_update_store_balance_is_a_ledger_entry(self):
+        self.db.update_store_balance(2, 550, is_addition=False)
+        self.assertEqual(self.rolled_up(2), (0, 0))
+        self.assertEqual(self.db.store_balance_cents(2), -550)
+
+class TestBatchReturns(unittest.TestCase):
+    def setUp(self):
+        self.db = Database(':memory:', bcrypt_rounds=4)
+        self.db.add_store('Store 1', tax_rate=0.1)
+        self.db.add_employee('Admin', 'User', 'admin', 1, 'password')
+        self.db.add_employee('Clerk', 'User', 'clerk', 1, 'password')
+        self.widget = self.db.add_part_to_store('Widget', 10.0, 1, 100)
+        self.gadget = self.db.add_part_to_store('Gadget', 2.5, 1, 100)
+        self.half_off = self.db.add_discount('Half off', 'percentage', 50)
+
+    def tearDown(self):
+        self.db.close_connection()
+
+    def sell(self, widgets, gadgets, discount_id=None):
+        return self.db.create_purchase([
+            PartSold('Widget', widgets, 1000, 1000 * widgets, part_id=self.widget),
+            PartSold('Gadget', gadgets, 250, 250 * gadgets, part_id=self.gadget),
+        ], 1, discount_id=discount_id)
+
+    def quantities(self):
+        return [part.quantity for part in self.db.get_parts_by_ids([self.widget, self.gadget])]
+
+    def test_returns_many_receipts_at_once(self):
+        first, second = self.sell(2, 4), self.sell(1, 2, discount_id=self.half_off)
+        self.assertEqual(self.quantities(), [97, 94])
+        returned = self.db.return_transactions([first, second, 999], 1)
+        self.assertEqual(set(returned), {first, second})
+        self.assertEqual(self.quantities(), [100, 100])
+        self.assertEqual(self.db.get_transaction_details(returned[first]).total_cents, -3300)
+        self.assertEqual(self.db.get_transaction_details(returned[second]).total_cents, -825)
+        logged = self.db.cursor.execute(
+            "SELECT original_transaction_id, refund_cents FROM returns ORDER BY return_id").fetchall()
+        self.assertEqual(logged, [(first, 3300), (second, 825)])
+        self.assertEqual(self.db.store_balance_cents(1), 0)
+
+    def test_single_return_delegates(self):
+        sale = self.sell(1, 0)
+        self.assertIsNotNone(self.db.return_by_transaction_id(sale, 1))
+        self.assertIsNone(self.db.return_by_transaction_id(999, 1))
+        with self.assertRaises(Exception) as context:
+            self.db.return_transactions([sale], 2)
+        self.assertEqual(str(context.exception), "Admin access required for returns")
+
+    def test_partial_returns_track_what_is_left(self):
+        sale = self.sell(3, 4)
+        first = self.db.return_lines(sale, {self.widget: 1}, 1)
+        self.assertEqual(self.db.get_transaction_details(first).total_cents, -1100)
+        self.assertEqual([(line.part_id, line.quantity) for line in self.db.returnable_lines(sale)],
+                         [(self.widget, 2), (self.gadget, 4)])
+        self.assertIsNone(self.db.return_lines(sale, {self.widget: 3}, 1))
+        self.assertEqual(self.quantities(), [98, 96])
+
+        rest = self.db.return_by_transaction_id(sale, 1)
+        self.assertEqual(self.db.get_transaction_details(rest).total_cents, -3300)
+        self.assertEqual(self.db.returnable_lines(sale), [])
+        self.assertIsNone(self.db.return_by_transaction_id(sale, 1))
+        self.assertEqual(self.quantities(), [100, 100])
+
+    def test_partial_return_prorates_fixed_discount(self):
+        five_off = self.db.add_discount('Five off', 'fixed', 5)
+        sale = self.sell(1, 4, discount_id=five_off)
+        first = self.db.return_lines(sale, {self.widget: 1}, 1)
+        second = self.db.return_lines(sale, {self.gadget: 4}, 1)
+        refunds = [self.db.get_transaction_details(t).total_cents for t in (first, second)]
+        self.assertEqual(refunds, [-825, -825])
+
+    def test_unit_by_unit_refunds_add_up_to_what_was_paid(self):
+        self.db.cursor.execute("UPDATE stores SET tax_rate = 0.0825 WHERE store_id = 1")
+        third_off = self.db.add_discount('Third off', 'percentage', 33)
+        sale = self.db.create_purchase([
+            PartSold('Widget', 7, 139, line_total(139, 7, 0.15), 0.15, part_id=self.widget),
+            PartSold('Gadget', 3, 77, 231, part_id=self.gadget),
+        ], 1, discount_id=third_off)
+        paid = self.db.get_transaction_details(sale).total_cents
+        refunds = []
+        for pno in [self.widget] * 7 + [self.gadget] * 3:
+            refunds.append(-self.db.get_transaction_details(self.db.return_lines(sale, {pno: 1}, 1)).total_cents)
+        self.assertEqual(sum(refunds), paid)
+        logged = self.db.cursor.execute("SELECT SUM(refund_cents) FROM returns WHERE original_transaction_id = ?",
+                                        (sale,)).fetchone()[0]
+        self.assertEqual(logged, paid)
+        self.assertEqual(self.db.store_balance_cents(1), 0)
+
+    def test_upgrade_links_existing_returns(self):
+        sale = self.sell(2, 1)
+        self.db.return_by_transaction_id(sale, 1)
+        self.db.cursor.execute("DROP INDEX idx_transaction_details_returned")
+        self.db.cursor.execute("ALTER TABLE transaction_details DROP COLUMN returned_detail_id")
+        self.db.conn.commit()
+        self.db.create_tables()
+        self.assertEqual(self.db.returnable_lines(sale), [])
+        plan = self.db.cursor.execute("EXPLAIN QUERY PLAN " + STATEMENTS["returnable_lines"], ("[1]",)).fetchall()
+        self.assertIn("idx_transaction_details_returned", " ".join(row[-1] for row in plan))
+
+class TestLineSnapshot(unittest.TestCase):
+    def setUp(self):
+        self.db = Database(':memory:', bcrypt_rounds=4)
+        self.db.add_store('Store 1', tax_rate=0.1)
+        self.db.add_employee('Admin', 'User', 'admin', 1, 'password')
+        self.widget = self.db.add_part_to_store('Widget', 10.0, 1, 100)
+
+    def tearDown(self):
+        self.db.close_connection()
+
+    def test_history_keeps_sale_price_and_name(self):
+        sale = self.db.create_purchase([PartSold('Widget', 2, 1000, 2000, 0.25, part_id=self.widget)], 1)
+        self.db.update_part(self.widget, name='Gizmo', price=15.0)
+        line = self.db.get_transaction_details(sale).parts_sold[0]
+        self.assertEqual((line.name, line.unit_cents, line.discount_percent, line.total_cents),
+                         ('Widget', 1000, 0.25, 1500))
+        report = "".join(self.db.sales_report_lines(1))
+        self.assertIn("Widget: 2 @ $10.00 each (Total: $15.00)", report)
+        self.assertEqual(self.db.SalesReport(1)[0].parts_sold[0].name, 'Widget')
+
+        refund = self.db.get_transaction_details(self.db.return_by_transaction_id(sale, 1))
+        self.assertEqual(refund.total_cents, -1650)
+
+    def test_receipt_keeps_discount_and_tax_as_sold(self):
+        half_off = self.db.add_discount('Half off', 'percentage', 50)
+        sale = self.db.create_purchase([PartSold('Widget', 2, 1000, 2000, part_id=self.widget)], 1,
+                                       discount_id=half_off)
+        self.db.remove_discount(half_off)
+        self.db.cursor.execute("UPDATE stores SET tax_rate = 0.2 WHERE store_id = 1")
+        self.db.update_part(self.widget, name='Gizmo')
+        details = self.db.get_transaction_details(sale)
+        self.assertEqual((details.subtotal_cents, details.discount_cents, details.tax_cents, details.total_cents),
+                         (2000, 1000, 100, 1100))
+        self.assertEqual(self.db.SalesReport(1)[0].discount_cents, 1000)
+        self.assertIn("(-$10.00)", "".join(self.db.sales_report_lines(1)))
+        self.assertEqual(self.db.top_items(1), [(self.widget, 'Widget', 2)])
+
+        first = self.db.get_transaction_details(self.db.return_lines(sale, {self.widget: 1}, 1))
+        self.assertEqual((first.subtotal_cents, first.discount_cents, first.tax_cents, first.total_cents),
+                         (-1000, -500, -50, -550))
+        rest = self.db.get_transaction_details(self.db.return_by_transaction_id(sale, 1))
+        self.assertEqual(rest.total_cents, -550)
+
+    def test_upgrade_backfills_discount_and_tax(self):
+        ten_off = self.db.add_discount('Ten off', 'fixed', 10)
+        sale = self.db.create_purchase([PartSold('Widget', 3, 1000, 3000, part_id=self.widget)], 1,
+                                       discount_id=ten_off)
+        for column in ("discount_cents", "tax_cents"):
+            self.db.cursor.execute(f"ALTER TABLE transactions DROP COLUMN {column}")
+        self.db.conn.commit()
+        self.db.create_tables()
+        details = self.db.get_transaction_details(sale)
+        self.assertEqual((details.discount_cents, details.tax_cents, details.total_cents), (1000, 200, 2200))
+
+    def test_lines_without_snapshot_take_current_price(self):
+        self.db.purchase_part_by_pno([{'pno': self.widget, 'quantity': 3}], 1)
+        row = self.db.cursor.execute(
+            "SELECT part_name, unit_cents, line_cents FROM transaction_details").fetchone()
+        self.assertEqual(row, ('Widget', 1000, 3000))
+
+    def test_upgrade_backfills_lines(self):
+        sale = self.db.create_purchase([PartSold('Widget', 2, 1000, 2000, part_id=self.widget)], 1)
+        self.db.cursor.execute("DROP INDEX idx_transaction_details_lines")
+        self.db.cursor.execute("DROP TRIGGER update_total_price")
+        for column in Database.LINE_SNAPSHOT_COLUMNS:
+            self.db.cursor.execute(f"ALTER TABLE transaction_details DROP COLUMN {column}")
+        self.db.conn.commit()
+        self.db.create_tables()
+        self.assertEqual(self.db.get_transaction_details(sale).parts_sold[0].total_cents, 2000)
+        plan = self.db.cursor.execute("EXPLAIN QUERY PLAN " + STATEMENTS["transaction_lines"], (sale,)).fetchall()
+        self.assertIn("COVERING INDEX idx_transaction_details_lines", plan[0][-1])
+
+class TestLoginService(unittest.TestCase):
+    def setUp(self):
+        self.db = Database(':memory:', bcrypt_rounds=4)
+        self.db.add_store('Test Store')
+        store_id = self.db.get_stores()[0][0]
+        self.db.add_employee('Alice', 'Smith', 'Clerk', store_id, 'securepassword')
+        self.service = LoginService(self.db)
+
+    def tearDown(self):
+        self.service.shutdown()
+        self.db.close_connection()
+
+    def test_login_issues_session(self):
+        """A successful login returns a live session token."""
+        session = self.service.login('Alice', 'Smith', 'securepassword')
+        self.assertEqual(session.role, 'Clerk')
+        self.assertIs(self.service.validate(session.token), session)
+
+        self.service.logout(session.token)
+        self.assertIsNone(self.service.validate(session.token))
+
+    def test_login_failures(self):
+        """Wrong passwords and unknown employees raise the same errors as employee_login."""
+        with self.assertRaises(Exception) as context:
+            self.service.login('Alice', 'Smith', 'wrongpassword')
+        self.assertEqual(str(context.exception), "Incorrect password.")
+
+        with self.assertRaises(Exception) as context:
+            self.service.login_async('NonExistent', 'User', 'password').result()
+        self.assertEqual(str(context.exception), "Employee not found.")
+
+    def test_relogin_uses_cached_session(self):
+        """Logging in again within the session lifetime skips bcrypt."""
+        first = self.service.login('Alice', 'Smith', 'securepassword')
+        relogin = self.service.login_async('Alice', 'Smith', 'securepassword')
+        self.assertTrue(relogin.done())
+        self.assertIs(relogin.result(), first)
+
+        with self.assertRaises(Exception):
+            self.service.login('Alice', 'Smith', 'wrongpassword')
+
+    def test_expired_session_is_not_reused(self):
+        """Sessions stop validating once their lifetime has passed."""
+        self.service.session_ttl = 0
+        session = self.service.login('Alice', 'Smith', 'securepassword')
+        self.assertIsNone(self.service.validate(session.token))
+
+    def test_rehash_on_cost_change(self):
+        """Raising the cost factor upgrades the stored hash at the next login."""
+        self.db.bcrypt_rounds = 5
+        self.service.login('Alice', 'Smith', 'securepassword')
+        _, stored_hash, _ = self.db.find_employee_credentials('Alice', 'Smith')
+        self.assertEqual(bcrypt_rounds_of(stored_hash), 5)
+
+        role, _ = self.db.employee_login('Alice', 'Smith', 'securepassword')
+        self.assertEqual(role, 'Clerk')
+
+    def test_name_lookup_uses_index(self):
+        """The login lookup is served by the employee name index."""
+        plan = self.db.cursor.execute(
+            "EXPLAIN QUERY PLAN SELECT id, password_hash, role FROM employees WHERE first_name = ? AND last_name = ?",
+            ('Alice', 'Smith')
+        ).fetchall()
+        self.assertIn('idx_employees_name', str(plan))
+
+class TestEventSink(unittest.TestCase):
+    def test_events_below_level_are_dropped(self):
+        """Events under the sink level never reach a route."""
+        received = []
+        sink = EventSink(level=WARNING, routes=[(DEBUG, received.extend)])
+        sink.emit(INFO, "ignored", value=1)
+        sink.emit(ERROR, "kept", value=2)
+        sink.flush()
+        sink.close()
+        self.assertEqual([event.name for event in received], ["kept"])
+        self.assertEqual(received[0].fields, {"value": 2})
+
+    def test_routes_filter_by_level(self):
+        """Each route only receives events at or above its own level."""
+        everything, errors = [], []
+        sink = EventSink(level=DEBUG, routes=[(DEBUG, everything.extend), (ERROR, errors.extend)])
+        sink.emit(INFO, "info_event")
+        sink.emit(ERROR, "error_event")
+        sink.close()
+        self.assertEqual(len(everything), 2)
+        self.assertEqual([event.name for event in errors], ["error_event"])
+
+    def test_closed_sinks_are_released(self):
+        """A closed sink is not held by the exit hook."""
+        sink = EventSink(level=DEBUG, routes=[(DEBUG, lambda events: None)])
+        sink.emit(INFO, "started")
+        sink.close()
+        released = threading.Event()
+        weakref.finalize(sink, released.set)
+        del sink
+        gc.collect()
+        self.assertTrue(released.is_set())
+
+    def test_json_lines_route(self):
+        """The JSON route writes one parseable object per event."""
+        stream = io.StringIO()
+        sink = EventSink(level=INFO, routes=[(INFO, StreamRoute(stream, json_lines=True))])
+        db = Database(':memory:', events=sink)
+        db.add_store('Test Store')
+        db.close_connection()
+        sink.close()
+        records = [json.loads(line) for line in stream.getvalue().splitlines()]
+        store_added = next(r for r in records if r["event"] == "store_added")
+        self.assertEqual(store_added["level"], "INFO")
+        self.assertEqual(store_added["store_name"], "Test Store")
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
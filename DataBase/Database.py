@@ -1,72 +1,757 @@
 import sqlite3
 import bcrypt
-from dataclasses import dataclass
-from typing import List
+import atexit
+import csv
+import inspect
+import hmac
+import json
+import os
+import pathlib
+import queue
+import secrets
+import sys
+import threading
+import time
+import weakref
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from datetime import datetime
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+from typing import Callable, Dict, Iterator, List, NamedTuple
+
+try:
+    # Only the columnar analytics (Database.sales_frame) need numpy and pandas
+    import numpy as np
+    import pandas as pd
+except ImportError:
+    np = pd = None
+
+# Event levels, numerically compatible with the logging module
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+LEVEL_NAMES = {DEBUG: "DEBUG", INFO: "INFO", WARNING: "WARNING", ERROR: "ERROR"}
+
+# bcrypt work factor for new password hashes; existing hashes are upgraded on login
+DEFAULT_BCRYPT_ROUNDS = 12
+
+def bcrypt_rounds_of(password_hash) -> int:
+    """Return the cost factor encoded in a bcrypt hash ($2b$<rounds>$...)."""
+    if isinstance(password_hash, str):
+        password_hash = password_hash.encode()
+    return int(password_hash.split(b"$")[2])
 
 @dataclass
+class Event:
+    timestamp: float
+    level: int
+    name: str
+    fields: dict = field(default_factory=dict)
+
+    def to_text(self) -> str:
+        """Render the event as a single human-readable line."""
+        stamp = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(self.timestamp))
+        details = " ".join(f"{key}={value}" for key, value in self.fields.items())
+        return f"{stamp} {LEVEL_NAMES.get(self.level, self.level)} {self.name} {details}".rstrip()
+
+    def to_json(self) -> str:
+        """Render the event as a single JSON object."""
+        record = {"ts": self.timestamp, "level": LEVEL_NAMES.get(self.level, self.level), "event": self.name}
+        record.update(self.fields)
+        return json.dumps(record, default=str)
+
+class StreamRoute:
+    """Route that writes events to a text stream, either as plain text or JSON lines."""
+
+    def __init__(self, stream=None, json_lines: bool = False):
+        self.stream = stream
+        self.json_lines = json_lines
+
+    def __call__(self, events: List[Event]):
+        stream = self.stream or sys.stderr
+        render = Event.to_json if self.json_lines else Event.to_text
+        stream.write("".join(render(event) + "\n" for event in events))
+        stream.flush()
+
+class EventSink:
+    """
+    Level-gated, buffered sink for structured database events.
+
+    Events below `level` are dropped before an Event is built or queued; callers with
+    costly fields can check `enabled` first. Events that pass the gate are queued and
+    handed to their routes in batches by a background thread, so callers never block
+    on output.
+
+    Args:
+        level (int): Minimum level that is recorded at all, defaults to WARNING.
+        routes (list): (min_level, handler) pairs. A handler receives a list of Events.
+    """
+    _STOP = object()
+
+    def __init__(self, level: int = WARNING, routes=None):
+        self.level = level
+        self.routes = [(DEBUG, StreamRoute())] if routes is None else list(routes)
+        self._queue = queue.SimpleQueue()
+        self._worker = None
+        self._lock = threading.Lock()
+
+    def enabled(self, level: int) -> bool:
+        """Return True if events at this level would be recorded."""
+        return level >= self.level
+
+    def add_route(self, handler: Callable[[List[Event]], None], level: int = DEBUG):
+        """Send every recorded event at or above `level` to `handler`."""
+        self.routes.append((level, handler))
+
+    def emit(self, level: int, name: str, /, **fields):
+        """Record an event if its level passes the gate."""
+        if level < self.level:
+            return
+        self._queue.put(Event(time.time(), level, name, fields))
+        if self._worker is None:
+            self._start()
+
+    def flush(self, timeout: float = 5.0):
+        """Block until every event queued so far has been delivered."""
+        if self._worker is None:
+            return
+        done = threading.Event()
+        self._queue.put(done)
+        done.wait(timeout)
+
+    def close(self):
+        """Deliver pending events and stop the background thread."""
+        with self._lock:
+            worker, self._worker = self._worker, None
+            _running_sinks.discard(self)
+        if worker is not None:
+            self._queue.put(self._STOP)
+            worker.join()
+
+    def _start(self):
+        with self._lock:
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._run, name="event-sink", daemon=True)
+                self._worker.start()
+                _running_sinks.add(self)
+
+    def _run(self):
+        while True:
+            batch, markers, stop = [], [], False
+            item = self._queue.get()
+            while True:
+                if item is self._STOP:
+                    stop = True
+                elif isinstance(item, threading.Event):
+                    markers.append(item)
+                else:
+                    batch.append(item)
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+            if batch:
+                self._deliver(batch)
+            for marker in markers:
+                marker.set()
+            if stop:
+                return
+
+    def _deliver(self, batch: List[Event]):
+        for min_level, handler in self.routes:
+            events = [event for event in batch if event.level >= min_level]
+            if events:
+                try:
+                    handler(events)
+                except Exception:
+                    pass
+
+# Sinks with a running worker, closed by one exit hook. Weak, so a sink that was closed
+# (or dropped with its Database) is not kept alive until interpreter exit.
+_running_sinks = weakref.WeakSet()
+
+@atexit.register
+def _close_running_sinks():
+    for sink in list(_running_sinks):
+        sink.close()
+
+# Money is carried as integer cents from the schema to the receipt. Rates (tax,
+# discount percentages) are applied in basis points with half-up rounding, so every
+# report that sums the same rows gets the same total.
+SCHEMA_VERSION = 1
+
+# Seconds a reporting snapshot is reused before it is copied again (Database.reporting)
+REPORT_SNAPSHOT_MAX_AGE = 60.0
+
+def to_cents(dollars) -> int:
+    """Convert a dollar amount (float, str or Decimal) to integer cents, rounding half up."""
+    return int(Decimal(str(dollars)).scaleb(2).quantize(Decimal(1), ROUND_HALF_UP))
+
+def to_dollars(cents: int) -> float:
+    """Convert integer cents to a float dollar amount for display."""
+    return cents / 100
+
+def basis_points(rate: float) -> int:
+    """Convert a decimal rate (e.g. 0.0825) to basis points (825)."""
+    return int(Decimal(str(rate)).scaleb(4).quantize(Decimal(1), ROUND_HALF_UP))
+
+def apply_rate(cents: int, bps: int) -> int:
+    """Return `cents` * `bps` / 10000, rounded half away from zero, in integer math."""
+    numerator = abs(cents) * bps
+    result = (numerator * 2 + 10000) // 20000
+    return -result if cents < 0 else result
+
+# Row types read in bulk (Part, PartSold, TransactionDetails) are slotted dataclasses:
+# no per-instance __dict__, which matters when a SalesReport holds every line of a store.
+@dataclass(slots=True)
 class PartSold:
     name: str
     quantity: int
-    unit_price: float
-    total_price: float
+    unit_cents: int
+    total_cents: int
     discount_percent: float = 0.0
-    discounted_price: float = None
+    part_id: int = None
+
+    @property
+    def unit_price(self) -> float:
+        return to_dollars(self.unit_cents)
+
+    @property
+    def total_price(self) -> float:
+        return to_dollars(self.total_cents)
 
-    def __post_init__(self):
-        """Format monetary values after initialization."""
-        self.unit_price = round(self.unit_price, 2)
-        self.total_price = round(self.total_price, 2)
+    @property
+    def discounted_price(self) -> float:
         if self.discount_percent > 0:
-            self.discounted_price = round(self.total_price * (1 - self.discount_percent), 2)
+            return to_dollars(self.total_cents - apply_rate(self.total_cents, basis_points(self.discount_percent)))
+        return None
 
-@dataclass
+@dataclass(slots=True)
 class TransactionDetails:
     transaction_id: int
     date: str
-    total_price: float
+    total_cents: int
     employee: str
     store: str
     parts_sold: List[PartSold]
-    subtotal: float = 0.0
-    discount_amount: float = 0.0
-    tax_amount: float = 0.0
+    subtotal_cents: int = 0
+    discount_cents: int = 0
+    tax_cents: int = 0
     discount_id: int = None
     discount_name: str = None
 
-    def __post_init__(self):
-        """Format monetary values after initialization."""
-        self.total_price = round(self.total_price, 2)
-        self.subtotal = round(self.subtotal, 2)
-        self.discount_amount = round(self.discount_amount, 2)
-        self.tax_amount = round(self.tax_amount, 2)
+    @property
+    def total_price(self) -> float:
+        return to_dollars(self.total_cents)
 
-@dataclass
+    @property
+    def subtotal(self) -> float:
+        return to_dollars(self.subtotal_cents)
+
+    @property
+    def discount_amount(self) -> float:
+        return to_dollars(self.discount_cents)
+
+    @property
+    def tax_amount(self) -> float:
+        return to_dollars(self.tax_cents)
+
+@dataclass(slots=True)
 class Part:
     part_id: int
     name: str
-    price: float
+    price_cents: int
+    store_id: int
+    quantity: int
+
+    @property
+    def price(self) -> float:
+        return to_dollars(self.price_cents)
+
+class Totals(NamedTuple):
+    subtotal_cents: int
+    discount_cents: int
+    tax_cents: int
+    total_cents: int
+
+    @property
+    def subtotal(self) -> float:
+        return to_dollars(self.subtotal_cents)
+
+    @property
+    def discount(self) -> float:
+        return to_dollars(self.discount_cents)
+
+    @property
+    def tax(self) -> float:
+        return to_dollars(self.tax_cents)
+
+    @property
+    def total(self) -> float:
+        return to_dollars(self.total_cents)
+
+def line_total(unit_cents: int, quantity: int, discount_percent: float = 0.0) -> int:
+    """Cents of one cart or receipt line, after its own line discount (a fraction, e.g. 0.2)."""
+    cents = unit_cents * quantity
+    if discount_percent:
+        cents -= apply_rate(cents, basis_points(discount_percent))
+    return cents
+
+def transaction_discount(subtotal_cents: int, discount_type: str, value) -> int:
+    """Cents a transaction-level discount ('percentage' or 'fixed' dollars) takes off a subtotal."""
+    discount_type = discount_type.lower()
+    if discount_type == "percentage":
+        return apply_rate(subtotal_cents, basis_points(float(value) / 100))
+    if discount_type == "fixed":
+        return min(to_cents(value), subtotal_cents)
+    return 0
+
+def price_totals(subtotal_cents: int, tax_rate: float, discount_cents: int = 0) -> Totals:
+    """Apply a discount and then tax to a subtotal, all in cents."""
+    discounted = max(subtotal_cents - discount_cents, 0)
+    tax = apply_rate(discounted, basis_points(tax_rate))
+    return Totals(subtotal_cents, discount_cents, tax, discounted + tax)
+
+def downsample_minmax(x, y, buckets: int):
+    """
+    Reduce a series sorted by x to at most about 2 * `buckets` points for plotting.
+
+    The x range is split into `buckets` equal-width buckets and only the lowest and
+    highest point of each bucket is kept (plus both end points), so peaks and dips
+    survive at any zoom level. Requires numpy.
+
+    Returns:
+        tuple: (x, y) numpy arrays in x order. Short series are returned unchanged.
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    if len(x) <= 2 * buckets or x[0] == x[-1]:
+        return x, y
+    edges = np.linspace(x[0], x[-1], buckets + 1)
+    bucket = np.clip(np.searchsorted(edges, x, side="right") - 1, 0, buckets - 1)
+    order = np.lexsort((y, bucket))                     # by bucket, then by y
+    sorted_bucket = bucket[order]
+    firsts = np.flatnonzero(np.r_[True, sorted_bucket[1:] != sorted_bucket[:-1]])
+    lasts = np.r_[firsts[1:], len(order)] - 1
+    keep = np.unique(np.concatenate((order[firsts], order[lasts], [0, len(x) - 1])))
+    return x[keep], y[keep]
+
+class StoreRow(NamedTuple):
     store_id: int
+    store_name: str
+    balance_cents: int
+    tax_rate: float
+
+    @property
+    def balance(self) -> float:
+        return to_dollars(self.balance_cents)
+
+class StoreSummary(NamedTuple):
+    store_id: int
+    store_name: str
+    tax_rate: float
+    inventory_cents: int
+
+    @property
+    def inventory_value(self) -> float:
+        return to_dollars(self.inventory_cents)
+
+class ItemTotal(NamedTuple):
+    pno: int
+    name: str
     quantity: int
 
+class SalesBucket(NamedTuple):
+    period: str          # start of the bucket, 'YYYY-MM-DD' or 'YYYY-MM-DD HH:00:00'
+    transactions: int
+    total_cents: int
+
+    @property
+    def total(self) -> float:
+        return to_dollars(self.total_cents)
+
+class ExportedFile(NamedTuple):
+    table: str
+    store_id: int        # None for tables that are not split by store
+    path: str
+    rows: int
+    last_id: int         # watermark after this export
+
+# Store-scoped tables written by Database.export: (id column the watermark follows, query).
+# Rows are append-only, so "since last export" means an id above the stored watermark.
+EXPORT_TABLES = {
+    "transactions": ("transaction_id", """
+        SELECT t.* FROM transactions t
+        WHERE t.store_id = ? AND t.transaction_id > ?
+        ORDER BY t.transaction_id"""),
+    "transaction_details": ("transaction_detail_id", """
+        SELECT td.* FROM transaction_details td
+        JOIN transactions t ON t.transaction_id = td.transaction_id
+        WHERE t.store_id = ? AND td.transaction_detail_id > ?
+        ORDER BY td.transaction_detail_id"""),
+    "returns": ("return_id", """
+        SELECT r.* FROM returns r
+        WHERE r.store_id = ? AND r.return_id > ?
+        ORDER BY r.return_id"""),
+}
+EXPORT_FORMATS = ("csv", "parquet")
+
+def _arrow_type(declared_type: str):
+    import pyarrow as pa
+    declared_type = (declared_type or "").upper()
+    if "INT" in declared_type or "BOOL" in declared_type:
+        return pa.int64()
+    if any(text in declared_type for text in ("CHAR", "TEXT", "CLOB", "DATE", "TIME")):
+        return pa.string()
+    return pa.float64()
+
+def _write_cursor(conn, cursor, table: str, path: str, fmt: str, id_column: str, chunk_size: int):
+    """Write a cursor's rows to CSV or Parquet in chunks. Returns (rows, last id)."""
+    columns = [description[0] for description in cursor.description]
+    id_index = columns.index(id_column) if id_column else None
+    rows_written, last_id = 0, 0
+    if fmt == "csv":
+        with open(path, "w", newline="", buffering=1 << 16) as file:
+            writer = csv.writer(file)
+            writer.writerow(columns)
+            while rows := cursor.fetchmany(chunk_size):
+                writer.writerows(rows)
+                rows_written += len(rows)
+                if id_index is not None:
+                    last_id = rows[-1][id_index]
+    else:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        declared = {col[1]: col[2] for col in conn.execute(f"PRAGMA table_info({table})")}
+        schema = pa.schema([(column, _arrow_type(declared.get(column))) for column in columns])
+        with pq.ParquetWriter(path, schema) as writer:
+            while rows := cursor.fetchmany(chunk_size):
+                arrays = [pa.array(values, type=field.type) for values, field in zip(zip(*rows), schema)]
+                writer.write_table(pa.Table.from_arrays(arrays, schema=schema))
+                rows_written += len(rows)
+                if id_index is not None:
+                    last_id = rows[-1][id_index]
+    return rows_written, last_id
+
+def _export_store(conn, directory: str, fmt: str, store_id: int, since: dict, chunk_size: int) -> List[ExportedFile]:
+    files = []
+    for table, (id_column, query) in EXPORT_TABLES.items():
+        since_id = since.get(table, 0)
+        path = os.path.join(directory, f"{table}_store{store_id}.{fmt}")
+        cursor = conn.execute(query, (store_id, since_id))
+        rows, last_id = _write_cursor(conn, cursor, table, path, fmt, id_column, chunk_size)
+        files.append(ExportedFile(table, store_id, path, rows, max(last_id, since_id)))
+    return files
+
+def _read_only_connection(db_name: str) -> sqlite3.Connection:
+    """Second connection to a database file that can only read, in autocommit mode."""
+    return sqlite3.connect(pathlib.Path(db_name).resolve().as_uri() + "?mode=ro", uri=True, isolation_level=None)
+
+def _export_store_worker(db_name: str, directory: str, fmt: str, store_id: int, since: dict, chunk_size: int):
+    """Export one store from a worker process over its own read-only connection."""
+    conn = _read_only_connection(db_name)
+    try:
+        return _export_store(conn, directory, fmt, store_id, since, chunk_size)
+    finally:
+        conn.close()
+
+class RejectedRow(NamedTuple):
+    line: int            # line number in a CSV/JSON Lines file, item number in a JSON array
+    row: dict
+    reason: str
+
+@dataclass
+class ImportReport:
+    inserted: int = 0
+    updated: int = 0
+    rejected: List[RejectedRow] = field(default_factory=list)
+    seconds: float = 0.0
+
+    @property
+    def rows_per_second(self) -> float:
+        return (self.inserted + self.updated) / self.seconds if self.seconds else 0.0
+
+IMPORT_FORMATS = ("csv", "json", "jsonl")
+
+def _import_format(source, fmt: str = None) -> str:
+    """Format of an import file, from `fmt` or the file extension."""
+    if fmt is None:
+        fmt = os.path.splitext(str(getattr(source, "name", source)))[1].lstrip(".").lower()
+    if fmt not in IMPORT_FORMATS:
+        raise ValueError(f"Unknown import format '{fmt}', expected one of {', '.join(IMPORT_FORMATS)}")
+    return fmt
+
+def _import_quantity(value) -> int:
+    """Whole-number quantity of an import row; JSON numbers and CSV text are held to the same rule."""
+    if isinstance(value, bool):
+        raise ValueError("invalid quantity")
+    try:
+        quantity = Decimal(str(value).strip())
+    except InvalidOperation:
+        raise ValueError("invalid quantity") from None
+    if not quantity.is_finite() or quantity != quantity.to_integral_value():
+        raise ValueError("invalid quantity")
+    return int(quantity)
+
+def _read_import_rows(source, fmt: str) -> Iterator[tuple]:
+    """Yield (line, row dict) from a CSV, JSON array or JSON Lines file, path or open file."""
+    file = open(source, newline="", encoding="utf-8") if isinstance(source, (str, os.PathLike)) else source
+    try:
+        if fmt == "csv":
+            reader = csv.DictReader(file)
+            for row in reader:
+                yield reader.line_num, row
+        elif fmt == "jsonl":
+            for line, text in enumerate(file, start=1):
+                if text.strip():
+                    try:
+                        yield line, json.loads(text)
+                    except ValueError:
+                        yield line, {"_raw": text.rstrip("\n")}
+        else:
+            for item, row in enumerate(json.load(file), start=1):
+                yield item, row
+    finally:
+        if file is not source:
+            file.close()
+
+class RecordedPurchase(NamedTuple):
+    transaction_id: int
+    totals: Totals       # None when the purchase was a duplicate
+    pnos: list
+    duplicate: bool      # the idempotency key had already been recorded
+
+class PurchaseRequest(NamedTuple):
+    parts: List[PartSold]
+    store_id: int
+    employee_id: int = 1
+    discount_id: int = None
+    idempotency_key: str = None
+
+class JournalEntry(NamedTuple):
+    seq: int
+    idempotency_key: str
+    store_id: int
+    employee_id: int
+    discount_id: int
+    parts: List[PartSold]
+
+class SyncResult(NamedTuple):
+    synced: list     # [(seq, transaction_id)]
+    rejected: list   # [(seq, error)]
+    pnos: tuple      # parts whose stock changed
+
+class EmployeeRow(NamedTuple):
+    id: int
+    first_name: str
+    last_name: str
+    role: str
+    store_id: int
+
+class PartChange(NamedTuple):
+    kind: str            # 'added', 'updated' or 'removed'
+    pnos: tuple
+    parts: tuple = ()    # current Part rows for 'added' and 'updated'
+
+class StatementStats(NamedTuple):
+    runs: int          # statements run through Database.run
+    first_uses: int    # names run for the first time on this connection
+    cache_size: int    # the connection's statement cache, sized to hold the registry
+
+# Prepared statement cache per connection; holds every statement in STATEMENTS
+STATEMENT_CACHE_SIZE = 256
+
+_PART_COLUMNS = "SELECT pno, name, price_cents, store_id, quantity FROM parts"
+
+# Named SQL of the frequently run queries, executed with Database.run. Each name maps
+# to fixed text, so after its first use a statement is reused from the connection's
+# statement cache instead of being parsed again.
+STATEMENTS = {
+    # Checkout
+    "transaction_by_key": "SELECT transaction_id FROM transactions WHERE idempotency_key = ?",
+    "store_tax_rate": "SELECT tax_rate FROM stores WHERE store_id = ?",
+    "discount_terms": "SELECT discount_type, value FROM discounts WHERE discount_id = ?",
+    "insert_transaction": "INSERT INTO transactions (employee_id, store_id, total_cents, discount_id, idempotency_key) "
+                          "VALUES (?, ?, ?, ?, ?)",
+    # Stock changes are one conditional UPDATE each, so concurrent registers can never
+    # sell the same unit twice. No row back means unknown part or not enough stock.
+    "take_stock_by_pno": "UPDATE parts SET quantity = quantity - ? WHERE pno = ? AND store_id = ? AND quantity >= ? "
+                         "RETURNING pno, quantity, price_cents, name",
+    "take_stock_by_name": "UPDATE parts SET quantity = quantity - ? "
+                          "WHERE pno = (SELECT pno FROM parts WHERE name = ? AND store_id = ? ORDER BY pno LIMIT 1) "
+                          "AND quantity >= ? RETURNING pno, quantity, price_cents, name",
+    "restock_by_pno": "UPDATE parts SET quantity = quantity + ? WHERE pno = ? AND store_id = ? "
+                      "RETURNING pno, quantity, price_cents",
+    "restock_by_name": "UPDATE parts SET quantity = quantity + ? "
+                       "WHERE pno = (SELECT pno FROM parts WHERE name = ? AND store_id = ? ORDER BY pno LIMIT 1) "
+                       "RETURNING pno, quantity, price_cents",
+    "stock_by_name": "SELECT pno, quantity FROM parts WHERE name = ? AND store_id = ? ORDER BY pno LIMIT 1",
+    "stock_by_pno": "SELECT pno, quantity FROM parts WHERE pno = ? AND store_id = ?",
+    "insert_detail": "INSERT INTO transaction_details (transaction_id, part_id, quantity) VALUES (?, ?, ?)",
+    # Sale and return lines carry the name and price they were sold at
+    "insert_sale_line": "INSERT INTO transaction_details "
+                        "(transaction_id, part_id, quantity, part_name, unit_cents, discount_percent, line_cents) "
+                        "VALUES (?, ?, ?, ?, ?, ?, ?)",
+    "insert_return_detail": "INSERT INTO transaction_details (transaction_id, part_id, quantity, returned_detail_id, "
+                            "part_name, unit_cents, discount_percent, line_cents) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+    "set_transaction_total": "UPDATE transactions SET total_cents = ? WHERE transaction_id = ?",
+    # Sale-time amounts, so receipts and refunds never depend on the discount or tax rate as they are now
+    "set_transaction_amounts": "UPDATE transactions SET total_cents = ?, discount_cents = ?, tax_cents = ? "
+                               "WHERE transaction_id = ?",
+    # Balance changes are appended; the stores row is only rewritten by rollup_balances
+    "ledger_entry": "INSERT INTO balance_ledger (store_id, amount_cents, transaction_id) VALUES (?, ?, ?)",
+    # Lookups
+    "employee_credentials": "SELECT id, password_hash, role FROM employees WHERE first_name = ? AND last_name = ?",
+    "parts_by_store": f"{_PART_COLUMNS} WHERE store_id = ? ORDER BY pno",
+    "part_by_name": f"{_PART_COLUMNS} WHERE name = ? AND store_id = ?",
+    "part_by_id": f"{_PART_COLUMNS} WHERE pno = ?",
+    # One statement for any number of ids, passed as a JSON array
+    "parts_by_ids": f"{_PART_COLUMNS} WHERE pno IN (SELECT value FROM json_each(?)) ORDER BY pno",
+    "transaction_header": """
+        SELECT t.transaction_id, t.transaction_date, t.total_cents,
+               e.first_name || ' ' || e.last_name AS employee_name,
+               s.store_name, t.discount_id, t.discount_cents, t.tax_cents
+        FROM transactions t
+        JOIN employees e ON t.employee_id = e.id
+        JOIN stores s ON t.store_id = s.store_id
+        WHERE t.transaction_id = ?""",
+    "transaction_lines": """
+        SELECT part_name, quantity, unit_cents, line_cents, discount_percent, part_id
+        FROM transaction_details
+        WHERE transaction_id = ?
+        ORDER BY transaction_detail_id""",
+    "discount_by_id": "SELECT name, discount_type, value FROM discounts WHERE discount_id = ?",
+    "employee_role": "SELECT role FROM employees WHERE id = ?",
+    "sales_report_transactions": """
+        SELECT t.transaction_id, t.transaction_date, t.total_cents,
+               e.first_name || ' ' || e.last_name AS employee_name,
+               t.discount_id, t.discount_cents, t.tax_cents
+        FROM transactions t
+        JOIN employees e ON t.employee_id = e.id
+        WHERE t.store_id = ?
+        ORDER BY t.transaction_date DESC""",
+    # Receipts being returned, with what was paid and what earlier returns already refunded
+    "return_receipts": """
+        SELECT t.transaction_id, t.store_id, t.discount_id, t.total_cents, t.discount_cents, t.tax_cents,
+               COALESCE((
+                   SELECT SUM(r.refund_cents) FROM returns r
+                   WHERE r.original_transaction_id = t.transaction_id
+               ), 0)
+        FROM transactions t
+        WHERE t.transaction_id IN (SELECT value FROM json_each(?))""",
+    # Sale lines with the quantity not yet returned, one indexed lookup per line
+    "returnable_lines": """
+        SELECT td.transaction_id, td.transaction_detail_id, td.part_id, td.quantity,
+               td.quantity + COALESCE((
+                   SELECT SUM(r.quantity) FROM transaction_details r
+                   WHERE r.returned_detail_id = td.transaction_detail_id
+               ), 0),
+               td.part_name, td.unit_cents, td.discount_percent, td.line_cents
+        FROM transaction_details td
+        WHERE td.transaction_id IN (SELECT value FROM json_each(?)) AND td.quantity > 0
+        ORDER BY td.transaction_detail_id""",
+    "restock": "UPDATE parts SET quantity = quantity + ? WHERE pno = ?",
+    "insert_return": "INSERT INTO returns (transaction_id, original_transaction_id, refund_cents, store_id, employee_id) "
+                     "VALUES (?, ?, ?, ?, ?)",
+    # Balance reads: rollup plus the ledger tail after it
+    "store_balances": """
+        SELECT s.store_id, s.store_name, s.balance_cents + COALESCE(SUM(l.amount_cents), 0), s.tax_rate
+        FROM stores s
+        LEFT JOIN balance_ledger l ON l.store_id = s.store_id AND l.entry_id > s.ledger_rolled_up_to
+        GROUP BY s.store_id
+        ORDER BY s.store_id""",
+    "store_balance": """
+        SELECT s.balance_cents + COALESCE((
+            SELECT SUM(l.amount_cents) FROM balance_ledger l
+            WHERE l.store_id = s.store_id AND l.entry_id > s.ledger_rolled_up_to
+        ), 0)
+        FROM stores s WHERE s.store_id = ?""",
+}
+
+def _transaction_log_statement(by_store: bool, since: bool, until: bool) -> str:
+    query = """
+        SELECT t.transaction_id, t.transaction_date, t.total_cents,
+               e.first_name || ' ' || e.last_name AS employee_name, s.store_name,
+               CASE WHEN r.return_id IS NOT NULL THEN 'Return' ELSE 'Purchase' END AS transaction_type,
+               r.original_transaction_id
+        FROM transactions t
+        JOIN employees e ON t.employee_id = e.id
+        JOIN stores s ON t.store_id = s.store_id
+        LEFT JOIN returns r ON t.transaction_id = r.transaction_id
+        WHERE 1=1"""
+    if by_store:
+        query += " AND t.store_id = ?"
+    if since:
+        query += " AND date(t.transaction_date) >= date(?)"
+    if until:
+        query += " AND date(t.transaction_date) <= date(?)"
+    return query + " ORDER BY t.transaction_date DESC"
+
+def _adjust_prices_statement(by_store: bool, by_prefix: bool, by_pnos: bool) -> str:
+    query = "UPDATE parts SET price_cents = MAX((price_cents * ? + 5000) / 10000, 0) WHERE 1=1"
+    if by_store:
+        query += " AND store_id = ?"
+    if by_prefix:
+        # A range instead of LIKE so idx_parts_store_name can serve it
+        query += " AND name >= ? AND name < ?"
+    if by_pnos:
+        query += " AND pno IN (SELECT value FROM json_each(?))"
+    return query + " RETURNING pno"
+
+# get_transaction_log and adjust_prices have one static variant per combination of filters
+for _flags in range(8):
+    STATEMENTS[f"transaction_log_{_flags}"] = _transaction_log_statement(bool(_flags & 1), bool(_flags & 2), bool(_flags & 4))
+    STATEMENTS[f"adjust_prices_{_flags}"] = _adjust_prices_statement(bool(_flags & 1), bool(_flags & 2), bool(_flags & 4))
+
 class Database:
-    def __init__(self, db_name):
+    def __init__(self, db_name, events: EventSink = None, bcrypt_rounds: int = DEFAULT_BCRYPT_ROUNDS):
         """
         Initializes the SQLite database and connects to it.
         If the database does not exist, it will be created.
         Also creates required tables if they do not exist.
+
+        Args:
+            db_name (str): Path of the SQLite database file, or ':memory:'.
+            events (EventSink, optional): Sink for operational events. A private
+                WARNING-level sink writing to stderr is created when omitted.
+            bcrypt_rounds (int): Cost factor for password hashes. Hashes made with a
+                different cost are rehashed the next time the employee logs in.
         """
         self.db_name = db_name
+        self.bcrypt_rounds = bcrypt_rounds
+        self.listeners = []
+        self.snapshot_taken_at = None  # set on reporting snapshots
+        self._statements_used = set()
+        self._statement_runs = 0
+        self._snapshot = None
+        self._owns_events = events is None
+        self.events = EventSink() if events is None else events
         self.conn = self.connect()
         self.cursor = self.conn.cursor()
         self.create_tables()
 
     def connect(self):
         """Create a connection to the SQLite database."""
-        conn = sqlite3.connect(self.db_name)
+        conn = sqlite3.connect(self.db_name, cached_statements=STATEMENT_CACHE_SIZE)
         conn.execute('PRAGMA foreign_keys = ON')
-        print(f"Successfully connected to the database: {self.db_name}")
+        self.events.emit(INFO, "connected", db=self.db_name)
         return conn
 
+    def run(self, name: str, params=()) -> sqlite3.Cursor:
+        """Execute the named statement from STATEMENTS on the shared cursor."""
+        self._statement_runs += 1
+        self._statements_used.add(name)
+        return self.cursor.execute(STATEMENTS[name], params)
+
+    def statement_stats(self) -> StatementStats:
+        """
+        How often registry statements were run and how many distinct ones were. sqlite3
+        does not report its own cache hits; with the registry smaller than the cache,
+        only a statement's first use should parse it.
+        """
+        return StatementStats(self._statement_runs, len(self._statements_used), STATEMENT_CACHE_SIZE)
+
     def create_tables(self):
         """Create tables if they don't already exist."""
         
@@ -88,7 +773,7 @@ class Database:
         CREATE TABLE IF NOT EXISTS parts (
             pno INTEGER PRIMARY KEY AUTOINCREMENT,
             name TEXT NOT NULL,  -- Enforce unique part names
-            price DECIMAL(10,2) NOT NULL,
+            price_cents INTEGER NOT NULL,
             store_id INTEGER,
             quantity INTEGER NOT NULL,
             FOREIGN KEY (store_id) REFERENCES stores(store_id) ON DELETE SET NULL
@@ -100,10 +785,27 @@ class Database:
         CREATE TABLE IF NOT EXISTS stores (
             store_id INTEGER PRIMARY KEY AUTOINCREMENT,
             store_name TEXT NOT NULL,
-            balance DECIMAL(10,2) NOT NULL DEFAULT 0.00,
-            tax_rate DECIMAL(5,2) NOT NULL DEFAULT 0.00
+            balance_cents INTEGER NOT NULL DEFAULT 0,  -- balance as of the last ledger rollup
+            tax_rate DECIMAL(5,2) NOT NULL DEFAULT 0.00,
+            ledger_rolled_up_to INTEGER NOT NULL DEFAULT 0
+        );
+        """
+
+        # Signed balance changes, appended by every sale and return (see rollup_balances)
+        create_balance_ledger_table_query = """
+        CREATE TABLE IF NOT EXISTS balance_ledger (
+            entry_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            store_id INTEGER NOT NULL,
+            amount_cents INTEGER NOT NULL,
+            transaction_id INTEGER,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (store_id) REFERENCES stores(store_id) ON DELETE CASCADE
         );
         """
+        # Covers the unrolled tail of one store's ledger
+        create_balance_ledger_index = """
+        CREATE INDEX IF NOT EXISTS idx_balance_ledger_store ON balance_ledger(store_id, entry_id, amount_cents);
+        """
     
         # Create transactions table 
         create_transactions_table_query = """
@@ -111,9 +813,12 @@ class Database:
             transaction_id INTEGER PRIMARY KEY AUTOINCREMENT,
             employee_id INTEGER NOT NULL,
             store_id INTEGER NOT NULL,
-            total_price DECIMAL(10,2) NOT NULL,
+            total_cents INTEGER NOT NULL,
+            discount_cents INTEGER NOT NULL DEFAULT 0,
+            tax_cents INTEGER NOT NULL DEFAULT 0,
             transaction_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
             discount_id INTEGER,
+            idempotency_key TEXT,
             FOREIGN KEY (employee_id) REFERENCES employees(id) ON DELETE SET NULL,
             FOREIGN KEY (store_id) REFERENCES stores(store_id) ON DELETE CASCADE,
             FOREIGN KEY (discount_id) REFERENCES discounts(discount_id) ON DELETE SET NULL
@@ -127,21 +832,32 @@ class Database:
             transaction_id INTEGER NOT NULL,
             part_id INTEGER NOT NULL,
             quantity INTEGER NOT NULL,
+            returned_detail_id INTEGER,
+            part_name TEXT,
+            unit_cents INTEGER,
+            discount_percent REAL NOT NULL DEFAULT 0,
+            line_cents INTEGER,
             FOREIGN KEY (transaction_id) REFERENCES transactions(transaction_id) ON DELETE CASCADE,
             FOREIGN KEY (part_id) REFERENCES parts(pno) ON DELETE CASCADE
         );
         """
-        # Trigger to update total_price in transactions table when a new transaction detail is added
+        # Trigger to update total_cents in transactions table when a new transaction detail is added.
+        # Lines inserted without a price snapshot take the part's current name and price.
         create_trigger_update_total_price = """
         CREATE TRIGGER IF NOT EXISTS update_total_price
         AFTER INSERT ON transaction_details
         FOR EACH ROW
         BEGIN
+            UPDATE transaction_details
+            SET (part_name, unit_cents) = (SELECT name, price_cents FROM parts WHERE pno = NEW.part_id)
+            WHERE transaction_detail_id = NEW.transaction_detail_id AND NEW.unit_cents IS NULL;
+            UPDATE transaction_details
+            SET line_cents = quantity * unit_cents
+            WHERE transaction_detail_id = NEW.transaction_detail_id AND NEW.line_cents IS NULL;
             UPDATE transactions
-            SET total_price = (
-                SELECT COALESCE(SUM(td.quantity * p.price), 0)
+            SET total_cents = (
+                SELECT COALESCE(SUM(td.line_cents), 0)
                 FROM transaction_details td
-                JOIN parts p ON td.part_id = p.pno
                 WHERE td.transaction_id = NEW.transaction_id
             )
             WHERE transaction_id = NEW.transaction_id;
@@ -154,7 +870,7 @@ class Database:
             transaction_id INTEGER NOT NULL,
             original_transaction_id INTEGER,
             return_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            total_refund DECIMAL(10,2) NOT NULL,
+            refund_cents INTEGER NOT NULL,
             store_id INTEGER NOT NULL,
             employee_id INTEGER NOT NULL,
             FOREIGN KEY (transaction_id) REFERENCES transactions(transaction_id) ON DELETE CASCADE,
@@ -190,21 +906,108 @@ class Database:
             FOREIGN KEY (discount_id) REFERENCES discounts(discount_id) ON DELETE CASCADE
         );
         """
+        # Last exported row id per export target, table and store (Database.export)
+        create_export_watermarks_table_query = """
+        CREATE TABLE IF NOT EXISTS export_watermarks (
+            export_name TEXT NOT NULL,
+            table_name TEXT NOT NULL,
+            store_id INTEGER NOT NULL,
+            last_id INTEGER NOT NULL,
+            exported_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (export_name, table_name, store_id)
+        );
+        """
+        # Indexes for the login lookup by name and the store-scoped queries
+        create_employee_name_index = """
+        CREATE INDEX IF NOT EXISTS idx_employees_name ON employees(first_name, last_name);
+        """
+        create_employee_store_index = """
+        CREATE INDEX IF NOT EXISTS idx_employees_store ON employees(store_id);
+        """
+        create_parts_store_index = """
+        CREATE INDEX IF NOT EXISTS idx_parts_store_name ON parts(store_id, name);
+        """
+        # Date-range scans of one store's sales (sales_frame and the report aggregates)
+        create_transactions_store_date_index = """
+        CREATE INDEX IF NOT EXISTS idx_transactions_store_date ON transactions(store_id, transaction_date);
+        """
+        # Lines of a transaction with their sale snapshot; covers the receipt, report and
+        # per-part reads without touching the table
+        create_details_lines_index = """
+        CREATE INDEX IF NOT EXISTS idx_transaction_details_lines
+        ON transaction_details(transaction_id, transaction_detail_id, part_id, quantity,
+                               part_name, unit_cents, discount_percent, line_cents);
+        """
+        # Return lines by the sale line they return, and returns by the receipt they return
+        create_returned_lines_index = """
+        CREATE INDEX IF NOT EXISTS idx_transaction_details_returned
+        ON transaction_details(returned_detail_id, quantity) WHERE returned_detail_id IS NOT NULL;
+        """
+        create_returns_original_index = """
+        CREATE INDEX IF NOT EXISTS idx_returns_original ON returns(original_transaction_id);
+        """
         try:
             self.cursor.execute(create_stores_table_query)  
             self.cursor.execute(create_employee_table_query)
+            self.cursor.execute(create_employee_name_index)
+            self.cursor.execute(create_employee_store_index)
             self.cursor.execute(create_parts_table_query)
+            self.cursor.execute(create_parts_store_index)
             self.cursor.execute(create_transactions_table_query)
+            self.cursor.execute(create_transactions_store_date_index)
             self.cursor.execute(create_transaction_details_table_query)
-            self.cursor.execute(create_trigger_update_total_price)
             self.cursor.execute(create_returns_table_query)
             self.cursor.execute(create_discounts_table_query)
             self.cursor.execute(create_part_discounts_table_query)
+            self.cursor.execute(create_export_watermarks_table_query)
+            self.migrate_money_to_cents()
+            self.ensure_line_snapshot(create_details_lines_index)
+            self.cursor.execute(create_trigger_update_total_price)
             self.conn.commit()
-            print("Tables are ready.")
+            self.events.emit(DEBUG, "tables_ready")
             self.ensure_discount_id_column()
+            self.ensure_transaction_amounts()
+            self.ensure_idempotency_key_column()
+            self.ensure_balance_ledger(create_balance_ledger_table_query, create_balance_ledger_index)
+            self.ensure_returned_detail_column(create_returned_lines_index, create_returns_original_index)
+        except sqlite3.Error as e:
+            self.events.emit(ERROR, "create_tables_failed", error=e)
+
+    # Money columns renamed to integer cents in schema version 1: {table: (old, new)}
+    CENTS_COLUMNS = {
+        "parts": ("price", "price_cents"),
+        "stores": ("balance", "balance_cents"),
+        "transactions": ("total_price", "total_cents"),
+        "returns": ("total_refund", "refund_cents"),
+    }
+
+    def migrate_money_to_cents(self):
+        """
+        Upgrade a database with DECIMAL dollar columns to integer cents (schema version 1).
+
+        Each money column is renamed to its *_cents name and its values are converted in
+        place. The whole upgrade runs in one transaction and is recorded in user_version.
+        """
+        version = self.cursor.execute("PRAGMA user_version").fetchone()[0]
+        if version >= SCHEMA_VERSION:
+            return
+        try:
+            if not self.conn.in_transaction:
+                self.cursor.execute("BEGIN")
+            # The trigger refers to the old columns; create_tables recreates it
+            self.cursor.execute("DROP TRIGGER IF EXISTS update_total_price")
+            for table, (old, new) in self.CENTS_COLUMNS.items():
+                columns = [col[1] for col in self.cursor.execute(f"PRAGMA table_info({table})")]
+                if old in columns:
+                    self.cursor.execute(f"ALTER TABLE {table} RENAME COLUMN {old} TO {new}")
+                    self.cursor.execute(f"UPDATE {table} SET {new} = CAST(ROUND({new} * 100) AS INTEGER)")
+                    self.events.emit(INFO, "column_migrated", table=table, column=new)
+            self.cursor.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+            self.conn.commit()
         except sqlite3.Error as e:
-            print(f"Error creating tables: {e}")
+            self.conn.rollback()
+            self.events.emit(ERROR, "migration_failed", version=SCHEMA_VERSION, error=e)
+            raise
 
     def ensure_discount_id_column(self):
         """Ensure the discount_id column exists in the transactions table (for upgrades)."""
@@ -214,20 +1017,231 @@ class Database:
             try:
                 self.cursor.execute("ALTER TABLE transactions ADD COLUMN discount_id INTEGER;")
                 self.conn.commit()
-                print("Added discount_id column to transactions table.")
+                self.events.emit(INFO, "column_added", table="transactions", column="discount_id")
             except Exception as e:
-                print(f"Error adding discount_id column: {e}")
+                self.events.emit(ERROR, "column_add_failed", table="transactions", column="discount_id", error=e)
+
+    def ensure_transaction_amounts(self):
+        """
+        Ensure transactions carry their discount and tax in cents at sale time (for upgrades).
+
+        Existing discounts are backfilled from the discount as it is now, the closest record
+        there is, and tax as whatever the total holds beyond the discounted lines.
+        """
+        self.cursor.execute("PRAGMA table_info(transactions)")
+        columns = [col[1] for col in self.cursor.fetchall()]
+        if "tax_cents" in columns:
+            return
+        try:
+            if not self.conn.in_transaction:
+                self.cursor.execute("BEGIN")
+            self.cursor.execute("ALTER TABLE transactions ADD COLUMN discount_cents INTEGER NOT NULL DEFAULT 0;")
+            self.cursor.execute("ALTER TABLE transactions ADD COLUMN tax_cents INTEGER NOT NULL DEFAULT 0;")
+            rows = self.cursor.execute("""
+                SELECT t.transaction_id, d.discount_type, d.value,
+                       (SELECT SUM(td.line_cents) FROM transaction_details td WHERE td.transaction_id = t.transaction_id)
+                FROM transactions t
+                JOIN discounts d ON d.discount_id = t.discount_id
+            """).fetchall()
+            # Return receipts have negative lines; their discount is the same share, negated
+            self.cursor.executemany(
+                "UPDATE transactions SET discount_cents = ? WHERE transaction_id = ?",
+                [((1 if subtotal >= 0 else -1) * transaction_discount(abs(subtotal), discount_type, value),
+                  transaction_id)
+                 for transaction_id, discount_type, value, subtotal in rows if subtotal]
+            )
+            self.cursor.execute("""
+                UPDATE transactions
+                SET tax_cents = total_cents + discount_cents - COALESCE((
+                    SELECT SUM(td.line_cents) FROM transaction_details td
+                    WHERE td.transaction_id = transactions.transaction_id
+                ), 0)
+            """)
+            self.conn.commit()
+            for column in ("discount_cents", "tax_cents"):
+                self.events.emit(INFO, "column_added", table="transactions", column=column)
+        except Exception as e:
+            self.conn.rollback()
+            self.events.emit(ERROR, "column_add_failed", table="transactions", column="discount_cents, tax_cents",
+                             error=e)
+
+    def ensure_idempotency_key_column(self):
+        """Ensure transactions has a unique idempotency_key for replayed sales (for upgrades)."""
+        self.cursor.execute("PRAGMA table_info(transactions)")
+        columns = [col[1] for col in self.cursor.fetchall()]
+        try:
+            if "idempotency_key" not in columns:
+                self.cursor.execute("ALTER TABLE transactions ADD COLUMN idempotency_key TEXT;")
+                self.events.emit(INFO, "column_added", table="transactions", column="idempotency_key")
+            self.cursor.execute(
+                "CREATE UNIQUE INDEX IF NOT EXISTS idx_transactions_idempotency ON transactions(idempotency_key);"
+            )
+            self.conn.commit()
+        except Exception as e:
+            self.events.emit(ERROR, "column_add_failed", table="transactions", column="idempotency_key", error=e)
+
+    def ensure_balance_ledger(self, create_table_query: str, create_index_query: str):
+        """Ensure the balance ledger and the rollup watermark on stores exist (for upgrades)."""
+        self.cursor.execute("PRAGMA table_info(stores)")
+        columns = [col[1] for col in self.cursor.fetchall()]
+        try:
+            if "ledger_rolled_up_to" not in columns:
+                self.cursor.execute("ALTER TABLE stores ADD COLUMN ledger_rolled_up_to INTEGER NOT NULL DEFAULT 0;")
+                self.events.emit(INFO, "column_added", table="stores", column="ledger_rolled_up_to")
+            self.cursor.execute(create_table_query)
+            self.cursor.execute(create_index_query)
+            self.conn.commit()
+        except Exception as e:
+            self.events.emit(ERROR, "column_add_failed", table="stores", column="ledger_rolled_up_to", error=e)
+
+    # Sale-time copies of the part on each transaction line: {column: declaration}
+    LINE_SNAPSHOT_COLUMNS = {
+        "part_name": "TEXT",
+        "unit_cents": "INTEGER",
+        "discount_percent": "REAL NOT NULL DEFAULT 0",
+        "line_cents": "INTEGER",
+    }
+
+    def ensure_line_snapshot(self, create_index_query: str):
+        """
+        Ensure transaction lines carry their name and price at sale time (for upgrades).
+
+        Existing lines are backfilled from the parts as they are now, the closest record
+        there is of what they sold for. The total trigger is dropped so create_tables
+        recreates it reading the snapshot.
+        """
+        self.cursor.execute("PRAGMA table_info(transaction_details)")
+        columns = [col[1] for col in self.cursor.fetchall()]
+        missing = [column for column in self.LINE_SNAPSHOT_COLUMNS if column not in columns]
+        try:
+            if missing:
+                if not self.conn.in_transaction:
+                    self.cursor.execute("BEGIN")
+                for column in missing:
+                    self.cursor.execute(
+                        f"ALTER TABLE transaction_details ADD COLUMN {column} {self.LINE_SNAPSHOT_COLUMNS[column]};"
+                    )
+                self.cursor.execute("""
+                    UPDATE transaction_details
+                    SET (part_name, unit_cents) = (SELECT name, price_cents FROM parts WHERE pno = part_id)
+                    WHERE unit_cents IS NULL
+                """)
+                self.cursor.execute(
+                    "UPDATE transaction_details SET line_cents = quantity * unit_cents WHERE line_cents IS NULL"
+                )
+                self.cursor.execute("DROP TRIGGER IF EXISTS update_total_price")
+                self.cursor.execute("DROP INDEX IF EXISTS idx_transaction_details_transaction")
+                for column in missing:
+                    self.events.emit(INFO, "column_added", table="transaction_details", column=column)
+            self.cursor.execute(create_index_query)
+            self.conn.commit()
+        except Exception as e:
+            self.conn.rollback()
+            self.events.emit(ERROR, "column_add_failed", table="transaction_details", column=", ".join(missing),
+                             error=e)
+
+    def ensure_returned_detail_column(self, create_lines_index_query: str, create_returns_index_query: str):
+        """
+        Ensure return lines point at the sale line they return (for upgrades).
+
+        Return lines written before the column existed are linked to the first sale line
+        of the same part on the receipt they returned, so those receipts stay returned.
+        """
+        self.cursor.execute("PRAGMA table_info(transaction_details)")
+        columns = [col[1] for col in self.cursor.fetchall()]
+        try:
+            if "returned_detail_id" not in columns:
+                self.cursor.execute("ALTER TABLE transaction_details ADD COLUMN returned_detail_id INTEGER;")
+                self.cursor.execute("""
+                    UPDATE transaction_details AS r
+                    SET returned_detail_id = (
+                        SELECT MIN(o.transaction_detail_id)
+                        FROM returns ret
+                        JOIN transaction_details o ON o.transaction_id = ret.original_transaction_id
+                        WHERE ret.transaction_id = r.transaction_id AND o.part_id = r.part_id AND o.quantity > 0
+                    )
+                    WHERE r.quantity < 0 AND r.transaction_id IN (SELECT transaction_id FROM returns)
+                """)
+                self.events.emit(INFO, "column_added", table="transaction_details", column="returned_detail_id")
+            self.cursor.execute(create_lines_index_query)
+            self.cursor.execute(create_returns_index_query)
+            self.conn.commit()
+        except Exception as e:
+            self.conn.rollback()
+            self.events.emit(ERROR, "column_add_failed", table="transaction_details", column="returned_detail_id",
+                             error=e)
 
     # Closes the connection to the database
     def close_connection(self):
         """Close the database connection."""
+        if self._snapshot:
+            self._snapshot.close_connection()
+            self._snapshot = None
         if self.conn:
             self.conn.close()
-            print(f"Connection to {self.db_name} closed.")
+            self.events.emit(INFO, "closed", db=self.db_name)
+        if self._owns_events:
+            self.events.close()
+        else:
+            self.events.flush()
+
+    def reporting(self, max_age: float = REPORT_SNAPSHOT_MAX_AGE) -> "Database":
+        """
+        Read-only snapshot of this database for reports.
+
+        The snapshot is an in-memory copy made with the SQLite online backup API, so long
+        report queries run without holding locks that checkouts on this connection (or
+        other registers) have to wait for. It is copied again once it is older than
+        `max_age` seconds; `snapshot_age` tells how current the figures are.
+        """
+        if self.snapshot_taken_at is not None:
+            return self
+        if self._snapshot is None or self._snapshot.snapshot_age > max_age:
+            self.refresh_snapshot()
+        return self._snapshot
+
+    def refresh_snapshot(self):
+        """Copy the live database into the reporting snapshot now."""
+        if self._snapshot is None:
+            self._snapshot = Database(":memory:", events=self.events, bcrypt_rounds=self.bcrypt_rounds)
+        start = time.perf_counter()
+        self.conn.backup(self._snapshot.conn)
+        self._snapshot.conn.execute("PRAGMA query_only = ON")
+        self._snapshot.snapshot_taken_at = time.time()
+        self.events.emit(DEBUG, "snapshot_refreshed", db=self.db_name, seconds=round(time.perf_counter() - start, 4))
+
+    @property
+    def snapshot_age(self) -> float:
+        """Seconds since this snapshot was taken, or None for a live database."""
+        if self.snapshot_taken_at is None:
+            return None
+        return time.time() - self.snapshot_taken_at
+
+    def add_listener(self, callback: Callable[[PartChange], None]):
+        """Call `callback` with a PartChange after every committed change to the parts table."""
+        self.listeners.append(callback)
+
+    def remove_listener(self, callback: Callable[[PartChange], None]):
+        """Stop notifying `callback`."""
+        if callback in self.listeners:
+            self.listeners.remove(callback)
+
+    def _notify_parts(self, kind: str, pnos):
+        """Tell listeners which parts changed. Only queries when someone is listening."""
+        if not self.listeners or not pnos:
+            return
+        pnos = tuple(dict.fromkeys(pnos))
+        parts = () if kind == "removed" else tuple(self.get_parts_by_ids(pnos))
+        change = PartChange(kind, pnos, parts)
+        for callback in list(self.listeners):
+            try:
+                callback(change)
+            except Exception as e:
+                self.events.emit(ERROR, "listener_failed", kind=kind, error=e)
 
-    def format_decimal(self, value: float) -> float:
-        """Format a value to 2 decimal places."""
-        return round(value, 2)
+    def refresh_parts(self, pnos):
+        """Tell listeners that parts were changed through another connection (e.g. a JournalSyncer)."""
+        self._notify_parts("updated", pnos)
 
     # Add a new store
     def add_store(self, store_name, balance=0.0, tax_rate=0.0):
@@ -236,23 +1250,23 @@ class Database:
         
         Args:
             store_name (str): Name of the store
-            balance (float): Initial balance, defaults to 0.0
+            balance (float): Initial balance in dollars, defaults to 0.0
             tax_rate (float): Tax rate as decimal (e.g., 0.08 for 8%), defaults to 0.0
         """
         try:
-            formatted_balance = self.format_decimal(balance)
-            formatted_tax_rate = self.format_decimal(tax_rate)
-            query = "INSERT INTO stores (store_name, balance, tax_rate) VALUES (?, ?, ?)"
-            self.cursor.execute(query, (store_name, formatted_balance, formatted_tax_rate))
+            balance_cents = to_cents(balance)
+            formatted_tax_rate = basis_points(tax_rate) / 10000
+            query = "INSERT INTO stores (store_name, balance_cents, tax_rate) VALUES (?, ?, ?)"
+            self.cursor.execute(query, (store_name, balance_cents, formatted_tax_rate))
             self.conn.commit()
-            print(f"Store '{store_name}' added successfully with {formatted_tax_rate*100:.2f}% tax rate.")
+            self.events.emit(INFO, "store_added", store_name=store_name, tax_rate=formatted_tax_rate)
         except sqlite3.Error as e:
-            print(f"Error adding store: {e}")
+            self.events.emit(ERROR, "add_store_failed", store_name=store_name, error=e)
 
     # Add a new employee
     def add_employee(self, first_name, last_name, role, store_id, password):
         """Create a new employee with a hashed password."""
-        hashed_pw = bcrypt.hashpw(password.encode(), bcrypt.gensalt())
+        hashed_pw = self.hash_password(password)
         query = """
         INSERT INTO employees (first_name, last_name, role, store_id, password_hash)
         VALUES (?, ?, ?, ?, ?)
@@ -270,7 +1284,7 @@ class Database:
 
         Args:
             name (str): The name of the part.
-            price (float): The price of the part.
+            price (float): The price of the part in dollars, stored as cents.
             store_id (int): The ID of the store.
             quantity (int): The quantity of the part.
 
@@ -278,41 +1292,155 @@ class Database:
             int: The generated part number (pno) if successful, None otherwise.
         """
         try:
-            formatted_price = self.format_decimal(price)
+            price_cents = to_cents(price)
             self.cursor.execute("SELECT store_id FROM stores WHERE store_id = ?", (store_id,))
             if not self.cursor.fetchone():
-                print(f"Error: Store ID {store_id} does not exist.")
+                self.events.emit(WARNING, "store_not_found", store_id=store_id)
                 return None
 
-            query = "INSERT INTO parts (name, price, store_id, quantity) VALUES (?, ?, ?, ?)"
-            self.cursor.execute(query, (name, formatted_price, store_id, quantity))
+            query = "INSERT INTO parts (name, price_cents, store_id, quantity) VALUES (?, ?, ?, ?)"
+            self.cursor.execute(query, (name, price_cents, store_id, quantity))
             self.conn.commit()
 
             # Return the generated pno (part number)
             pno = self.cursor.lastrowid
-            print(f"Part '{name}' added to store {store_id} with quantity {quantity}. Generated pno: {pno}")
+            self.events.emit(INFO, "part_added", name=name, store_id=store_id, quantity=quantity, pno=pno)
+            self._notify_parts("added", [pno])
             return pno
         except sqlite3.IntegrityError:
-            print(f"Error: Part '{name}' already exists in store {store_id}.")
+            self.events.emit(WARNING, "part_exists", name=name, store_id=store_id)
             return None
         except sqlite3.Error as e:
-            print(f"Error adding part: {e}")
+            self.events.emit(ERROR, "add_part_failed", name=name, store_id=store_id, error=e)
             return None
 
+    def import_parts(self, source, store_id: int = None, fmt: str = None, batch_size: int = 5000) -> ImportReport:
+        """
+        Bulk insert or update parts from a CSV, JSON array or JSON Lines supplier catalog.
+
+        Rows need `name`, `price` (dollars) and `quantity`, plus `store_id` unless a default
+        `store_id` is given. Rows are validated in one streaming pass. A part whose name
+        already exists in the store gets the row's price and quantity. Any other row becomes
+        a new part. Valid rows are written `batch_size` at a time with executemany, one
+        transaction per batch. Invalid rows are skipped and listed in the report.
+
+        Args:
+            source (str | file): Path or open text file.
+            store_id (int, optional): Store for rows without a store_id column.
+            fmt (str, optional): 'csv', 'json' or 'jsonl', defaults to the file extension.
+            batch_size (int): Rows per transaction.
+
+        Returns:
+            ImportReport: Inserted and updated counts, rejected rows and timing.
+        """
+        return self._import_rows(_read_import_rows(source, _import_format(source, fmt)), store_id, batch_size)
+
+    def _import_rows(self, rows, store_id: int = None, batch_size: int = 5000) -> ImportReport:
+        """Validate and write (line, row dict) pairs; see import_parts."""
+        started = time.perf_counter()
+        report = ImportReport()
+        stores = {row[0] for row in self.conn.execute("SELECT store_id FROM stores")}
+        existing = {(row[0], row[1]): row[2] for row in self.conn.execute("SELECT store_id, name, pno FROM parts")}
+        inserts, updates = {}, {}
+
+        for line, row in rows:
+            try:
+                if not isinstance(row, dict):
+                    raise ValueError("row is not an object")
+                name = str(row.get("name") or "").strip()
+                if not name:
+                    raise ValueError("missing name")
+                if isinstance(row.get("price"), bool):
+                    raise ValueError("invalid price")
+                try:
+                    price_cents = to_cents(row.get("price"))
+                except InvalidOperation:
+                    raise ValueError("invalid price") from None
+                quantity = _import_quantity(row.get("quantity"))
+                row_store = row.get("store_id")
+                row_store = store_id if row_store in (None, "") else int(row_store)
+            except (ValueError, TypeError) as e:
+                report.rejected.append(RejectedRow(line, row, str(e) or type(e).__name__))
+                continue
+            if price_cents < 0 or quantity < 0:
+                report.rejected.append(RejectedRow(line, row, "negative price or quantity"))
+                continue
+            if row_store not in stores:
+                report.rejected.append(RejectedRow(line, row, f"store {row_store} not found"))
+                continue
+            key = (row_store, name)
+            if key in existing:
+                updates[existing[key]] = (price_cents, quantity)
+            else:
+                inserts[key] = (price_cents, quantity)   # A repeated new name keeps its last row
+            if len(inserts) + len(updates) >= batch_size:
+                self._write_import_batch(inserts, updates, existing, report)
+        self._write_import_batch(inserts, updates, existing, report)
+
+        report.seconds = time.perf_counter() - started
+        self.events.emit(INFO, "parts_imported", inserted=report.inserted, updated=report.updated,
+                         rejected=len(report.rejected), seconds=round(report.seconds, 3))
+        return report
+
+    def _write_import_batch(self, inserts: dict, updates: dict, existing: dict, report: ImportReport):
+        """Write one import batch in a single transaction and clear it."""
+        if not inserts and not updates:
+            return
+        try:
+            first_new_pno = self.conn.execute("SELECT COALESCE(MAX(pno), 0) + 1 FROM parts").fetchone()[0]
+            self.conn.executemany(
+                "UPDATE parts SET price_cents = ?, quantity = ? WHERE pno = ?",
+                [(price_cents, quantity, pno) for pno, (price_cents, quantity) in updates.items()]
+            )
+            self.conn.executemany(
+                "INSERT INTO parts (name, price_cents, store_id, quantity) VALUES (?, ?, ?, ?)",
+                [(name, price_cents, store, quantity) for (store, name), (price_cents, quantity) in inserts.items()]
+            )
+            new_parts = self.conn.execute(
+                "SELECT pno, store_id, name FROM parts WHERE pno >= ? ORDER BY pno", (first_new_pno,)
+            ).fetchall()
+            self.conn.commit()
+        except sqlite3.Error as e:
+            self.conn.rollback()
+            self.events.emit(ERROR, "import_failed", rows=len(inserts) + len(updates), error=e)
+            raise
+        for pno, store, name in new_parts:
+            existing[(store, name)] = pno
+        report.inserted += len(inserts)
+        report.updated += len(updates)
+        self._notify_parts("updated", list(updates))
+        self._notify_parts("added", [pno for pno, _, _ in new_parts])
+        inserts.clear()
+        updates.clear()
+
     # Resets the employee password 
     def set_employee_password(self, employee_id, password):
         """Hash and store the employee's password."""
-        hashed_pw = bcrypt.hashpw(password.encode(), bcrypt.gensalt())
+        self.store_password_hash(employee_id, self.hash_password(password))
+
+    def hash_password(self, password: str) -> bytes:
+        """Hash a password with the configured bcrypt cost factor."""
+        return bcrypt.hashpw(password.encode(), bcrypt.gensalt(rounds=self.bcrypt_rounds))
+
+    def store_password_hash(self, employee_id, password_hash):
+        """Replace the stored password hash of an employee."""
         query = "UPDATE employees SET password_hash = ? WHERE id = ?"
-        self.cursor.execute(query, (hashed_pw, employee_id))
+        self.cursor.execute(query, (password_hash, employee_id))
         self.conn.commit()
 
+    def find_employee_credentials(self, first_name, last_name):
+        """
+        Look up the login record of an employee by name (served by idx_employees_name).
+
+        Returns:
+            tuple: (id, password_hash, role), or None if no employee has that name.
+        """
+        return self.run("employee_credentials", (first_name, last_name)).fetchone()
+
     # logs in for an employee and returns there role and id
     def employee_login(self, first_name, last_name, password) -> tuple[str, str]:
         """Verify employee login and return their role if successful."""
-        query = "SELECT id, password_hash, role FROM employees WHERE first_name = ? AND last_name = ?"
-        self.cursor.execute(query, (first_name, last_name))
-        result = self.cursor.fetchone()
+        result = self.find_employee_credentials(first_name, last_name)
 
         if not result:
             raise Exception("Employee not found.")
@@ -322,36 +1450,44 @@ class Database:
         if not bcrypt.checkpw(password.encode(), hashed_pw):
             raise Exception("Incorrect password.")
 
+        if bcrypt_rounds_of(hashed_pw) != self.bcrypt_rounds:
+            self.store_password_hash(emp_id, self.hash_password(password))
+            self.events.emit(INFO, "password_rehashed", employee_id=emp_id, rounds=self.bcrypt_rounds)
+
         return (role, emp_id)
 
     # Purchase parts: Decrease quantity of part in store and increase store's balance
     def purchase_part(self, name, store_id, quantity):
         try:
-            # Check the current quantity of the part in the store by part name
-            self.cursor.execute("SELECT pno, quantity, price FROM parts WHERE name = ? AND store_id = ?", (name, store_id))
-            result = self.cursor.fetchone()
-            
+            # Take the stock only if enough is left, in one statement
+            result = self.run("take_stock_by_name", (quantity, name, store_id, quantity)).fetchone()
             if result:
-                pno, current_quantity, part_price = result
-                
-                if current_quantity >= quantity:
-                    new_quantity = current_quantity - quantity
-                    total_price = part_price * quantity
-                    
-                    # Update the quantity of the part in the store
-                    self.cursor.execute("UPDATE parts SET quantity = ? WHERE pno = ? AND store_id = ?", (new_quantity, pno, store_id))
-                    
-                    # Update the store's balance (increase by total price)
-                    self.cursor.execute("UPDATE stores SET balance = balance + ? WHERE store_id = ?", (total_price, store_id))
-                    
-                    self.conn.commit()
-                    print(f"Sold {quantity} of part '{name}' (pno: {pno}) for store {store_id}. Total amount: {total_price}. New quantity: {new_quantity}.")
-                else:
-                    print(f"Insufficient quantity of part '{name}' in store {store_id}. Available quantity: {current_quantity}.")
+                pno, new_quantity, price_cents, _ = result
+                total_cents = price_cents * quantity
+
+                # Update the store's balance (increase by total price)
+                self.run("ledger_entry", (store_id, total_cents, None))
+
+                self.conn.commit()
+                self.events.emit(INFO, "part_sold", pno=pno, store_id=store_id, quantity=quantity, total_cents=total_cents, remaining=new_quantity)
+                self._notify_parts("updated", [pno])
             else:
-                print(f"Part '{name}' not found in store {store_id}.")
+                self._stock_refused(quantity, store_id, name=name)
         except sqlite3.Error as e:
-            print(f"Error purchasing part: {e}")
+            self.events.emit(ERROR, "purchase_failed", store_id=store_id, error=e)
+            self.conn.rollback()
+
+    def _stock_refused(self, quantity, store_id, name=None, pno=None):
+        """Report why a conditional stock decrement matched no row."""
+        if pno is not None:
+            row = self.run("stock_by_pno", (pno, store_id)).fetchone()
+        else:
+            row = self.run("stock_by_name", (name, store_id)).fetchone()
+        key = {"pno": pno} if pno is not None else {"name": name}
+        if row:
+            self.events.emit(WARNING, "insufficient_stock", **key, store_id=store_id, available=row[1], requested=quantity)
+        else:
+            self.events.emit(WARNING, "part_not_found", **key, store_id=store_id)
 
     # Return parts: Increase quantity of part in store and decrease store's balance
     def return_part(self, name, store_id, quantity, employee_id: int):
@@ -359,71 +1495,49 @@ class Database:
         if not self.check_admin_access(employee_id):
             raise Exception("Admin access required for returns")
         try:
-            # Check the current quantity of the part in the store by part name
-            self.cursor.execute("SELECT pno, quantity, price FROM parts WHERE name = ? AND store_id = ?", (name, store_id))
-            result = self.cursor.fetchone()
-            
+            # Increase the quantity of the part in the store
+            result = self.run("restock_by_name", (quantity, name, store_id)).fetchone()
             if result:
-                pno, current_quantity, part_price = result
-                
-                # Increase the quantity of the part in the store
-                new_quantity = current_quantity + quantity
-                total_refund = part_price * quantity
-                
-                # Update the quantity of the part in the store
-                self.cursor.execute("UPDATE parts SET quantity = ? WHERE pno = ? AND store_id = ?", (new_quantity, pno, store_id))
-                
+                pno, new_quantity, price_cents = result
+                refund_cents = price_cents * quantity
+
                 # Update the store's balance (decrease by total refund amount)
-                self.cursor.execute("UPDATE stores SET balance = balance - ? WHERE store_id = ?", (total_refund, store_id))
+                self.run("ledger_entry", (store_id, -refund_cents, None))
                 
                 self.conn.commit()
-                print(f"Returned {quantity} of part '{name}' (pno: {pno}) for store {store_id}. Total refund: {total_refund}. New quantity: {new_quantity}.")
+                self.events.emit(INFO, "part_returned", pno=pno, store_id=store_id, quantity=quantity, refund_cents=refund_cents, remaining=new_quantity)
+                self._notify_parts("updated", [pno])
             else:
-                print(f"Part '{name}' not found in store {store_id}.")
+                self.events.emit(WARNING, "part_not_found", name=name, store_id=store_id)
         except sqlite3.Error as e:
-            print(f"Error returning part: {e}")
+            self.events.emit(ERROR, "return_failed", store_id=store_id, error=e)
 
     # Purchase part by pno: Decrease quantity of part in store and increase store's balance
     def purchase_part_by_pno(self, pno, store_id, quantity):
         try:
-            # Check the current quantity of the part in the store by pno
-            self.cursor.execute("SELECT quantity, price FROM parts WHERE pno = ? AND store_id = ?", (pno, store_id))
-            result = self.cursor.fetchone()
-            
+            # Take the stock only if enough is left, in one statement
+            result = self.run("take_stock_by_pno", (quantity, pno, store_id, quantity)).fetchone()
             if result:
-                current_quantity, part_price = result
-                
-                if current_quantity >= quantity:
-                    new_quantity = current_quantity - quantity
-                    total_price = part_price * quantity
-                    
-                    # Create a transaction
-                    self.cursor.execute(
-                        "INSERT INTO transactions (employee_id, store_id, total_price) VALUES (?, ?, ?)",
-                        (1, store_id, total_price)  
-                    )
-                    transaction_id = self.cursor.lastrowid
+                _, new_quantity, price_cents, _ = result
+                total_cents = price_cents * quantity
 
-                    # Add transaction details
-                    self.cursor.execute(
-                        "INSERT INTO transaction_details (transaction_id, part_id, quantity) VALUES (?, ?, ?)",
-                        (transaction_id, pno, quantity)
-                    )
+                # Create a transaction
+                transaction_id = self.run("insert_transaction", (1, store_id, total_cents, None, None)).lastrowid
 
-                    # Update the quantity of the part in the store
-                    self.cursor.execute("UPDATE parts SET quantity = ? WHERE pno = ? AND store_id = ?", (new_quantity, pno, store_id))
-                    
-                    # Update the store's balance (increase by total price)
-                    self.cursor.execute("UPDATE stores SET balance = balance + ? WHERE store_id = ?", (total_price, store_id))
-                    
-                    self.conn.commit()
-                    print(f"Sold {quantity} of part with pno {pno} for store {store_id}. Total amount: {total_price}. New quantity: {new_quantity}.")
-                else:
-                    print(f"Insufficient quantity of part with pno {pno} in store {store_id}. Available quantity: {current_quantity}.")
+                # Add transaction details
+                self.run("insert_detail", (transaction_id, pno, quantity))
+
+                # Update the store's balance (increase by total price)
+                self.run("ledger_entry", (store_id, total_cents, transaction_id))
+
+                self.conn.commit()
+                self.events.emit(INFO, "part_sold", pno=pno, store_id=store_id, quantity=quantity, total_cents=total_cents, remaining=new_quantity)
+                self._notify_parts("updated", [pno])
             else:
-                print(f"Part with pno {pno} not found in store {store_id}.")
+                self._stock_refused(quantity, store_id, pno=pno)
         except sqlite3.Error as e:
-            print(f"Error purchasing part: {e}")
+            self.events.emit(ERROR, "purchase_failed", store_id=store_id, error=e)
+            self.conn.rollback()
 
     # Return part by pno: Increase quantity of part in store and decrease store's balance
     def return_part_by_pno(self, pno, store_id, quantity, employee_id: int):
@@ -431,29 +1545,22 @@ class Database:
         if not self.check_admin_access(employee_id):
             raise Exception("Admin access required for returns")
         try:
-            # Check the current quantity of the part in the store by pno
-            self.cursor.execute("SELECT quantity, price FROM parts WHERE pno = ? AND store_id = ?", (pno, store_id))
-            result = self.cursor.fetchone()
-            
+            # Increase the quantity of the part in the store
+            result = self.run("restock_by_pno", (quantity, pno, store_id)).fetchone()
             if result:
-                current_quantity, part_price = result
-                
-                # Increase the quantity of the part in the store
-                new_quantity = current_quantity + quantity
-                total_refund = part_price * quantity
-                
-                # Update the quantity of the part in the store
-                self.cursor.execute("UPDATE parts SET quantity = ? WHERE pno = ? AND store_id = ?", (new_quantity, pno, store_id))
-                
+                _, new_quantity, price_cents = result
+                refund_cents = price_cents * quantity
+
                 # Update the store's balance (decrease by total refund amount)
-                self.cursor.execute("UPDATE stores SET balance = balance - ? WHERE store_id = ?", (total_refund, store_id))
+                self.run("ledger_entry", (store_id, -refund_cents, None))
                 
                 self.conn.commit()
-                print(f"Returned {quantity} of part with pno {pno} for store {store_id}. Total refund: {total_refund}. New quantity: {new_quantity}.")
+                self.events.emit(INFO, "part_returned", pno=pno, store_id=store_id, quantity=quantity, refund_cents=refund_cents, remaining=new_quantity)
+                self._notify_parts("updated", [pno])
             else:
-                print(f"Part with pno {pno} not found in store {store_id}.")
+                self.events.emit(WARNING, "part_not_found", pno=pno, store_id=store_id)
         except sqlite3.Error as e:
-            print(f"Error returning part: {e}")
+            self.events.emit(ERROR, "return_failed", store_id=store_id, error=e)
 
     def purchase_part_by_pno(self, parts, store_id):
         """
@@ -466,288 +1573,354 @@ class Database:
             store_id (int): The ID of the store where the purchase is made.
         """
         try:
-            total_price = 0.0
+            total_cents = 0
             transaction_id = None
 
             # Create a transaction
-            self.cursor.execute(
-                "INSERT INTO transactions (employee_id, store_id, total_price) VALUES (?, ?, ?)",
-                (1, store_id, 0.0)  
-            )
-            transaction_id = self.cursor.lastrowid
+            transaction_id = self.run("insert_transaction", (1, store_id, 0, None, None)).lastrowid
 
             for part in parts:
                 pno = part['pno']
                 quantity = part['quantity']
 
-                # Check the current quantity and price of the part
-                self.cursor.execute("SELECT quantity, price FROM parts WHERE pno = ? AND store_id = ?", (pno, store_id))
-                result = self.cursor.fetchone()
-
+                # Take the stock only if enough is left, in one statement
+                result = self.run("take_stock_by_pno", (quantity, pno, store_id, quantity)).fetchone()
                 if result:
-                    current_quantity, part_price = result
-
-                    if current_quantity >= quantity:
-                        new_quantity = current_quantity - quantity
-                        part_total_price = part_price * quantity
-                        total_price += part_total_price
-
-                        # Add transaction details
-                        self.cursor.execute(
-                            "INSERT INTO transaction_details (transaction_id, part_id, quantity) VALUES (?, ?, ?)",
-                            (transaction_id, pno, quantity)
-                        )
-
-                        # Update the quantity of the part in the store
-                        self.cursor.execute(
-                            "UPDATE parts SET quantity = ? WHERE pno = ? AND store_id = ?",
-                            (new_quantity, pno, store_id)
-                        )
-                    else:
-                        print(f"Insufficient quantity for part with pno {pno}. Available: {current_quantity}, Requested: {quantity}.")
+                    total_cents += result[2] * quantity
+
+                    # Add transaction details
+                    self.run("insert_detail", (transaction_id, pno, quantity))
                 else:
-                    print(f"Part with pno {pno} not found in store {store_id}.")
+                    self._stock_refused(quantity, store_id, pno=pno)
 
             # Update the total price of the transaction
-            self.cursor.execute(
-                "UPDATE transactions SET total_price = ? WHERE transaction_id = ?",
-                (total_price, transaction_id)
-            )
+            self.run("set_transaction_total", (total_cents, transaction_id))
 
             # Update the store's balance
-            self.cursor.execute(
-                "UPDATE stores SET balance = balance + ? WHERE store_id = ?",
-                (total_price, store_id)
-            )
+            self.run("ledger_entry", (store_id, total_cents, transaction_id))
 
             self.conn.commit()
-            print(f"Transaction {transaction_id} completed. Total price: {total_price}.")
+            self.events.emit(INFO, "purchase_completed", transaction_id=transaction_id, store_id=store_id, total_cents=total_cents)
+            self._notify_parts("updated", [part['pno'] for part in parts])
             return transaction_id
 
         except sqlite3.Error as e:
-            print(f"Error purchasing parts: {e}")
+            self.events.emit(ERROR, "purchase_failed", store_id=store_id, error=e)
             self.conn.rollback()
             return None
 
 
-    def create_purchase(self, parts: List[PartSold], store_id: int, employee_id: int = 1, discount_id: int = None) -> int:
-        """Create a purchase transaction for multiple parts with discount support."""
+    def create_purchase(self, parts: List[PartSold], store_id: int, employee_id: int = 1, discount_id: int = None,
+                        idempotency_key: str = None) -> int:
+        """
+        Create a purchase transaction for multiple parts with discount support.
+
+        A purchase with an `idempotency_key` that was already recorded is not applied
+        again; the ID of the existing transaction is returned instead.
+        """
         try:
-            tax_rate = self.get_store_tax_rate(store_id)
-            subtotal = 0.0
-            discounted_total = 0.0
-            transaction_id = None
-            discount_amount = 0.0
+            recorded = self._record_purchase(parts, store_id, employee_id, discount_id, idempotency_key)
+            self.conn.commit()
+        except Exception as e:
+            self.events.emit(ERROR, "purchase_failed", store_id=store_id, error=e)
+            self.conn.rollback()
+            return None
+        if not recorded.duplicate:
+            totals = recorded.totals
+            self.events.emit(INFO, "purchase_completed", transaction_id=recorded.transaction_id, store_id=store_id,
+                             subtotal_cents=totals.subtotal_cents, discount_cents=totals.discount_cents,
+                             tax_cents=totals.tax_cents, total_cents=totals.total_cents)
+            self._notify_parts("updated", recorded.pnos)
+        return recorded.transaction_id
+
+    def _record_purchase(self, parts: List[PartSold], store_id: int, employee_id: int, discount_id: int = None,
+                         idempotency_key: str = None) -> RecordedPurchase:
+        """
+        Write a purchase without committing, so callers can batch several in one transaction.
 
-            # Calculate subtotal and discount
-            for part in parts:
-                part_subtotal = part.unit_price * part.quantity
-                subtotal += part_subtotal
-            if discount_id:
-                # Get discount info
-                self.cursor.execute("SELECT discount_type, value FROM discounts WHERE discount_id = ?", (discount_id,))
-                row = self.cursor.fetchone()
-                if row:
-                    dtype, dval = row
-                    if dtype == "percentage":
-                        discount_amount = round(subtotal * (float(dval) / 100), 2)
-                    elif dtype == "fixed":
-                        discount_amount = min(round(float(dval), 2), subtotal)
-            discounted_total = max(subtotal - discount_amount, 0)
-
-            # Create initial transaction (store discount_id)
-            self.cursor.execute(
-                "INSERT INTO transactions (employee_id, store_id, total_price, discount_id) VALUES (?, ?, ?, ?)",
-                (employee_id, store_id, 0.0, discount_id)
-            )
-            transaction_id = self.cursor.lastrowid
+        Raises:
+            Exception: A part is missing or short on stock. The caller rolls back.
+        """
+        if idempotency_key is not None:
+            self.run("transaction_by_key", (idempotency_key,))
+            existing = self.cursor.fetchone()
+            if existing:
+                return RecordedPurchase(existing[0], None, [], True)
 
-            # Process each part
-            for part in parts:
-                self.cursor.execute(
-                    "SELECT pno, quantity FROM parts WHERE name = ? AND store_id = ?", 
-                    (part.name, store_id)
-                )
-                result = self.cursor.fetchone()
-                if result and result[1] >= part.quantity:
-                    pno, current_quantity = result
-                    new_quantity = current_quantity - part.quantity
-                    self.cursor.execute(
-                        "UPDATE parts SET quantity = ? WHERE pno = ?",
-                        (new_quantity, pno)
-                    )
-                    self.cursor.execute(
-                        "INSERT INTO transaction_details (transaction_id, part_id, quantity) VALUES (?, ?, ?)",
-                        (transaction_id, pno, part.quantity)
-                    )
-                else:
-                    raise Exception(f"Insufficient quantity for {part.name}")
+        tax_rate = self.get_store_tax_rate(store_id)
+        discount_cents = 0
 
-            # Calculate final amounts
-            tax_amount = discounted_total * tax_rate
-            final_total = discounted_total + tax_amount
+        # Calculate subtotal and discount
+        subtotal = sum(line_total(part.unit_cents, part.quantity, part.discount_percent) for part in parts)
+        if discount_id:
+            # Get discount info
+            row = self.run("discount_terms", (discount_id,)).fetchone()
+            if row:
+                discount_cents = transaction_discount(subtotal, row[0], row[1])
+        totals = price_totals(subtotal, tax_rate, discount_cents)
+
+        # Create initial transaction (store discount_id)
+        self.run("insert_transaction", (employee_id, store_id, 0, discount_id, idempotency_key))
+        transaction_id = self.cursor.lastrowid
+
+        # Process each part, by pno when the caller knows it
+        sold_pnos = []
+        for part in parts:
+            if part.part_id is not None:
+                result = self.run("take_stock_by_pno", (part.quantity, part.part_id, store_id, part.quantity)).fetchone()
+            else:
+                result = self.run("take_stock_by_name", (part.quantity, part.name, store_id, part.quantity)).fetchone()
+            if not result:
+                raise Exception(f"Insufficient quantity for {part.name}")
+            sold_pnos.append(result[0])
+            self.run("insert_sale_line", (transaction_id, result[0], part.quantity, result[3], part.unit_cents,
+                                          part.discount_percent,
+                                          line_total(part.unit_cents, part.quantity, part.discount_percent)))
+
+        # Update transaction total, keeping the discount and tax it was sold with
+        self.run("set_transaction_amounts", (totals.total_cents, totals.discount_cents, totals.tax_cents,
+                                             transaction_id))
+
+        # Update store balance (in this transaction; update_store_balance would commit)
+        self.run("ledger_entry", (store_id, totals.total_cents, transaction_id))
+        return RecordedPurchase(transaction_id, totals, sold_pnos, False)
+
+    def record_purchases(self, requests: List[PurchaseRequest]) -> list:
+        """
+        Record several purchases in one transaction and one commit.
 
-            # Update transaction total
-            self.cursor.execute(
-                "UPDATE transactions SET total_price = ? WHERE transaction_id = ?",
-                (final_total, transaction_id)
-            )
+        Each purchase runs under its own savepoint, so one that cannot be applied (short
+        stock, unknown employee) fails on its own while the rest are committed together.
 
-            # Update store balance
-            self.update_store_balance(store_id, final_total, is_addition=True)
+        Returns:
+            list: A RecordedPurchase, or the Exception that rejected it, per request.
 
+        Raises:
+            sqlite3.OperationalError: The database is locked or unreachable. Nothing
+                is committed.
+        """
+        outcomes = []
+        try:
+            if not self.conn.in_transaction:
+                self.cursor.execute("BEGIN")
+            for request in requests:
+                self.cursor.execute("SAVEPOINT purchase")
+                try:
+                    outcomes.append(self._record_purchase(*request))
+                except sqlite3.OperationalError:
+                    raise
+                except Exception as e:
+                    self.cursor.execute("ROLLBACK TO purchase")
+                    outcomes.append(e)
+                self.cursor.execute("RELEASE purchase")
             self.conn.commit()
-            print(f"Purchase completed - Subtotal: {subtotal:.2f}, Discounted: {discounted_total:.2f}, Tax: {tax_amount:.2f}, Total: {final_total:.2f}")
-            return transaction_id
-
         except Exception as e:
-            print(f"Error in create_purchase: {e}")
             self.conn.rollback()
-            return None
+            self.events.emit(WARNING, "purchases_failed", purchases=len(requests), error=e)
+            raise
+        self._notify_parts("updated", [
+            pno for outcome in outcomes if isinstance(outcome, RecordedPurchase) for pno in outcome.pnos
+        ])
+        return outcomes
+
+    def replay_sales(self, entries: List[JournalEntry]) -> SyncResult:
+        """
+        Record journaled sales as purchases in one transaction (see record_purchases).
+
+        Entries whose idempotency key was already recorded count as synced without being
+        applied twice.
+
+        Raises:
+            sqlite3.OperationalError: The database is locked or unreachable. Nothing
+                from the batch is committed and it can be replayed later.
+        """
+        outcomes = self.record_purchases([
+            PurchaseRequest(entry.parts, entry.store_id, entry.employee_id, entry.discount_id, entry.idempotency_key)
+            for entry in entries
+        ])
+        synced, rejected, pnos = [], [], []
+        for entry, outcome in zip(entries, outcomes):
+            if isinstance(outcome, Exception):
+                rejected.append((entry.seq, str(outcome)))
+                self.events.emit(WARNING, "replayed_sale_rejected", seq=entry.seq, error=outcome)
+            else:
+                synced.append((entry.seq, outcome.transaction_id))
+                pnos.extend(outcome.pnos)
+        self.events.emit(INFO, "sales_replayed", synced=len(synced), rejected=len(rejected))
+        return SyncResult(synced, rejected, tuple(dict.fromkeys(pnos)))
 
     def create_return(self, parts: List[PartSold], store_id: int, employee_id: int) -> int:
         """Create a return transaction with admin check."""
         if not self.check_admin_access(employee_id):
             raise Exception("Admin access required for returns")
         try:
-            total_refund = 0.0
+            refund_cents = 0
+            returned_pnos = []
             # Create a transaction
-            self.cursor.execute(
-                "INSERT INTO transactions (employee_id, store_id, total_price) VALUES (?, ?, ?)",
-                (employee_id, store_id, 0.0)
-            )
-            transaction_id = self.cursor.lastrowid
+            transaction_id = self.run("insert_transaction", (employee_id, store_id, 0, None, None)).lastrowid
 
             # Process parts and update quantities
             for part in parts:
-                # Fetch part details by name
-                self.cursor.execute("SELECT pno, quantity, price FROM parts WHERE name = ? AND store_id = ?", (part.name, store_id))
-                result = self.cursor.fetchone()
+                # Increase the quantity of the part in the store
+                if part.part_id is not None:
+                    result = self.run("restock_by_pno", (part.quantity, part.part_id, store_id)).fetchone()
+                else:
+                    result = self.run("restock_by_name", (part.quantity, part.name, store_id)).fetchone()
 
                 if result:
-                    pno, current_quantity, part_price = result
-
-                    # Increase the quantity of the part in the store
-                    new_quantity = current_quantity + part.quantity
-                    part_total_refund = part_price * part.quantity
-                    total_refund += part_total_refund
+                    pno, new_quantity, price_cents = result
+                    refund_cents += price_cents * part.quantity
 
                     # Add transaction details
-                    self.cursor.execute(
-                        "INSERT INTO transaction_details (transaction_id, part_id, quantity) VALUES (?, ?, ?)",
-                        (transaction_id, pno, -part.quantity)  # Negative quantity for returns
-                    )
-
-                    # Update the quantity of the part in the store
-                    self.cursor.execute(
-                        "UPDATE parts SET quantity = ? WHERE pno = ? AND store_id = ?",
-                        (new_quantity, pno, store_id)
-                    )
-                    print(f"Updated part '{part.name}' (pno: {pno}) quantity to {new_quantity}.")
+                    self.run("insert_detail", (transaction_id, pno, -part.quantity))  # Negative quantity for returns
+                    returned_pnos.append(pno)
+                    self.events.emit(DEBUG, "stock_restored", pno=pno, store_id=store_id, remaining=new_quantity)
                 else:
-                    print(f"Part '{part.name}' not found in store {store_id}.")
+                    self.events.emit(WARNING, "part_not_found", name=part.name, store_id=store_id)
 
             # Log the return in returns table
-            self.cursor.execute(
-                """INSERT INTO returns 
-                   (transaction_id, original_transaction_id, total_refund, store_id, employee_id)
-                   VALUES (?, NULL, ?, ?, ?)""",
-                (transaction_id, total_refund, store_id, employee_id)
-            )
+            self.run("insert_return", (transaction_id, None, refund_cents, store_id, employee_id))
 
             self.conn.commit()
+            self._notify_parts("updated", returned_pnos)
             return transaction_id
 
         except sqlite3.Error as e:
-            print(f"Error creating return: {e}")
+            self.events.emit(ERROR, "return_failed", store_id=store_id, error=e)
             self.conn.rollback()
             return None
 
     def return_by_transaction_id(self, transaction_id: int, employee_id: int) -> int:
         """Process a return based on transaction ID with admin check."""
-        if not self.check_admin_access(employee_id):
-            raise Exception("Admin access required for returns")
-        try:
-            # Get original transaction details with discount info
-            transaction_details = self.get_transaction_details(transaction_id)
-            if not transaction_details:
-                raise Exception(f"Transaction with ID {transaction_id} not found.")
-
-            store_id = self.cursor.execute(
-                "SELECT store_id FROM transactions WHERE transaction_id = ?", 
-                (transaction_id,)
-            ).fetchone()[0]
+        return self.return_transactions([transaction_id], employee_id).get(transaction_id)
 
-            # Get store's tax rate
-            self.cursor.execute("SELECT tax_rate FROM stores WHERE store_id = ?", (store_id,))
-            tax_rate = self.cursor.fetchone()[0]
+    def return_transactions(self, transaction_ids, employee_id: int) -> dict:
+        """
+        Return whole receipts, any number at once, in one transaction.
 
-            # Create a new return transaction
-            self.cursor.execute(
-                "INSERT INTO transactions (employee_id, store_id, total_price, discount_id) VALUES (?, ?, ?, ?)",
-                (employee_id, store_id, 0.0, transaction_details.discount_id)  
-            )
-            return_transaction_id = self.cursor.lastrowid
+        Every line still returnable on each receipt is returned, so a receipt that was
+        partly returned before refunds only the rest. Unknown transaction IDs and receipts
+        with nothing left to return are skipped.
 
-            total_refund = 0.0
+        Returns:
+            dict: {original transaction_id: return transaction_id}. Empty on failure.
 
-            # Process each part in the original transaction
-            for part in transaction_details.parts_sold:
-                # Update inventory quantity
-                self.cursor.execute(
-                    "SELECT quantity FROM parts WHERE name = ? AND store_id = ?", (part.name, store_id)
-                )
-                current_quantity = self.cursor.fetchone()[0]
-                new_quantity = current_quantity + abs(part.quantity)
-                self.cursor.execute(
-                    "UPDATE parts SET quantity = ? WHERE name = ? AND store_id = ?",
-                    (new_quantity, part.name, store_id)
-                )
-
-                # Calculate refund with discount consideration
-                part_refund = abs(part.quantity) * part.unit_price
-                total_refund += part_refund
-                part.part_id = self.get_part_by_name(part.name, store_id).part_id
-
-                # Add return transaction details
-                self.cursor.execute(
-                    "INSERT INTO transaction_details (transaction_id, part_id, quantity) VALUES (?, ?, ?)",
-                    (return_transaction_id, part.part_id, -abs(part.quantity))
-                )
+        Raises:
+            Exception: The employee is not an admin.
+        """
+        return self._process_returns(dict.fromkeys(transaction_ids), employee_id)
 
-            # Apply the same discount as original transaction
-            if transaction_details.discount_amount > 0:
-                total_refund = max(total_refund - transaction_details.discount_amount, 0)
+    def return_lines(self, transaction_id: int, quantities: Dict[int, int], employee_id: int) -> int:
+        """
+        Return part of a receipt.
 
-            # Calculate tax on discounted amount
-            tax_amount = total_refund * tax_rate
-            total_with_tax = self.format_decimal(total_refund + tax_amount)
+        Args:
+            transaction_id: The original sale
+            quantities: {pno: quantity} to return; at most what returnable_lines allows
 
-            # Update return transaction total
-            self.cursor.execute(
-                "UPDATE transactions SET total_price = ? WHERE transaction_id = ?",
-                (-total_with_tax, return_transaction_id)
-            )
+        Returns:
+            int: The return transaction ID, or None if the lines cannot be returned.
 
-            # Log the return
-            self.cursor.execute(
-                """INSERT INTO returns 
-                   (transaction_id, original_transaction_id, total_refund, store_id, employee_id)
-                   VALUES (?, ?, ?, ?, ?)""",
-                (return_transaction_id, transaction_id, total_with_tax, store_id, employee_id)
-            )
+        Raises:
+            Exception: The employee is not an admin.
+        """
+        return self._process_returns({transaction_id: quantities}, employee_id).get(transaction_id)
 
-            # Update store balance
-            self.update_store_balance(store_id, total_with_tax, is_addition=False)
+    def returnable_lines(self, transaction_id: int) -> List[PartSold]:
+        """Lines of a sale with the quantity that can still be returned. Fully returned lines are left out."""
+        lines = self.run("returnable_lines", (json.dumps([transaction_id]),)).fetchall()
+        return [PartSold(name, left, unit_cents, line_total(unit_cents, left, discount_percent), discount_percent, pno)
+                for _, _, pno, _, left, name, unit_cents, discount_percent, _ in lines if left > 0]
 
+    def _process_returns(self, requests: dict, employee_id: int) -> dict:
+        """
+        Return receipts or parts of them: {transaction_id: {pno: quantity} or None for everything left}.
+
+        Lines are read, restocked and written with one set-based statement each, keyed
+        by pno, however many receipts are returned. Each return line points at the sale
+        line it returns, so what is still returnable is an indexed lookup per line and a
+        line cannot be returned twice; the write lock is taken before reading so two
+        registers cannot both return the same line. Refunds use the discount and tax the
+        receipt was sold with, prorated over the sale lines returned so far, less what
+        earlier returns already refunded; the return that empties a receipt refunds
+        exactly what is left of the amount paid.
+        """
+        if not self.check_admin_access(employee_id):
+            raise Exception("Admin access required for returns")
+        ids = json.dumps(list(requests))
+        try:
+            if not self.conn.in_transaction:
+                self.cursor.execute("BEGIN IMMEDIATE")
+            receipts = {row[0]: row[1:] for row in self.run("return_receipts", (ids,))}
+            lines = {transaction_id: [] for transaction_id in receipts}
+            for transaction_id, *line in self.run("returnable_lines", (ids,)):
+                lines[transaction_id].append(line)
+            for missing in requests.keys() - receipts.keys():
+                self.events.emit(WARNING, "transaction_not_found", transaction_id=missing)
+
+            returned = {}
+            restock, details, totals, ledger, logged = {}, [], [], [], []
+            for transaction_id, (store_id, discount_id, paid_cents, discount_cents, tax_cents,
+                                 refunded_cents) in receipts.items():
+                wanted = requests[transaction_id]
+                wanted = dict(wanted) if wanted is not None else None
+                picked = []
+                sale_subtotal = returned_before = returned_after = 0
+                remaining = False
+                for detail_id, pno, sold, left, name, unit_cents, discount_percent, line_cents in lines[transaction_id]:
+                    quantity = left if wanted is None else min(left, wanted.get(pno, 0))
+                    sale_subtotal += line_cents
+                    returned_before += line_total(unit_cents, sold - left, discount_percent)
+                    returned_after += line_total(unit_cents, sold - left + quantity, discount_percent)
+                    remaining = remaining or quantity < left
+                    if quantity > 0:
+                        picked.append((detail_id, pno, quantity, name, unit_cents, discount_percent))
+                        if wanted is not None:
+                            wanted[pno] -= quantity
+                short = {pno: quantity for pno, quantity in (wanted or {}).items() if quantity > 0}
+                if short or not picked:
+                    self.events.emit(WARNING, "return_refused", transaction_id=transaction_id,
+                                     not_returnable=short or None)
+                    continue
+
+                return_id = self.run("insert_transaction", (employee_id, store_id, 0, discount_id, None)).lastrowid
+                returned[transaction_id] = return_id
+                refund_subtotal = 0
+                for detail_id, pno, quantity, name, unit_cents, discount_percent in picked:
+                    line_cents = line_total(unit_cents, quantity, discount_percent)
+                    restock[pno] = restock.get(pno, 0) + quantity
+                    details.append((return_id, pno, -quantity, detail_id, name, unit_cents, discount_percent,
+                                    -line_cents))
+                    refund_subtotal += line_cents
+                # Refunded to date is the sale's discount and tax prorated over every line returned
+                # so far, so rounding never drifts across partial returns; the last one settles the rest
+                if remaining and sale_subtotal:
+                    discount = (discount_cents * returned_after // sale_subtotal
+                                - discount_cents * returned_before // sale_subtotal)
+                    refund = (returned_after - discount_cents * returned_after // sale_subtotal
+                              + tax_cents * returned_after // sale_subtotal - refunded_cents)
+                else:
+                    discount = discount_cents - discount_cents * returned_before // sale_subtotal if sale_subtotal else 0
+                    refund = paid_cents - refunded_cents
+                totals.append((-refund, -discount, refund_subtotal - discount - refund, return_id))
+                ledger.append((store_id, -refund, return_id))
+                logged.append((return_id, transaction_id, refund, store_id, employee_id))
+
+            self.cursor.executemany(STATEMENTS["restock"], [(quantity, pno) for pno, quantity in restock.items()])
+            self.cursor.executemany(STATEMENTS["insert_return_detail"], details)
+            self.cursor.executemany(STATEMENTS["set_transaction_amounts"], totals)
+            self.cursor.executemany(STATEMENTS["insert_return"], logged)
+            self.cursor.executemany(STATEMENTS["ledger_entry"], ledger)
             self.conn.commit()
-            print(f"Return processed - Original total: {transaction_details.total_price}, Refund amount: {total_with_tax}")
-            return return_transaction_id
-
         except Exception as e:
-            print(f"Error processing return: {e}")
+            self.events.emit(ERROR, "return_failed", original_transaction_ids=list(requests), error=e)
             self.conn.rollback()
-            return None
+            return {}
+        for return_id, transaction_id, refund, *_ in logged:
+            self.events.emit(INFO, "return_completed", transaction_id=return_id,
+                             original_transaction_id=transaction_id, refund_cents=refund)
+        self._notify_parts("updated", list(restock))
+        return returned
 
     def reset_db(self):
         """Reset the database by dropping all tables."""
@@ -759,92 +1932,152 @@ class Database:
             self.cursor.execute("DROP TABLE IF EXISTS parts;")
             self.cursor.execute("PRAGMA foreign_keys=ON;")  # Re-enable foreign key checks
             self.conn.commit()
-            print("All tables have been dropped and the database has been reset.")
+            self.events.emit(WARNING, "database_reset", db=self.db_name)
         except Exception as e:
-            print(f"Error resetting database: {e}")
+            self.events.emit(ERROR, "database_reset_failed", error=e)
             self.conn.rollback()
 
     # Get all stores
-    def get_stores(self):
+    def get_stores(self) -> List[StoreRow]:
+        try:
+            return [StoreRow._make(row) for row in self.run("store_balances").fetchall()]
+        except sqlite3.Error as e:
+            self.events.emit(ERROR, "query_failed", query="get_stores", error=e)
+            return []
+
+    def store_balance_cents(self, store_id: int) -> int:
+        """A store's balance: the rolled-up value plus the ledger entries after it."""
+        row = self.run("store_balance", (store_id,)).fetchone()
+        return row[0] if row else 0
+
+    def rollup_balances(self) -> int:
+        """
+        Fold the ledger tail of every store into stores.balance_cents.
+
+        Ledger entries are kept; each store records the last entry folded in, and the
+        balance reads add only the entries after it. Meant to be called periodically;
+        balance reads never fold. Nothing is folded while the connection has a transaction
+        open, which belongs to the caller, or is read-only, as reporting snapshots are.
+        Returns the entries folded.
+        """
+        if self.conn.in_transaction or self.cursor.execute("PRAGMA query_only").fetchone()[0]:
+            self.events.emit(DEBUG, "balance_rollup_skipped", in_transaction=self.conn.in_transaction)
+            return 0
+        try:
+            self.cursor.execute("BEGIN IMMEDIATE")
+            high = self.cursor.execute("SELECT COALESCE(MAX(entry_id), 0) FROM balance_ledger").fetchone()[0]
+            folded = self.cursor.execute(
+                "SELECT COUNT(*) FROM balance_ledger l JOIN stores s ON s.store_id = l.store_id "
+                "WHERE l.entry_id > s.ledger_rolled_up_to"
+            ).fetchone()[0]
+            self.cursor.execute("""
+                UPDATE stores
+                SET balance_cents = balance_cents + COALESCE((
+                        SELECT SUM(l.amount_cents) FROM balance_ledger l
+                        WHERE l.store_id = stores.store_id
+                        AND l.entry_id > stores.ledger_rolled_up_to AND l.entry_id <= ?
+                    ), 0),
+                    ledger_rolled_up_to = ?
+                WHERE ledger_rolled_up_to < ?
+            """, (high, high, high))
+            self.conn.commit()
+        except sqlite3.Error as e:
+            self.events.emit(ERROR, "balance_rollup_failed", error=e)
+            self.conn.rollback()
+            return 0
+        self.events.emit(DEBUG, "balances_rolled_up", entries=folded, up_to=high)
+        return folded
+
+    def get_store_summaries(self) -> List[StoreSummary]:
+        """
+        Fetches every store with its tax rate and inventory value in one grouped query.
+
+        Returns:
+            List[StoreSummary]: One row per store, in store_id order.
+        """
         try:
-            self.cursor.execute("SELECT * FROM stores")
-            stores = self.cursor.fetchall()
-            return stores
+            query = """
+            SELECT s.store_id, s.store_name, s.tax_rate, COALESCE(SUM(p.price_cents * p.quantity), 0)
+            FROM stores s
+            LEFT JOIN parts p ON p.store_id = s.store_id
+            GROUP BY s.store_id
+            ORDER BY s.store_id;
+            """
+            self.cursor.execute(query)
+            return [StoreSummary._make(row) for row in self.cursor.fetchall()]
         except sqlite3.Error as e:
-            print(f"Error fetching stores: {e}")
+            self.events.emit(ERROR, "query_failed", query="get_store_summaries", error=e)
             return []
 
-    # Get all employees
-    def get_employees(self):
+    # Get all employees (password hashes are never returned)
+    def get_employees(self) -> List[EmployeeRow]:
+        try:
+            self.cursor.execute("SELECT id, first_name, last_name, role, store_id FROM employees")
+            return [EmployeeRow._make(row) for row in self.cursor.fetchall()]
+        except sqlite3.Error as e:
+            self.events.emit(ERROR, "query_failed", query="get_employees", error=e)
+            return []
+
+    def get_store_employees(self, store_id: int) -> List[EmployeeRow]:
+        """
+        Fetches the employees of one store, served by idx_employees_store.
+
+        Args:
+            store_id (int): The ID of the store. None selects employees without a store.
+
+        Returns:
+            List[EmployeeRow]: The store's employees, without password hashes.
+        """
         try:
-            self.cursor.execute("SELECT * FROM employees")
-            employees = self.cursor.fetchall()
-            return employees
+            query = """
+            SELECT id, first_name, last_name, role, store_id
+            FROM employees
+            WHERE store_id IS ?
+            ORDER BY id;
+            """
+            self.cursor.execute(query, (store_id,))
+            return [EmployeeRow._make(row) for row in self.cursor.fetchall()]
         except sqlite3.Error as e:
-            print(f"Error fetching employees: {e}")
+            self.events.emit(ERROR, "query_failed", query="get_store_employees", store_id=store_id, error=e)
             return []
 
     # Get all parts
-    def get_parts(self):
+    def get_parts(self) -> List[Part]:
         try:
-            self.cursor.execute("SELECT * FROM parts")
-            parts = self.cursor.fetchall()
-            return parts
+            self.cursor.execute("SELECT pno, name, price_cents, store_id, quantity FROM parts")
+            return [Part(part_id=p[0], name=p[1], price_cents=p[2], store_id=p[3], quantity=p[4]) for p in self.cursor.fetchall()]
         except sqlite3.Error as e:
-            print(f"Error fetching parts: {e}")
+            self.events.emit(ERROR, "query_failed", query="get_parts", error=e)
             return []
 
     def get_transaction_details(self, transaction_id) -> TransactionDetails:
         """Fetches and returns all details of a specific transaction as a structured object."""
-        transaction_query = """
-        SELECT t.transaction_id, t.transaction_date, t.total_price, 
-               e.first_name || ' ' || e.last_name AS employee_name, 
-               s.store_name, t.discount_id
-        FROM transactions t
-        JOIN employees e ON t.employee_id = e.id
-        JOIN stores s ON t.store_id = s.store_id
-        WHERE t.transaction_id = ?;
-        """
-        self.cursor.execute(transaction_query, (transaction_id,))
-        transaction = self.cursor.fetchone()
+        transaction = self.run("transaction_header", (transaction_id,)).fetchone()
         if not transaction:
             raise Exception("No trasaction found")
         # Fetch all parts involved in the transaction
-        parts_query = """
-        SELECT p.name, td.quantity, p.price, (td.quantity * p.price) AS total_part_price
-        FROM transaction_details td
-        JOIN parts p ON td.part_id = p.pno
-        WHERE td.transaction_id = ?;
-        """
-        self.cursor.execute(parts_query, (transaction_id,))
-        parts = self.cursor.fetchall()
+        parts = self.run("transaction_lines", (transaction_id,)).fetchall()
         # Create a list of PartSold objects
-        parts_sold = [PartSold(name=p[0], quantity=p[1], unit_price=p[2], total_price=p[3]) for p in parts]
-        # Fetch discount info if present
-        discount_id = transaction[5]
+        parts_sold = [PartSold(*p) for p in parts]
+        # Discount and tax are as sold; only the discount's name is looked up
+        discount_id, discount_cents, tax_cents = transaction[5:8]
         discount_name = None
-        discount_amount = 0.0
-        subtotal = sum(p.total_price for p in parts_sold)
+        subtotal = sum(p.total_cents for p in parts_sold)
         if discount_id:
-            self.cursor.execute("SELECT name, discount_type, value FROM discounts WHERE discount_id = ?", (discount_id,))
-            drow = self.cursor.fetchone()
+            drow = self.run("discount_by_id", (discount_id,)).fetchone()
             if drow:
                 discount_name = drow[0]
-                dtype, dval = drow[1], float(drow[2])
-                if dtype == "percentage":
-                    discount_amount = round(subtotal * (dval / 100), 2)
-                elif dtype == "fixed":
-                    discount_amount = min(round(dval, 2), subtotal)
         # Return the structured TransactionDetails object
         return TransactionDetails(
             transaction_id=transaction[0],
             date=transaction[1],
-            total_price=transaction[2],
+            total_cents=transaction[2],
             employee=transaction[3],
             store=transaction[4],
             parts_sold=parts_sold,
-            subtotal=subtotal,
-            discount_amount=discount_amount,
+            subtotal_cents=subtotal,
+            discount_cents=discount_cents,
+            tax_cents=tax_cents,
             discount_id=discount_id,
             discount_name=discount_name
         )
@@ -854,60 +2087,45 @@ class Database:
         Fetches and returns all transaction details for a specific store.
         """
         try:
-            # Query to fetch transactions for the given store (include discount_id)
-            transactions_query = """
-            SELECT t.transaction_id, t.transaction_date, t.total_price, 
-                   e.first_name || ' ' || e.last_name AS employee_name,
-                   t.discount_id
-            FROM transactions t
-            JOIN employees e ON t.employee_id = e.id
-            WHERE t.store_id = ?
-            ORDER BY t.transaction_date DESC;
-            """
-            self.cursor.execute(transactions_query, (store_id,))
-            transactions = self.cursor.fetchall()
+            # Transactions of the store, with discount_id
+            transactions = self.run("sales_report_transactions", (store_id,)).fetchall()
             if not transactions:
-                print(f"No transactions found for store ID {store_id}.")
+                self.events.emit(DEBUG, "no_transactions", store_id=store_id)
                 return []
-            # Fetch details for each transaction
+            # Fetch details for each transaction. Repeated strings (store label, employee and
+            # part names) and discount rows are shared between records instead of copied.
             sales_report = []
+            store_label = f"Store ID {store_id}"
+            strings = {}
+            discounts = {}
             for transaction in transactions:
-                transaction_id, transaction_date, total_price, employee_name, discount_id = transaction
+                (transaction_id, transaction_date, total_cents, employee_name,
+                 discount_id, discount_cents, tax_cents) = transaction
+                employee_name = strings.setdefault(employee_name, employee_name)
                 # Fetch parts sold in this transaction
-                parts_query = """
-                SELECT p.name, td.quantity, p.price, (td.quantity * p.price) AS total_part_price
-                FROM transaction_details td
-                JOIN parts p ON td.part_id = p.pno
-                WHERE td.transaction_id = ?;
-                """
-                self.cursor.execute(parts_query, (transaction_id,))
-                parts = self.cursor.fetchall()
+                parts = self.run("transaction_lines", (transaction_id,)).fetchall()
                 # Create a list of PartSold objects
-                parts_sold = [PartSold(name=p[0], quantity=p[1], unit_price=p[2], total_price=p[3]) for p in parts]
-                # Fetch discount info if present
+                parts_sold = [PartSold(strings.setdefault(p[0], p[0]), *p[1:]) for p in parts]
+                # Discount and tax are as sold; only the discount's name is looked up
                 discount_name = None
-                discount_amount = 0.0
-                subtotal = sum(p.total_price for p in parts_sold)
+                subtotal = sum(p.total_cents for p in parts_sold)
                 if discount_id:
-                    self.cursor.execute("SELECT name, discount_type, value FROM discounts WHERE discount_id = ?", (discount_id,))
-                    drow = self.cursor.fetchone()
+                    if discount_id not in discounts:
+                        discounts[discount_id] = self.run("discount_by_id", (discount_id,)).fetchone()
+                    drow = discounts[discount_id]
                     if drow:
                         discount_name = drow[0]
-                        dtype, dval = drow[1], float(drow[2])
-                        if dtype == "percentage":
-                            discount_amount = round(subtotal * (dval / 100), 2)
-                        elif dtype == "fixed":
-                            discount_amount = min(round(dval, 2), subtotal)
                 # Add transaction details to the report
                 sales_report.append(TransactionDetails(
                     transaction_id=transaction_id,
                     date=transaction_date,
-                    total_price=total_price,
+                    total_cents=total_cents,
                     employee=employee_name,
-                    store=f"Store ID {store_id}",
+                    store=store_label,
                     parts_sold=parts_sold,
-                    subtotal=subtotal,
-                    discount_amount=discount_amount,
+                    subtotal_cents=subtotal,
+                    discount_cents=discount_cents,
+                    tax_cents=tax_cents,
                     discount_id=discount_id,
                     discount_name=discount_name
                 ))
@@ -915,9 +2133,295 @@ class Database:
             return sales_report
 
         except sqlite3.Error as e:
-            print(f"Error fetching sales report for store ID {store_id}: {e}")
+            self.events.emit(ERROR, "query_failed", query="SalesReport", store_id=store_id, error=e)
+            return []
+
+    def sales_report_lines(self, store_id: int, chunk_size: int = 1000) -> Iterator[str]:
+        """
+        Yields the detailed text sales report of a store line by line, newest first.
+
+        Lines are read from one cursor `chunk_size` rows at a time and only the lines of
+        the current transaction are held, so memory stays flat for any report size.
+
+        Args:
+            store_id (int): The ID of the store.
+            chunk_size (int): Rows fetched per round trip.
+
+        Yields:
+            str: Report lines, each ending in a newline.
+        """
+        query = """
+        SELECT t.transaction_id, t.transaction_date, t.total_cents,
+               e.first_name || ' ' || e.last_name, d.name, t.discount_cents,
+               td.part_name, td.quantity, td.unit_cents, td.line_cents
+        FROM transactions t
+        JOIN employees e ON t.employee_id = e.id
+        LEFT JOIN discounts d ON d.discount_id = t.discount_id
+        LEFT JOIN transaction_details td ON td.transaction_id = t.transaction_id
+        WHERE t.store_id = ?
+        ORDER BY t.transaction_date DESC, t.transaction_id DESC, td.transaction_detail_id;
+        """
+        cursor = self.conn.execute(query, (store_id,))
+        header = f"Sales Report for Store ID {store_id}\n"
+        if self.snapshot_taken_at is not None:
+            taken = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(self.snapshot_taken_at))
+            header += f"Data as of {taken} (snapshot, {self.snapshot_age:.0f} s old)\n"
+        yield header + "\n"
+        current, header, lines = None, None, []
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            for row in rows:
+                if row[0] != current:
+                    if current is not None:
+                        yield from self._report_transaction(header, lines)
+                    current, header, lines = row[0], row, []
+                if row[6] is not None:
+                    lines.append(
+                        f"  - {row[6]}: {row[7]} @ ${to_dollars(row[8]):.2f} each (Total: ${to_dollars(row[9]):.2f})\n"
+                    )
+            if not rows:
+                break
+        if current is not None:
+            yield from self._report_transaction(header, lines)
+
+    def _report_transaction(self, header, lines) -> Iterator[str]:
+        transaction_id, date, total_cents, employee, discount_name, discount_cents = header[:6]
+        yield f"Transaction ID: {transaction_id}, Date: {date}, Total: ${to_dollars(total_cents):.2f}, Employee: {employee}\n"
+        if discount_cents:
+            yield f"  Discount: {discount_name or 'removed discount'} (-${to_dollars(discount_cents):.2f})\n"
+        yield from lines
+        yield "\n"
+
+    def export(self, directory: str, fmt: str = "csv", store_ids=None, since_last: bool = False,
+               export_name: str = "default", chunk_size: int = 5000, workers: int = 0,
+               discounts: bool = True) -> List[ExportedFile]:
+        """
+        Export transactions, transaction details, returns and discounts to CSV or Parquet.
+
+        Store-scoped tables are written per store as `<table>_store<id>.<fmt>` and discounts
+        as `discounts.<fmt>`. Rows are fetched and written `chunk_size` at a time. After the
+        export the last row id of every file is recorded as a watermark under `export_name`,
+        so a later export with since_last=True only writes rows added since.
+
+        Args:
+            directory (str): Output directory, created if missing.
+            fmt (str): 'csv' or 'parquet' (needs pyarrow).
+            store_ids (list, optional): Stores to export, defaults to all stores.
+            since_last (bool): Only export rows added since the previous export of `export_name`.
+            export_name (str): Watermark namespace, one per downstream consumer.
+            chunk_size (int): Rows fetched per round trip.
+            workers (int): Export stores in this many processes. Needs a database file.
+            discounts (bool): Also write discounts.<fmt>.
+
+        Returns:
+            List[ExportedFile]: One entry per file written.
+
+        Raises:
+            RuntimeError: The connection has uncommitted changes. The export reads through
+                its own connections and commits its watermarks, so the caller commits or
+                rolls back first.
+        """
+        if fmt not in EXPORT_FORMATS:
+            raise ValueError(f"Unknown export format '{fmt}', expected one of {', '.join(EXPORT_FORMATS)}")
+        if self.conn.in_transaction:
+            raise RuntimeError("Commit or roll back pending changes before exporting")
+        if fmt == "parquet":
+            import pyarrow  # noqa: F401  (fail before writing anything)
+        os.makedirs(directory, exist_ok=True)
+        if store_ids is None:
+            store_ids = [row[0] for row in self.conn.execute("SELECT store_id FROM stores ORDER BY store_id")]
+        since = {store_id: {} for store_id in store_ids}
+        if since_last:
+            rows = self.conn.execute(
+                "SELECT table_name, store_id, last_id FROM export_watermarks WHERE export_name = ?", (export_name,)
+            )
+            for table, store_id, last_id in rows:
+                if store_id in since:
+                    since[store_id][table] = last_id
+
+        files = []
+        source, reader = self.conn, None
+        try:
+            if workers > 1 and len(store_ids) > 1 and self.db_name != ":memory:":
+                with ProcessPoolExecutor(max_workers=workers) as pool:
+                    futures = [
+                        pool.submit(_export_store_worker, self.db_name, directory, fmt, store_id, since[store_id], chunk_size)
+                        for store_id in store_ids
+                    ]
+                    for future in futures:
+                        files.extend(future.result())
+            else:
+                # One deferred read transaction on a second connection: every table is read
+                # from the same state and streamed a chunk at a time, without copying the
+                # database first
+                if self.db_name != ":memory:":
+                    source = reader = _read_only_connection(self.db_name)
+                    reader.execute("BEGIN")
+                for store_id in store_ids:
+                    files.extend(_export_store(source, directory, fmt, store_id, since[store_id], chunk_size))
+
+            # Discounts are few and can change in place, so they are always exported in full
+            if discounts:
+                path = os.path.join(directory, f"discounts.{fmt}")
+                cursor = source.execute("SELECT * FROM discounts ORDER BY discount_id")
+                rows, _ = _write_cursor(source, cursor, "discounts", path, fmt, None, chunk_size)
+                files.append(ExportedFile("discounts", None, path, rows, None))
+        finally:
+            if reader is not None:
+                reader.close()
+
+        self.conn.executemany(
+            """
+            INSERT INTO export_watermarks (export_name, table_name, store_id, last_id, exported_at)
+            VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)
+            ON CONFLICT (export_name, table_name, store_id)
+            DO UPDATE SET last_id = excluded.last_id, exported_at = excluded.exported_at
+            """,
+            [(export_name, f.table, f.store_id, f.last_id) for f in files if f.store_id is not None]
+        )
+        self.conn.commit()
+        self.events.emit(INFO, "export_completed", export_name=export_name, fmt=fmt, directory=directory,
+                         files=len(files), rows=sum(f.rows for f in files))
+        return files
+
+    # Bucket start expressions for sales_over_time; weeks start on Monday
+    TIME_BUCKETS = {
+        "hourly": "strftime('%Y-%m-%d %H:00:00', t.transaction_date)",
+        "daily": "date(t.transaction_date)",
+        "weekly": "date(t.transaction_date, 'weekday 0', '-6 days')",
+    }
+
+    def top_items(self, store_id: int, limit: int = 10, start: str = None, end: str = None) -> List[ItemTotal]:
+        """
+        Fetches the parts a store sold the most units of, aggregated in SQL.
+
+        Args:
+            store_id (int): The ID of the store.
+            limit (int): Number of parts to return.
+            start (str, optional): First day to include (YYYY-MM-DD).
+            end (str, optional): Last day to include (YYYY-MM-DD).
+
+        Returns:
+            List[ItemTotal]: Parts by units sold, highest first, named as they were last
+                sold. Return lines are not counted.
+        """
+        # MAX() makes SQLite take the bare part_name from each part's latest line
+        query = """
+        SELECT td.part_id, td.part_name, SUM(td.quantity) AS sold, MAX(td.transaction_detail_id)
+        FROM transactions t
+        JOIN transaction_details td ON td.transaction_id = t.transaction_id
+        WHERE t.store_id = ? AND td.quantity > 0
+        """
+        query, params = self._date_range(query, [store_id], start, end)
+        query += " GROUP BY td.part_id ORDER BY sold DESC, td.part_id LIMIT ?"
+        try:
+            self.cursor.execute(query, (*params, limit))
+            return [ItemTotal._make(row[:3]) for row in self.cursor.fetchall()]
+        except sqlite3.Error as e:
+            self.events.emit(ERROR, "query_failed", query="top_items", store_id=store_id, error=e)
+            return []
+
+    def sales_over_time(self, store_id: int, granularity: str = "daily", start: str = None, end: str = None) -> List[SalesBucket]:
+        """
+        Fetches a store's sales totals per hour, day or week, aggregated in SQL.
+
+        Args:
+            store_id (int): The ID of the store.
+            granularity (str): 'hourly', 'daily' or 'weekly'.
+            start (str, optional): First day to include (YYYY-MM-DD).
+            end (str, optional): Last day to include (YYYY-MM-DD).
+
+        Returns:
+            List[SalesBucket]: One bucket per period that has transactions, oldest first.
+            Return transactions are counted and reduce the total.
+        """
+        bucket = self.TIME_BUCKETS.get(granularity)
+        if bucket is None:
+            raise ValueError(f"Unknown granularity '{granularity}', expected one of {', '.join(self.TIME_BUCKETS)}")
+        query = f"""
+        SELECT {bucket} AS period, COUNT(*), SUM(t.total_cents)
+        FROM transactions t
+        WHERE t.store_id = ?
+        """
+        query, params = self._date_range(query, [store_id], start, end)
+        query += " GROUP BY period ORDER BY period"
+        try:
+            self.cursor.execute(query, params)
+            return [SalesBucket._make(row) for row in self.cursor.fetchall()]
+        except sqlite3.Error as e:
+            self.events.emit(ERROR, "query_failed", query="sales_over_time", store_id=store_id, error=e)
             return []
 
+    def _date_range(self, query: str, params: list, start: str = None, end: str = None):
+        """Append inclusive day bounds on t.transaction_date to a WHERE clause."""
+        if start:
+            query += " AND t.transaction_date >= date(?)"
+            params.append(start)
+        if end:
+            query += " AND t.transaction_date < date(?, '+1 day')"
+            params.append(end)
+        return query, params
+
+    # Columns of sales_frame, one row per transaction line
+    SALES_FRAME_COLUMNS = ("transaction_id", "date", "pno", "name", "quantity", "amount_cents", "total_cents")
+
+    def sales_frame(self, store_id: int, start: str = None, end: str = None, chunk_size: int = 10000):
+        """
+        Fetches a store's sales as a pandas DataFrame with one row per transaction line.
+
+        Rows are read from the cursor `chunk_size` at a time into typed NumPy columns,
+        without creating a Python object per transaction or line.
+
+        Args:
+            store_id (int): The ID of the store.
+            start (str, optional): First day to include (YYYY-MM-DD).
+            end (str, optional): Last day to include (YYYY-MM-DD).
+            chunk_size (int): Rows fetched per round trip.
+
+        Returns:
+            DataFrame: transaction_id, pno, quantity, amount_cents (line total) and
+            total_cents (transaction total) as int64, date as datetime64 and name as
+            a categorical, ordered by date.
+        """
+        if pd is None:
+            raise ImportError("Database.sales_frame requires numpy and pandas")
+        query = """
+        SELECT t.transaction_id, t.transaction_date, td.part_id, td.part_name, td.quantity,
+               td.line_cents, t.total_cents
+        FROM transactions t
+        JOIN transaction_details td ON td.transaction_id = t.transaction_id
+        WHERE t.store_id = ?
+        """
+        query, params = self._date_range(query, [store_id], start, end)
+        query += " ORDER BY t.transaction_date, t.transaction_id"
+
+        columns = {name: [] for name in self.SALES_FRAME_COLUMNS}
+        try:
+            cursor = self.conn.execute(query, params)
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    break
+                ids, dates, pnos, names, quantities, amounts, totals = zip(*rows)
+                columns["transaction_id"].append(np.array(ids, dtype=np.int64))
+                columns["date"].append(np.array(dates, dtype="datetime64[s]"))
+                columns["pno"].append(np.array(pnos, dtype=np.int64))
+                columns["name"].append(np.array(names, dtype=object))
+                columns["quantity"].append(np.array(quantities, dtype=np.int64))
+                columns["amount_cents"].append(np.array(amounts, dtype=np.int64))
+                columns["total_cents"].append(np.array(totals, dtype=np.int64))
+        except sqlite3.Error as e:
+            self.events.emit(ERROR, "query_failed", query="sales_frame", store_id=store_id, error=e)
+            raise
+
+        dtypes = {"date": "datetime64[s]", "name": object}
+        frame = pd.DataFrame({
+            name: np.concatenate(chunks) if chunks else np.array([], dtype=dtypes.get(name, np.int64))
+            for name, chunks in columns.items()
+        })
+        frame["name"] = frame["name"].astype("category")
+        return frame
+
     def get_parts_by_store(self, store_id: int) -> List[Part]:
         """
         Fetches and returns all parts for a specific store.
@@ -929,18 +2433,12 @@ class Database:
             List[Part]: A list of Part objects representing the parts in the store.
         """
         try:
-            query = """
-            SELECT pno, name, price, store_id, quantity
-            FROM parts
-            WHERE store_id = ?;
-            """
-            self.cursor.execute(query, (store_id,))
-            parts = self.cursor.fetchall()
+            parts = self.run("parts_by_store", (store_id,)).fetchall()
 
             # Convert the results into a list of Part objects
-            return [Part(part_id=p[0], name=p[1], price=p[2], store_id=p[3], quantity=p[4]) for p in parts]
+            return [Part(part_id=p[0], name=p[1], price_cents=p[2], store_id=p[3], quantity=p[4]) for p in parts]
         except sqlite3.Error as e:
-            print(f"Error fetching parts for store ID {store_id}: {e}")
+            self.events.emit(ERROR, "query_failed", query="get_parts_by_store", store_id=store_id, error=e)
             return []
 
     def get_part_by_name(self, name: str, store_id: int) -> Part:
@@ -958,13 +2456,7 @@ class Database:
             Exception: If the part is not found in the specified store.
         """
         try:
-            query = """
-            SELECT pno, name, price, store_id, quantity
-            FROM parts
-            WHERE name = ? AND store_id = ?;
-            """
-            self.cursor.execute(query, (name, store_id))
-            part = self.cursor.fetchone()
+            part = self.run("part_by_name", (name, store_id)).fetchone()
             if not part:
                 raise Exception(f"Part '{name}' not found in store {store_id}")
                 
@@ -972,73 +2464,203 @@ class Database:
             return Part(
                 part_id=part[0],
                 name=part[1],
-                price=part[2],
+                price_cents=part[2],
                 store_id=part[3],
                 quantity=part[4]
             )
         except sqlite3.Error as e:
-            print(f"Database error: {e}")
+            self.events.emit(ERROR, "query_failed", query="get_part_by_name", name=name, store_id=store_id, error=e)
             raise Exception(f"Error fetching part '{name}' from store {store_id}")
 
     def get_part_by_id(self, part_id: int):
         """Fetches and returns part details as a structured object."""
-        query = """
-        SELECT pno, name, price, store_id, quantity
-        FROM parts
-        WHERE pno = ?;
-        """
-        self.cursor.execute(query, (part_id,))
-        part = self.cursor.fetchone()
+        part = self.run("part_by_id", (part_id,)).fetchone()
         if not part:
             return None
         return Part(
             part_id=part[0],
             name=part[1],
-            price=part[2],
+            price_cents=part[2],
             store_id=part[3],
             quantity=part[4]
         )
 
-    def update_store_balance(self, store_id: int, amount: float, is_addition: bool = True) -> bool:
+    def get_parts_by_ids(self, part_ids) -> List[Part]:
+        """Fetches the parts with the given part numbers, in pno order."""
+        # The ids travel as one JSON array, so any number of them uses the same statement
+        rows = self.run("parts_by_ids", (json.dumps(sorted(set(part_ids))),)).fetchall()
+        return [Part(part_id=p[0], name=p[1], price_cents=p[2], store_id=p[3], quantity=p[4]) for p in rows]
+
+    def update_part(self, part_id: int, name: str = None, price: float = None, quantity: int = None) -> bool:
+        """
+        Update the name, price (in dollars) and/or stock of a single part, keyed by pno.
+
+        Returns:
+            bool: True if the part exists and was updated.
+        """
+        changes = {"name": name, "price": price, "quantity": quantity}
+        changes = {column: value for column, value in changes.items() if value is not None}
+        if not changes:
+            return False
+        try:
+            return self.update_parts({part_id: changes}) > 0
+        except sqlite3.Error:
+            return False
+
+    def update_parts(self, changes: dict) -> int:
+        """
+        Apply name, price (in dollars) and/or quantity changes to many parts in one transaction.
+
+        Args:
+            changes (dict): {pno: {"name": ..., "price": ..., "quantity": ...}}, any subset of fields.
+
+        Returns:
+            int: Number of parts updated. Unknown pnos are skipped.
+
+        Raises:
+            sqlite3.Error: The transaction was rolled back and nothing was changed.
+        """
+        # Parts changing the same set of columns share one executemany statement
+        statements = {}
+        for pno, fields in changes.items():
+            values = {}
+            if fields.get("name") is not None:
+                values["name"] = fields["name"]
+            if fields.get("price") is not None:
+                values["price_cents"] = to_cents(fields["price"])
+            if fields.get("quantity") is not None:
+                values["quantity"] = fields["quantity"]
+            if values:
+                statements.setdefault(tuple(values), []).append((*values.values(), pno))
+        if not statements:
+            return 0
+        updated = 0
+        try:
+            for columns, rows in statements.items():
+                assignments = ", ".join(f"{column} = ?" for column in columns)
+                updated += self.conn.executemany(f"UPDATE parts SET {assignments} WHERE pno = ?", rows).rowcount
+            self.conn.commit()
+        except sqlite3.Error as e:
+            self.events.emit(ERROR, "update_parts_failed", parts=len(changes), error=e)
+            self.conn.rollback()
+            raise
+        if updated:
+            self._notify_parts("updated", [row[-1] for rows in statements.values() for row in rows])
+        return updated
+
+    def adjust_prices(self, percent: float, store_id: int = None, name_prefix: str = None, pnos=None) -> int:
+        """
+        Raise or lower prices by a percentage with one set-based UPDATE.
+
+        Parts can be selected by store (all stores when omitted), by name prefix (for a
+        product line such as "Bolt "), and/or by an explicit list of pnos. New prices are
+        rounded half up to the cent and never go below zero.
+
+        Args:
+            percent (float): Change in percent, e.g. 5 for +5% or -10 for -10%.
+
+        Returns:
+            int: Number of parts repriced.
+        """
+        bps = 10000 + basis_points(percent / 100)
+        # One static statement per filter combination (see STATEMENTS)
+        filters = [
+            (1, store_id is not None, (store_id,)),
+            (2, bool(name_prefix), (name_prefix, f"{name_prefix}\U0010ffff")),
+            (4, pnos is not None, (json.dumps(list(pnos or ())),)),
+        ]
+        flags = sum(flag for flag, used, _ in filters if used)
+        params = [value for _, used, values in filters if used for value in values]
+        try:
+            repriced = [pno for (pno,) in self.run(f"adjust_prices_{flags}", (bps, *params)).fetchall()]
+            self.conn.commit()
+        except sqlite3.Error as e:
+            self.events.emit(ERROR, "adjust_prices_failed", percent=percent, store_id=store_id, error=e)
+            self.conn.rollback()
+            raise
+        self.events.emit(INFO, "prices_adjusted", percent=percent, store_id=store_id, parts=len(repriced))
+        self._notify_parts("updated", repriced)
+        return len(repriced)
+
+    def adjust_stock(self, deltas: dict) -> int:
+        """
+        Add to or take from the stock of many parts in one transaction.
+
+        Args:
+            deltas (dict): {pno: quantity change}, negative to remove stock.
+
+        Returns:
+            int: Number of parts updated.
+
+        Raises:
+            ValueError: A pno is unknown or its stock would go negative; nothing was changed.
+        """
+        rows = [(delta, pno, delta) for pno, delta in deltas.items() if delta]
+        try:
+            changed = self.conn.executemany(
+                "UPDATE parts SET quantity = quantity + ? WHERE pno = ? AND quantity + ? >= 0", rows
+            ).rowcount
+        except sqlite3.Error as e:
+            self.events.emit(ERROR, "adjust_stock_failed", parts=len(rows), error=e)
+            self.conn.rollback()
+            raise
+        if changed != len(rows):
+            self.conn.rollback()
+            raise ValueError("Unknown part or insufficient stock; no stock was changed.")
+        self.conn.commit()
+        self._notify_parts("updated", [pno for _, pno, _ in rows])
+        return changed
+
+    def remove_part(self, part_id: int) -> bool:
+        """Delete a part by pno. Returns True if a part was removed."""
+        try:
+            self.cursor.execute("DELETE FROM parts WHERE pno = ?", (part_id,))
+            removed = self.cursor.rowcount > 0
+            self.conn.commit()
+            if removed:
+                self._notify_parts("removed", [part_id])
+            return removed
+        except sqlite3.Error as e:
+            self.events.emit(ERROR, "remove_part_failed", pno=part_id, error=e)
+            self.conn.rollback()
+            return False
+
+    def update_store_balance(self, store_id: int, amount_cents: int, is_addition: bool = True) -> bool:
         """
-        Update store balance with proper decimal formatting.
+        Update store balance by an exact number of cents.
         
         Args:
             store_id (int): The ID of the store to update
-            amount (float): The amount to add or subtract
+            amount_cents (int): The amount to add or subtract, in cents
             is_addition (bool): True to add amount, False to subtract
         
         Returns:
             bool: True if successful, False otherwise
         """
         try:
-            formatted_amount = self.format_decimal(amount)
-            
-            # Get current balance
-            self.cursor.execute("SELECT balance FROM stores WHERE store_id = ?", (store_id,))
-            current_balance = self.cursor.fetchone()[0]
-            
-            # Calculate new balance
-            new_balance = self.format_decimal(
-                current_balance + formatted_amount if is_addition 
-                else current_balance - formatted_amount
-            )
-            
-            # Update store balance
-            self.cursor.execute(
-                "UPDATE stores SET balance = ? WHERE store_id = ?",
-                (new_balance, store_id)
-            )
+            delta = amount_cents if is_addition else -amount_cents
+            self.run("ledger_entry", (store_id, delta, None))
             self.conn.commit()
             return True
         except sqlite3.Error as e:
-            print(f"Error updating store balance: {e}")
+            self.events.emit(ERROR, "balance_update_failed", store_id=store_id, error=e)
+            return False
+
+    def set_store_tax_rate(self, store_id: int, tax_rate: float) -> bool:
+        """Set a store's tax rate (as a decimal, e.g. 0.085). Returns True if the store exists."""
+        try:
+            self.cursor.execute("UPDATE stores SET tax_rate = ? WHERE store_id = ?", (round(tax_rate, 4), store_id))
+            updated = self.cursor.rowcount > 0
+            self.conn.commit()
+            return updated
+        except sqlite3.Error as e:
+            self.events.emit(ERROR, "set_tax_rate_failed", store_id=store_id, error=e)
+            self.conn.rollback()
             return False
 
     def get_store_tax_rate(self, store_id):
         """Fetch the tax rate for a given store."""
-        self.cursor.execute("SELECT tax_rate FROM stores WHERE store_id = ?", (store_id,))
-        result = self.cursor.fetchone()
+        result = self.run("store_tax_rate", (store_id,)).fetchone()
         return result[0] if result else 0.0
 
     def get_transaction_log(self, store_id: int = None, start_date: str = None, end_date: str = None):
@@ -1051,42 +2673,11 @@ class Database:
             end_date (str, optional): Filter by end date (YYYY-MM-DD)
         """
         try:
-            query = """
-                SELECT 
-                    t.transaction_id,
-                    t.transaction_date,
-                    t.total_price,
-                    e.first_name || ' ' || e.last_name AS employee_name,
-                    s.store_name,
-                    CASE 
-                        WHEN r.return_id IS NOT NULL THEN 'Return'
-                        ELSE 'Purchase'
-                    END as transaction_type,
-                    r.original_transaction_id
-                FROM transactions t
-                JOIN employees e ON t.employee_id = e.id
-                JOIN stores s ON t.store_id = s.store_id
-                LEFT JOIN returns r ON t.transaction_id = r.transaction_id
-                WHERE 1=1
-            """
-            params = []
-
-            if store_id:
-                query += " AND t.store_id = ?"
-                params.append(store_id)
-            
-            if start_date:
-                query += " AND date(t.transaction_date) >= date(?)"
-                params.append(start_date)
-                
-            if end_date:
-                query += " AND date(t.transaction_date) <= date(?)"
-                params.append(end_date)
-
-            query += " ORDER BY t.transaction_date DESC"
-
-            self.cursor.execute(query, params)
-            transactions = self.cursor.fetchall()
+            # One static statement per filter combination (see STATEMENTS)
+            filters = [(1, store_id), (2, start_date), (4, end_date)]
+            flags = sum(flag for flag, value in filters if value)
+            params = [value for _, value in filters if value]
+            transactions = self.run(f"transaction_log_{flags}", params).fetchall()
 
             # Format the results as a list of dictionaries
             transaction_log = []
@@ -1094,7 +2685,8 @@ class Database:
                 transaction_log.append({
                     'transaction_id': t[0],
                     'date': t[1],
-                    'total_price': t[2],
+                    'total_price': to_dollars(t[2]),
+                    'total_cents': t[2],
                     'employee': t[3],
                     'store': t[4],
                     'type': t[5],
@@ -1104,14 +2696,13 @@ class Database:
             return transaction_log
 
         except sqlite3.Error as e:
-            print(f"Error getting transaction log: {e}")
+            self.events.emit(ERROR, "query_failed", query="get_transaction_log", error=e)
             return []
 
     def check_admin_access(self, employee_id: int) -> bool:
         """Check if employee has admin role."""
         try:
-            self.cursor.execute("SELECT role FROM employees WHERE id = ?", (employee_id,))
-            result = self.cursor.fetchone()
+            result = self.run("employee_role", (employee_id,)).fetchone()
             return result and result[0].lower() == 'admin'
         except sqlite3.Error:
             return False
@@ -1145,9 +2736,21 @@ class Database:
             self.conn.commit()
             return self.cursor.lastrowid
         except sqlite3.Error as e:
-            print(f"Error creating discount: {e}")
+            self.events.emit(ERROR, "add_discount_failed", name=name, error=e)
             return None
 
+    def remove_discount(self, discount_id: int) -> bool:
+        """Delete a discount. Returns True if a discount was removed."""
+        try:
+            self.cursor.execute("DELETE FROM discounts WHERE discount_id = ?", (discount_id,))
+            removed = self.cursor.rowcount > 0
+            self.conn.commit()
+            return removed
+        except sqlite3.Error as e:
+            self.events.emit(ERROR, "remove_discount_failed", discount_id=discount_id, error=e)
+            self.conn.rollback()
+            return False
+
     def apply_discount_to_part(self, part_id: int, discount_id: int):
         """Apply a discount to a specific part."""
         try:
@@ -1158,7 +2761,7 @@ class Database:
             self.cursor.execute(query, (part_id, discount_id))
             self.conn.commit()
         except sqlite3.Error as e:
-            print(f"Error applying discount to part: {e}")
+            self.events.emit(ERROR, "apply_discount_failed", part_id=part_id, discount_id=discount_id, error=e)
 
     def get_active_discounts(self, store_id: int = None) -> list:
         """Get all active discounts for a store."""
@@ -1174,34 +2777,28 @@ class Database:
             self.cursor.execute(query, (store_id,))
             return self.cursor.fetchall()
         except sqlite3.Error as e:
-            print(f"Error fetching active discounts: {e}")
+            self.events.emit(ERROR, "query_failed", query="get_active_discounts", store_id=store_id, error=e)
             return []
 
-    def calculate_discount(self, original_price: float, discount_type: str, 
-                          discount_value: float) -> float:
-        """Calculate discounted price."""
-        if discount_type == 'percentage':
-            discount_amount = original_price * (discount_value / 100)
-        else:  
-            discount_amount = discount_value
-        
-        discount_amount = min(discount_amount, original_price)
-        return self.format_decimal(original_price - discount_amount)
+    def calculate_discount(self, original_cents: int, discount_type: str, 
+                          discount_value: float) -> int:
+        """Calculate discounted price in cents."""
+        return original_cents - min(transaction_discount(original_cents, discount_type, discount_value), original_cents)
 
     def get_part_price_with_discount(self, part_id: int, store_id: int) -> tuple:
         """
         Get part price including any applicable discounts.
         
         Returns:
-            tuple: (final_price, original_price, discount_applied)
+            tuple: (final_cents, original_cents, discount_applied)
         """
         try:
             # Get original price
             self.cursor.execute(
-                "SELECT price FROM parts WHERE pno = ? AND store_id = ?", 
+                "SELECT price_cents FROM parts WHERE pno = ? AND store_id = ?", 
                 (part_id, store_id)
             )
-            original_price = self.cursor.fetchone()[0]
+            original_cents = self.cursor.fetchone()[0]
             
             # Check for applicable discounts
             query = """
@@ -1219,12 +2816,1170 @@ class Database:
             discount = self.cursor.fetchone()
             
             if discount:
-                final_price = self.calculate_discount(
-                    original_price, discount[0], discount[1]
+                final_cents = self.calculate_discount(
+                    original_cents, discount[0], discount[1]
                 )
-                return (final_price, original_price, True)
+                return (final_cents, original_cents, True)
             
-            return (original_price, original_price, False)
+            return (original_cents, original_cents, False)
         except sqlite3.Error as e:
-            print(f"Error calculating discounted price: {e}")
-            return (original_price, original_price, False)
+            self.events.emit(ERROR, "query_failed", query="get_part_price_with_discount", part_id=part_id, error=e)
+            return (original_cents, original_cents, False)
+
+# Row ids of a store shard start at store_id << SHARD_ID_BITS, so a pno or transaction
+# id names its store and ids never collide when shards are merged
+SHARD_ID_BITS = 32
+
+def shard_of(row_id: int) -> int:
+    """Store whose shard holds a pno, transaction_id or return_id."""
+    return row_id >> SHARD_ID_BITS
+
+class ShardedDatabase:
+    """
+    Database split into one SQLite file per store plus a catalog, so registers of
+    different stores no longer contend for one writer lock.
+
+    The catalog (catalog.db) owns stores, employees and discounts. Those reference
+    tables are copied into every shard (store_<id>.db) when it is opened and after each
+    catalog write made through the router, so the shards' foreign keys hold. A shard
+    owns its store's parts, sales, returns and balance.
+
+    Calls that name a store, part or transaction (see ROUTES) go to one shard; the
+    cross-store queries below read every shard in parallel on a thread pool and merge
+    the results, and the bulk calls keyed by pno or store split their work per shard.
+    Calls in CATALOG_CALLS go to the catalog; any other Database method raises
+    AttributeError rather than silently reading or writing the catalog. Like Database,
+    an instance belongs to the thread that created it. Each store is always handed to
+    the same fan-out worker, which keeps its own connection to the shard; shards are
+    seeded and their reference tables copied on the creating thread only, so a worker
+    opening a shard never writes to it.
+
+    Bulk writes that span stores commit shard by shard, not atomically.
+
+    Args:
+        directory (str): Directory holding catalog.db and the shard files.
+        events (EventSink, optional): Sink shared by the catalog and every shard.
+        bcrypt_rounds (int): Cost factor for password hashes.
+        workers (int): Threads used by cross-store queries.
+    """
+
+    # Routed calls: {method: argument that selects the shard}
+    ROUTES = {
+        "add_part_to_store": "store_id",
+        "create_purchase": "store_id",
+        "create_return": "store_id",
+        "import_parts": "store_id",
+        "adjust_prices": "store_id",
+        "get_parts_by_store": "store_id",
+        "get_part_by_name": "store_id",
+        "SalesReport": "store_id",
+        "sales_report_lines": "store_id",
+        "top_items": "store_id",
+        "sales_over_time": "store_id",
+        "sales_frame": "store_id",
+        "get_part_by_id": "part_id",
+        "update_part": "part_id",
+        "remove_part": "part_id",
+        "apply_discount_to_part": "part_id",
+        "get_part_price_with_discount": "part_id",
+        "get_transaction_details": "transaction_id",
+        "return_by_transaction_id": "transaction_id",
+        "return_lines": "transaction_id",
+        "returnable_lines": "transaction_id",
+        "purchase_part": "store_id",
+        "purchase_part_by_pno": "store_id",
+        "return_part": "store_id",
+        "return_part_by_pno": "store_id",
+        "update_store_balance": "store_id",
+        "store_balance_cents": "store_id",
+    }
+    # Catalog writes that change the reference tables copied into the shards
+    REFERENCE_WRITES = ("add_employee", "set_employee_password", "store_password_hash", "add_discount",
+                        "remove_discount", "set_store_tax_rate")
+    # Catalog reads of the reference tables; with REFERENCE_WRITES, the only calls the catalog answers
+    CATALOG_CALLS = ("get_employees", "get_store_employees", "get_active_discounts", "get_store_tax_rate",
+                     "employee_login", "find_employee_credentials", "check_admin_access", "hash_password",
+                     "calculate_discount")
+
+    def __init__(self, directory: str, events: EventSink = None, bcrypt_rounds: int = DEFAULT_BCRYPT_ROUNDS,
+                 workers: int = 4):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.db_name = directory
+        self.bcrypt_rounds = bcrypt_rounds
+        self._owns_events = events is None
+        self.events = EventSink() if events is None else events
+        self.catalog = Database(os.path.join(directory, "catalog.db"), events=self.events, bcrypt_rounds=bcrypt_rounds)
+        self.listeners = []
+        self._shards = {}   # {store_id: Database}, opened on this thread
+        self._worker_shards = threading.local()   # .shards {store_id: Database} of each fan-out worker
+        # One thread per worker, and store_id % workers picks it, so a store always meets the same connection
+        self._pools = [ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"shard{worker}")
+                       for worker in range(workers)]
+
+    def shard_path(self, store_id: int) -> str:
+        return os.path.join(self.directory, f"store_{store_id}.db")
+
+    def shard(self, store_id: int) -> Database:
+        """The shard of a store, created on first use."""
+        db = self._shards.get(store_id)
+        if db is None:
+            db = self._open_shard(store_id)
+            for callback in self.listeners:
+                db.add_listener(callback)
+            self._shards[store_id] = db
+        return db
+
+    def _open_shard(self, store_id: int) -> Database:
+        db = Database(self.shard_path(store_id), events=self.events, bcrypt_rounds=self.bcrypt_rounds)
+        self._seed_id_ranges(db, store_id)
+        self._copy_reference_tables(db)
+        return db
+
+    def _submit(self, store_id: int, method: str, args: tuple = (), kwargs: dict = None) -> Future:
+        """Run a Database method on a shard on the store's fan-out worker."""
+        self.shard(store_id)  # Seeded and up to date before any worker reads it
+        pool = self._pools[store_id % len(self._pools)]
+        return pool.submit(self._on_worker_shard, store_id, method, args, kwargs or {})
+
+    def _on_worker_shard(self, store_id: int, method: str, args: tuple, kwargs: dict):
+        """Run a Database method on a shard from a fan-out worker, over the worker's own connection."""
+        shards = getattr(self._worker_shards, "shards", None)
+        if shards is None:
+            shards = self._worker_shards.shards = {}
+        db = shards.get(store_id)
+        if db is None:
+            db = shards[store_id] = Database(self.shard_path(store_id), events=self.events,
+                                             bcrypt_rounds=self.bcrypt_rounds)
+        return getattr(db, method)(*args, **kwargs)
+
+    def _close_worker_shards(self):
+        for db in getattr(self._worker_shards, "shards", {}).values():
+            db.close_connection()
+        self._worker_shards.shards = {}
+
+    def _seed_id_ranges(self, db: Database, store_id: int):
+        """Start the shard's AUTOINCREMENT ids in the store's own range."""
+        floor = store_id << SHARD_ID_BITS
+        for table in ("parts", "transactions", "transaction_details", "returns", "part_discounts"):
+            db.cursor.execute("UPDATE sqlite_sequence SET seq = ? WHERE name = ? AND seq < ?", (floor, table, floor))
+            db.cursor.execute(
+                "INSERT INTO sqlite_sequence (name, seq) SELECT ?, ? "
+                "WHERE NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = ?)",
+                (table, floor, table)
+            )
+        db.conn.commit()
+
+    def _copy_reference_tables(self, db: Database):
+        """Upsert stores, employees and discounts from the catalog. Shard balances are kept."""
+        db.cursor.execute("ATTACH DATABASE ? AS catalog", (self.catalog.db_name,))
+        try:
+            db.cursor.execute("""
+                INSERT INTO stores (store_id, store_name, balance_cents, tax_rate)
+                SELECT store_id, store_name, balance_cents, tax_rate FROM catalog.stores WHERE true
+                ON CONFLICT(store_id) DO UPDATE SET store_name = excluded.store_name, tax_rate = excluded.tax_rate
+            """)
+            db.cursor.execute("""
+                INSERT INTO employees (id, first_name, last_name, role, store_id, password_hash)
+                SELECT id, first_name, last_name, role, store_id, password_hash FROM catalog.employees WHERE true
+                ON CONFLICT(id) DO UPDATE SET first_name = excluded.first_name, last_name = excluded.last_name,
+                    role = excluded.role, store_id = excluded.store_id, password_hash = excluded.password_hash
+            """)
+            db.cursor.execute("""
+                INSERT INTO discounts (discount_id, name, description, discount_type, value,
+                                       start_date, end_date, store_id, active)
+                SELECT discount_id, name, description, discount_type, value, start_date, end_date, store_id, active
+                FROM catalog.discounts WHERE true
+                ON CONFLICT(discount_id) DO UPDATE SET name = excluded.name, description = excluded.description,
+                    discount_type = excluded.discount_type, value = excluded.value, start_date = excluded.start_date,
+                    end_date = excluded.end_date, store_id = excluded.store_id, active = excluded.active
+            """)
+            db.cursor.execute("DELETE FROM discounts WHERE discount_id NOT IN (SELECT discount_id FROM catalog.discounts)")
+            db.conn.commit()
+        finally:
+            db.cursor.execute("DETACH DATABASE catalog")
+
+    def refresh_reference_tables(self):
+        """Copy the catalog into every open shard, e.g. after another register changed it."""
+        for db in self._shards.values():
+            self._copy_reference_tables(db)
+
+    def store_ids(self) -> List[int]:
+        return [row[0] for row in self.catalog.cursor.execute("SELECT store_id FROM stores ORDER BY store_id")]
+
+    def add_store(self, store_name, balance=0.0, tax_rate=0.0) -> int:
+        """Add a store to the catalog and create its shard. Returns the new store_id."""
+        self.catalog.add_store(store_name, balance, tax_rate)
+        store_id = self.catalog.cursor.lastrowid
+        self.refresh_reference_tables()
+        self.shard(store_id)
+        return store_id
+
+    def __getattr__(self, name):
+        if name.startswith("_") or name == "catalog":
+            raise AttributeError(name)
+        if name in self.ROUTES:
+            return self._routed(name, self.ROUTES[name])
+        if name not in self.REFERENCE_WRITES and name not in self.CATALOG_CALLS and not name.isupper():
+            raise AttributeError(f"ShardedDatabase has no route for '{name}'")
+        attribute = getattr(self.catalog, name)
+        if name in self.REFERENCE_WRITES:
+            def write_through(*args, **kwargs):
+                result = attribute(*args, **kwargs)
+                self.refresh_reference_tables()
+                return result
+            return write_through
+        return attribute
+
+    def _routed(self, name: str, key: str, snapshot_max_age: float = None):
+        signature = inspect.signature(getattr(Database, name))
+
+        def call(*args, **kwargs):
+            value = signature.bind(None, *args, **kwargs).arguments.get(key)
+            if value is None:
+                raise ValueError(f"ShardedDatabase.{name} needs a {key}")
+            db = self.shard(value if key == "store_id" else shard_of(value))
+            if snapshot_max_age is not None:
+                db = db.reporting(snapshot_max_age)
+            return getattr(db, name)(*args, **kwargs)
+        return call
+
+    def reporting(self, max_age: float = REPORT_SNAPSHOT_MAX_AGE) -> "ShardSnapshots":
+        """Routed calls answered by the reporting snapshot of each shard (see Database.reporting)."""
+        return ShardSnapshots(self, max_age)
+
+    def replay_sales(self, entries: List[JournalEntry]) -> SyncResult:
+        """Replay journaled sales, one batch per store shard."""
+        by_store = {}
+        for entry in entries:
+            by_store.setdefault(entry.store_id, []).append(entry)
+        synced, rejected, pnos = [], [], []
+        for store_id, store_entries in by_store.items():
+            result = self.shard(store_id).replay_sales(store_entries)
+            synced += result.synced
+            rejected += result.rejected
+            pnos += result.pnos
+        return SyncResult(synced, rejected, tuple(pnos))
+
+    def fan_out(self, method: str, *args, store_ids=None, **kwargs) -> dict:
+        """Call a Database method on every shard in parallel. Returns {store_id: result}."""
+        if store_ids is None:
+            store_ids = self.store_ids()
+        futures = {store_id: self._submit(store_id, method, args, kwargs) for store_id in store_ids}
+        return {store_id: future.result() for store_id, future in futures.items()}
+
+    def _by_store(self, keys, store_of=shard_of) -> dict:
+        """Group keys by the store that holds them: {store_id: [key, ...]}."""
+        groups = {}
+        for key in keys:
+            groups.setdefault(store_of(key), []).append(key)
+        return groups
+
+    def update_parts(self, changes: dict) -> int:
+        """Apply part changes shard by shard (see Database.update_parts)."""
+        return sum(
+            self.shard(store_id).update_parts({pno: changes[pno] for pno in pnos})
+            for store_id, pnos in self._by_store(changes).items()
+        )
+
+    def adjust_stock(self, deltas: dict) -> int:
+        """
+        Adjust stock shard by shard (see Database.adjust_stock). If a shard refuses its
+        deltas, the shards already adjusted are reverted before the error is raised.
+        """
+        applied = []
+        try:
+            for store_id, pnos in self._by_store(deltas).items():
+                store_deltas = {pno: deltas[pno] for pno in pnos}
+                self.shard(store_id).adjust_stock(store_deltas)
+                applied.append((store_id, store_deltas))
+        except Exception:
+            for store_id, store_deltas in applied:
+                self.shard(store_id).adjust_stock({pno: -delta for pno, delta in store_deltas.items()})
+            raise
+        return sum(1 for delta in deltas.values() if delta)
+
+    def adjust_prices(self, percent: float, store_id: int = None, name_prefix: str = None, pnos=None) -> int:
+        """Reprice one store, the stores holding `pnos`, or every store (see Database.adjust_prices)."""
+        if store_id is not None:
+            return self.shard(store_id).adjust_prices(percent, store_id, name_prefix, pnos)
+        if pnos is not None:
+            return sum(self.shard(store).adjust_prices(percent, None, name_prefix, store_pnos)
+                       for store, store_pnos in self._by_store(pnos).items())
+        return sum(self.shard(store).adjust_prices(percent, store, name_prefix) for store in self.store_ids())
+
+    def import_parts(self, source, store_id: int = None, fmt: str = None, batch_size: int = 5000) -> ImportReport:
+        """
+        Import a catalog file, sending each row to the shard of its own store (see
+        Database.import_parts). Rows are buffered per store and handed to the shard
+        `batch_size` at a time, so at most one batch per store is held.
+        """
+        started = time.perf_counter()
+        stores = set(self.store_ids())
+
+        def store_of(numbered):
+            row_store = numbered[1].get("store_id") if isinstance(numbered[1], dict) else None
+            try:
+                row_store = store_id if row_store in (None, "") else int(row_store)
+            except (ValueError, TypeError):
+                row_store = None
+            # Rows naming no valid store are rejected by any shard; its stores table is the catalog's
+            return row_store if row_store in stores else next(iter(sorted(stores)), None)
+
+        report = ImportReport()
+        buffers = {}
+
+        def flush(target):
+            store_report = self.shard(target)._import_rows(buffers.pop(target), store_id, batch_size)
+            report.inserted += store_report.inserted
+            report.updated += store_report.updated
+            report.rejected += store_report.rejected
+
+        for line, row in _read_import_rows(source, _import_format(source, fmt)):
+            target = store_of((line, row))
+            if target is None:
+                report.rejected.append(RejectedRow(line, row, f"store {store_id} not found"))
+                continue
+            buffer = buffers.setdefault(target, [])
+            buffer.append((line, row))
+            if len(buffer) >= batch_size:
+                flush(target)
+        for target in list(buffers):
+            flush(target)
+        report.rejected.sort(key=lambda rejected: rejected.line)
+        report.seconds = time.perf_counter() - started
+        return report
+
+    def record_purchases(self, requests: List[PurchaseRequest]) -> list:
+        """Record purchases with one commit per store shard; outcomes keep the request order."""
+        outcomes = [None] * len(requests)
+        for store_id, indexes in self._by_store(range(len(requests)), lambda i: requests[i].store_id).items():
+            results = self.shard(store_id).record_purchases([requests[i] for i in indexes])
+            for i, outcome in zip(indexes, results):
+                outcomes[i] = outcome
+        return outcomes
+
+    def rollup_balances(self) -> int:
+        return sum(self.shard(store_id).rollup_balances() for store_id in self.store_ids())
+
+    def export(self, directory: str, fmt: str = "csv", store_ids=None, since_last: bool = False,
+               export_name: str = "default", chunk_size: int = 5000, workers: int = 0) -> List[ExportedFile]:
+        """
+        Export every store from its own shard, with watermarks kept in the shard, and
+        the discounts once from the catalog (see Database.export). With workers, stores
+        are exported in parallel on the fan-out threads.
+        """
+        if store_ids is None:
+            store_ids = self.store_ids()
+        options = dict(fmt=fmt, since_last=since_last, export_name=export_name, chunk_size=chunk_size,
+                       discounts=False)
+        if workers > 1:
+            futures = [self._submit(store_id, "export", (directory,), dict(options, store_ids=[store_id]))
+                       for store_id in store_ids]
+            files = [exported for future in futures for exported in future.result()]
+        else:
+            files = [exported for store_id in store_ids
+                     for exported in self.shard(store_id).export(directory, store_ids=[store_id], **options)]
+        return files + self.catalog.export(directory, fmt, store_ids=[], chunk_size=chunk_size)
+
+    def get_stores(self) -> List[StoreRow]:
+        """Every store with the balance kept by its shard."""
+        results = self.fan_out("get_stores")
+        return [row for store_id, rows in results.items() for row in rows if row.store_id == store_id]
+
+    def get_store_summaries(self) -> List[StoreSummary]:
+        results = self.fan_out("get_store_summaries")
+        return [row for store_id, rows in results.items() for row in rows if row.store_id == store_id]
+
+    def get_parts(self) -> List[Part]:
+        return [part for parts in self.fan_out("get_parts").values() for part in parts]
+
+    def get_parts_by_ids(self, part_ids) -> List[Part]:
+        by_store = {}
+        for pno in part_ids:
+            by_store.setdefault(shard_of(pno), []).append(pno)
+        parts = []
+        for store_id, pnos in by_store.items():
+            parts += self.shard(store_id).get_parts_by_ids(pnos)
+        return sorted(parts, key=lambda part: part.part_id)
+
+    def return_transactions(self, transaction_ids, employee_id: int) -> dict:
+        by_store = {}
+        for transaction_id in transaction_ids:
+            by_store.setdefault(shard_of(transaction_id), []).append(transaction_id)
+        returned = {}
+        for store_id, ids in by_store.items():
+            returned.update(self.shard(store_id).return_transactions(ids, employee_id))
+        return returned
+
+    def refresh_parts(self, pnos):
+        by_store = {}
+        for pno in pnos:
+            by_store.setdefault(shard_of(pno), []).append(pno)
+        for store_id, store_pnos in by_store.items():
+            self.shard(store_id).refresh_parts(store_pnos)
+
+    def get_transaction_log(self, store_id: int = None, start_date: str = None, end_date: str = None):
+        """The transaction log of one store, or of every store newest first."""
+        if store_id:
+            return self.shard(store_id).get_transaction_log(store_id, start_date, end_date)
+        results = self.fan_out("get_transaction_log", None, start_date, end_date)
+        log = [entry for entries in results.values() for entry in entries]
+        log.sort(key=lambda entry: entry['date'], reverse=True)
+        return log
+
+    def add_listener(self, callback: Callable[[PartChange], None]):
+        """Listen for part changes in every shard."""
+        self.listeners.append(callback)
+        for db in self._shards.values():
+            db.add_listener(callback)
+
+    def remove_listener(self, callback: Callable[[PartChange], None]):
+        if callback in self.listeners:
+            self.listeners.remove(callback)
+        for db in self._shards.values():
+            db.remove_listener(callback)
+
+    def close_connection(self):
+        for future in [pool.submit(self._close_worker_shards) for pool in self._pools]:
+            future.result()
+        for pool in self._pools:
+            pool.shutdown(wait=True)
+        for db in self._shards.values():
+            db.close_connection()
+        self._shards.clear()
+        self.catalog.close_connection()
+        if self._owns_events:
+            self.events.close()
+
+class ShardSnapshots:
+    """
+    Report view of a ShardedDatabase: routed calls read the snapshot of their shard.
+    Cross-store queries already read through their own worker connections.
+    """
+
+    def __init__(self, router: ShardedDatabase, max_age: float):
+        self.router = router
+        self.max_age = max_age
+
+    def __getattr__(self, name):
+        if name in ShardedDatabase.ROUTES:
+            return self.router._routed(name, ShardedDatabase.ROUTES[name], self.max_age)
+        return getattr(self.router, name)
+
+@dataclass
+class Session:
+    token: str
+    employee_id: int
+    role: str
+    expires_at: float
+    password_hash: bytes = None
+    verifier: bytes = None
+
+    def expired(self, now: float = None) -> bool:
+        return (time.time() if now is None else now) >= self.expires_at
+
+class LoginService:
+    """
+    Employee login that keeps bcrypt off the calling (UI) thread.
+
+    The employee row is looked up on the caller's thread through idx_employees_name,
+    while the password check runs in a small worker pool. A successful login issues a
+    short-lived session token. Until it expires, logging the same employee in again
+    with the same password is verified against an in-memory HMAC instead of bcrypt.
+
+    Hashes whose cost differs from `db.bcrypt_rounds` are rehashed in the worker and
+    written back on the caller's thread by the next call into the service, because
+    the database connection belongs to that thread.
+
+    Args:
+        db (Database): Database holding the employees table.
+        workers (int): Number of bcrypt worker threads.
+        session_ttl (float): Session lifetime in seconds, defaults to one shift (8 hours).
+    """
+
+    def __init__(self, db: Database, workers: int = 2, session_ttl: float = 8 * 60 * 60):
+        self.db = db
+        self.session_ttl = session_ttl
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="login")
+        self._secret = secrets.token_bytes(32)
+        self._sessions = {}      # {token: Session}
+        self._by_employee = {}   # {employee_id: Session}
+        self._rehashes = queue.SimpleQueue()
+        self._lock = threading.Lock()
+
+    def login_async(self, first_name, last_name, password) -> Future:
+        """
+        Start a login and return a Future that resolves to a Session.
+
+        The Future raises "Employee not found." or "Incorrect password." on failure.
+        """
+        self.apply_rehashes()
+        result = self.db.find_employee_credentials(first_name, last_name)
+        if not result:
+            future = Future()
+            future.set_exception(Exception("Employee not found."))
+            return future
+
+        emp_id, hashed_pw, role = result
+        session = self._cached_session(emp_id, hashed_pw, password)
+        if session:
+            future = Future()
+            future.set_result(session)
+            return future
+        return self._pool.submit(self._verify, emp_id, hashed_pw, role, password)
+
+    def login(self, first_name, last_name, password) -> Session:
+        """Log an employee in, blocking until the password has been verified."""
+        session = self.login_async(first_name, last_name, password).result()
+        self.apply_rehashes()
+        return session
+
+    def validate(self, token) -> Session:
+        """Return the live session for a token, or None if it is unknown or expired."""
+        with self._lock:
+            session = self._sessions.get(token)
+            if session and session.expired():
+                self._drop(session)
+                return None
+            return session
+
+    def logout(self, token):
+        """End a session."""
+        with self._lock:
+            session = self._sessions.get(token)
+            if session:
+                self._drop(session)
+
+    def apply_rehashes(self):
+        """Write hashes upgraded by the workers back to the database."""
+        while True:
+            try:
+                emp_id, new_hash = self._rehashes.get_nowait()
+            except queue.Empty:
+                return
+            self.db.store_password_hash(emp_id, new_hash)
+            self.db.events.emit(INFO, "password_rehashed", employee_id=emp_id, rounds=self.db.bcrypt_rounds)
+
+    def shutdown(self):
+        """Stop the worker pool and apply outstanding rehashes."""
+        self._pool.shutdown(wait=True)
+        self.apply_rehashes()
+
+    def _verify(self, emp_id, hashed_pw, role, password) -> Session:
+        if not bcrypt.checkpw(password.encode(), hashed_pw):
+            raise Exception("Incorrect password.")
+        if bcrypt_rounds_of(hashed_pw) != self.db.bcrypt_rounds:
+            new_hash = bcrypt.hashpw(password.encode(), bcrypt.gensalt(rounds=self.db.bcrypt_rounds))
+            self._rehashes.put((emp_id, new_hash))
+            hashed_pw = new_hash
+        return self._issue(emp_id, role, hashed_pw, password)
+
+    def _issue(self, emp_id, role, hashed_pw, password) -> Session:
+        session = Session(
+            token=secrets.token_urlsafe(24),
+            employee_id=emp_id,
+            role=role,
+            expires_at=time.time() + self.session_ttl,
+            password_hash=hashed_pw,
+            verifier=self._verifier(emp_id, password)
+        )
+        with self._lock:
+            previous = self._by_employee.get(emp_id)
+            if previous:
+                self._drop(previous)
+            self._sessions[session.token] = session
+            self._by_employee[emp_id] = session
+        return session
+
+    def _cached_session(self, emp_id, hashed_pw, password) -> Session:
+        with self._lock:
+            session = self._by_employee.get(emp_id)
+            if not session:
+                return None
+            if session.expired():
+                self._drop(session)
+                return None
+        # A password change replaces the stored hash, which invalidates the cache entry
+        if session.password_hash != hashed_pw:
+            return None
+        if not hmac.compare_digest(session.verifier, self._verifier(emp_id, password)):
+            return None
+        return session
+
+    def _verifier(self, emp_id, password) -> bytes:
+        return hmac.new(self._secret, f"{emp_id}:{password}".encode(), "sha256").digest()
+
+    def _drop(self, session: Session):
+        self._sessions.pop(session.token, None)
+        if self._by_employee.get(session.employee_id) is session:
+            del self._by_employee[session.employee_id]
+
+class PartIndex:
+    """
+    In-memory name <-> pno <-> Part index of one store's inventory.
+
+    The index subscribes to the database's part change notifications, so it stays
+    current without being reloaded and every lookup is a dictionary access.
+    """
+
+    def __init__(self, db: Database):
+        self.db = db
+        self.store_id = None
+        self.by_pno = {}    # {pno: Part}, in pno order
+        self.by_name = {}   # {name: pno}
+        db.add_listener(self.apply_change)
+
+    def load(self, store_id: int):
+        """Replace the index contents with the parts of `store_id`."""
+        self.store_id = store_id
+        self.by_pno = {part.part_id: part for part in self.db.get_parts_by_store(store_id)}
+        self.by_name = {part.name: part.part_id for part in self.by_pno.values()}
+
+    def close(self):
+        """Stop following database changes."""
+        self.db.remove_listener(self.apply_change)
+
+    def get(self, pno: int) -> Part:
+        """Return the part with this pno, or None."""
+        return self.by_pno.get(pno)
+
+    def find(self, name: str) -> Part:
+        """Return the part with this name, or None."""
+        pno = self.by_name.get(name)
+        return None if pno is None else self.by_pno[pno]
+
+    def names(self) -> List[str]:
+        return [part.name for part in self.by_pno.values()]
+
+    def parts(self) -> List[Part]:
+        return list(self.by_pno.values())
+
+    def __contains__(self, pno) -> bool:
+        return pno in self.by_pno
+
+    def __len__(self) -> int:
+        return len(self.by_pno)
+
+    def apply_change(self, change: PartChange):
+        """Apply a PartChange notification from the database."""
+        if change.kind == "removed":
+            for pno in change.pnos:
+                self._discard(pno)
+            return
+        for part in change.parts:
+            if part.store_id != self.store_id:
+                # A part moved to another store is no longer in this index
+                self._discard(part.part_id)
+                continue
+            previous = self.by_pno.get(part.part_id)
+            if previous and previous.name != part.name and self.by_name.get(previous.name) == part.part_id:
+                del self.by_name[previous.name]
+            # Existing keys keep their position; new parts have the highest pno
+            self.by_pno[part.part_id] = part
+            self.by_name[part.name] = part.part_id
+
+    def _discard(self, pno: int):
+        part = self.by_pno.pop(pno, None)
+        if part and self.by_name.get(part.name) == pno:
+            del self.by_name[part.name]
+
+@dataclass(slots=True)
+class CartLine:
+    part: Part
+    quantity: int
+    total_cents: int = 0
+
+    @property
+    def total(self) -> float:
+        return to_dollars(self.total_cents)
+
+class Cart:
+    """
+    Shopping cart keyed by pno that keeps its totals current as lines change.
+
+    Each change adjusts the running subtotal by the difference in one line's total,
+    so reading the totals never walks the cart. Adding, changing and removing a line
+    are dict operations on its pno; the row order for display is rebuilt only when it
+    is asked for after a removal. Discount and tax use the same pricing functions as
+    Database.create_purchase. The cart has no UI dependencies.
+
+    Args:
+        tax_rate (float): Store tax rate as decimal (e.g., 0.08 for 8%).
+    """
+
+    def __init__(self, tax_rate: float = 0.0):
+        self.tax_rate = tax_rate
+        self.lines = {}        # {pno: CartLine}, in the order items were added
+        self._rows = []        # pnos in display order, None after a removal until next asked for
+        self._positions = {}   # {pno: row}, kept in step with _rows
+        self.subtotal_cents = 0
+        self.discount_id = None
+        self.discount_type = None
+        self.discount_value = 0.0
+
+    def add(self, part: Part, quantity: int) -> CartLine:
+        """Add `quantity` of a part, creating its line if needed."""
+        line = self.lines.get(part.part_id)
+        return self.set_quantity(part, quantity + (line.quantity if line else 0))
+
+    def set_quantity(self, part: Part, quantity: int) -> CartLine:
+        """Set the quantity of a part's line, creating it if needed."""
+        if quantity <= 0:
+            raise ValueError("Quantity must be greater than 0.")
+        if quantity > part.quantity:
+            raise ValueError(f"Not enough stock available. Max available: {part.quantity}.")
+        line = self.lines.get(part.part_id)
+        if line is None:
+            line = self.lines[part.part_id] = CartLine(part, 0)
+            if self._rows is not None:
+                self._positions[part.part_id] = len(self._rows)
+                self._rows.append(part.part_id)
+        previous_total = line.total_cents
+        line.part = part
+        line.quantity = quantity
+        line.total_cents = line_total(part.price_cents, quantity)
+        self.subtotal_cents += line.total_cents - previous_total
+        return line
+
+    def remove(self, pno: int):
+        """Remove a line from the cart."""
+        line = self.lines.pop(pno, None)
+        if line is None:
+            return
+        self.subtotal_cents -= line.total_cents
+        self._rows = None
+
+    def clear(self):
+        self.lines.clear()
+        self._rows = []
+        self._positions = {}
+        self.subtotal_cents = 0
+        self.set_discount(None)
+
+    def set_discount(self, discount_id, discount_type: str = None, value: float = 0.0):
+        """Apply a transaction-level discount, or remove it with discount_id=None."""
+        self.discount_id = discount_id
+        self.discount_type = discount_type if discount_id is not None else None
+        self.discount_value = value if discount_id is not None else 0.0
+
+    def totals(self) -> Totals:
+        """Subtotal, discount, tax and total of the cart."""
+        discount = transaction_discount(self.subtotal_cents, self.discount_type, self.discount_value) if self.discount_type else 0
+        return price_totals(self.subtotal_cents, self.tax_rate, discount)
+
+    @property
+    def subtotal(self) -> float:
+        return to_dollars(self.subtotal_cents)
+
+    def position(self, pno: int) -> int:
+        """Row of a line in display order."""
+        self._index_rows()
+        return self._positions[pno]
+
+    def pno_at(self, row: int) -> int:
+        """Part number of the line shown at a row."""
+        self._index_rows()
+        return self._rows[row]
+
+    def _index_rows(self):
+        if self._rows is None:
+            self._rows = list(self.lines)
+            self._positions = {pno: row for row, pno in enumerate(self._rows)}
+
+    def to_parts_sold(self) -> List[PartSold]:
+        """The cart lines as PartSold records for Database.create_purchase."""
+        return [
+            PartSold(name=line.part.name, quantity=line.quantity, unit_cents=line.part.price_cents,
+                     total_cents=line.total_cents, part_id=pno)
+            for pno, line in self.lines.items()
+        ]
+
+    def __contains__(self, pno) -> bool:
+        return pno in self.lines
+
+    def __iter__(self):
+        return iter(self.lines.values())
+
+    def __len__(self) -> int:
+        return len(self.lines)
+
+class SaleJournal:
+    """
+    Local, append-only journal of sales for registers that must keep selling while the
+    store database is locked or unreachable.
+
+    A sale is durable once `record` returns, so the receipt can be printed right away.
+    Entries are never rewritten; syncing only stamps them with the transaction they
+    became (or the reason they were rejected). Like Database, an instance belongs to
+    the thread that created it; the syncer opens its own.
+
+    Args:
+        path (str): Path of the journal file, on a local disk.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode = WAL")
+        self.conn.execute("""
+        CREATE TABLE IF NOT EXISTS journal (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            idempotency_key TEXT NOT NULL UNIQUE,
+            store_id INTEGER NOT NULL,
+            employee_id INTEGER,
+            discount_id INTEGER,
+            lines TEXT NOT NULL,  -- JSON [[pno, name, quantity, unit_cents, discount_percent], ...]
+            created_at REAL NOT NULL,
+            synced_at REAL,
+            transaction_id INTEGER,
+            error TEXT
+        );
+        """)
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_journal_pending ON journal(seq) WHERE synced_at IS NULL;")
+        self.conn.commit()
+
+    def record(self, parts: List[PartSold], store_id: int, employee_id: int = 1, discount_id: int = None) -> str:
+        """Append a sale and return its idempotency key."""
+        key = secrets.token_hex(16)
+        lines = json.dumps([[p.part_id, p.name, p.quantity, p.unit_cents, p.discount_percent] for p in parts])
+        with self.conn:
+            self.conn.execute(
+                "INSERT INTO journal (idempotency_key, store_id, employee_id, discount_id, lines, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (key, store_id, employee_id, discount_id, lines, time.time())
+            )
+        return key
+
+    def pending(self, limit: int = 200) -> List[JournalEntry]:
+        """The oldest `limit` sales not yet synced, in the order they were taken."""
+        rows = self.conn.execute(
+            "SELECT seq, idempotency_key, store_id, employee_id, discount_id, lines FROM journal "
+            "WHERE synced_at IS NULL ORDER BY seq LIMIT ?",
+            (limit,)
+        ).fetchall()
+        return [
+            JournalEntry(seq, key, store_id, employee_id, discount_id, [
+                PartSold(name, quantity, unit_cents, line_total(unit_cents, quantity, discount), discount, pno)
+                for pno, name, quantity, unit_cents, discount in json.loads(lines)
+            ])
+            for seq, key, store_id, employee_id, discount_id, lines in rows
+        ]
+
+    def settle(self, result: SyncResult):
+        """Stamp the entries of a replayed batch as synced or rejected."""
+        now = time.time()
+        with self.conn:
+            self.conn.executemany(
+                "UPDATE journal SET synced_at = ?, transaction_id = ? WHERE seq = ?",
+                [(now, transaction_id, seq) for seq, transaction_id in result.synced]
+            )
+            self.conn.executemany(
+                "UPDATE journal SET synced_at = ?, error = ? WHERE seq = ?",
+                [(now, error, seq) for seq, error in result.rejected]
+            )
+
+    def backlog(self) -> int:
+        """Number of sales waiting to be synced."""
+        return self.conn.execute("SELECT COUNT(*) FROM journal WHERE synced_at IS NULL").fetchone()[0]
+
+    def rejected(self) -> list:
+        """(seq, idempotency_key, store_id, error) of every sale the database refused."""
+        return self.conn.execute(
+            "SELECT seq, idempotency_key, store_id, error FROM journal WHERE error IS NOT NULL ORDER BY seq"
+        ).fetchall()
+
+    def close(self):
+        self.conn.close()
+
+class JournalSyncer:
+    """
+    Background thread that replays a SaleJournal into the store database.
+
+    Pending sales are replayed `batch_size` at a time, one commit per batch. While
+    the database is locked or unreachable the syncer backs off (doubling up to
+    `max_backoff` seconds) and the journal keeps growing; nothing is lost or applied
+    twice, because every sale carries its idempotency key into the transactions table.
+
+    Each replayed batch is put on `results` as a SyncResult for the UI thread to pick
+    up, e.g. to refresh the parts whose stock changed.
+
+    Args:
+        db_name (str): Path of the store database file, or the directory of a ShardedDatabase.
+        journal_path (str): Path of the journal file.
+        batch_size (int): Sales replayed per transaction.
+        interval (float): Seconds between syncs when `wake` is not called.
+        max_backoff (float): Longest wait after a failed sync.
+        events (EventSink, optional): Sink shared with the syncer's Database.
+    """
+
+    def __init__(self, db_name: str, journal_path: str, batch_size: int = 200, interval: float = 2.0,
+                 max_backoff: float = 60.0, events: EventSink = None):
+        self.db_name = db_name
+        self.journal_path = journal_path
+        self.batch_size = batch_size
+        self.interval = interval
+        self.max_backoff = max_backoff
+        self.events = events
+        self.results = queue.SimpleQueue()
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="journal-sync", daemon=True)
+
+    def start(self) -> "JournalSyncer":
+        self._thread.start()
+        return self
+
+    def wake(self):
+        """Sync now instead of at the next interval, e.g. right after a sale."""
+        self._wake.set()
+
+    def stop(self, timeout: float = None):
+        """Finish the current batch and stop the thread."""
+        self._stopping.set()
+        self._wake.set()
+        self._thread.join(timeout)
+
+    def _run(self):
+        db = None
+        journal = SaleJournal(self.journal_path)
+        delay = self.interval
+        try:
+            while not self._stopping.is_set():
+                try:
+                    if db is None:
+                        db = (ShardedDatabase(self.db_name, events=self.events) if os.path.isdir(self.db_name)
+                              else Database(self.db_name, events=self.events))
+                    self._drain(db, journal)
+                    delay = self.interval
+                except sqlite3.Error as e:
+                    delay = min(delay * 2, self.max_backoff)
+                    if db is not None:
+                        db.events.emit(WARNING, "journal_sync_stalled", backlog=journal.backlog(),
+                                       retry_in=delay, error=e)
+                self._wake.wait(delay)
+                self._wake.clear()
+        finally:
+            journal.close()
+            if db is not None:
+                db.close_connection()
+
+    def _drain(self, db: Database, journal: SaleJournal):
+        while not self._stopping.is_set():
+            entries = journal.pending(self.batch_size)
+            if not entries:
+                return
+            result = db.replay_sales(entries)
+            journal.settle(result)
+            self.results.put(result)
+
+class BackupResult(NamedTuple):
+    path: str
+    ok: bool
+    pages: int
+    seconds: float
+    size: int
+    error: str = None
+
+class BackupScheduler:
+    """
+    Online backups of a database file, taken while registers keep selling.
+
+    A backup copies `pages` pages per step through sqlite3's backup API and sleeps
+    `sleep` seconds between steps, so the source is only read-locked for one small
+    step at a time. A write by another connection between steps restarts the copy,
+    which is cheap while steps are small. The copy is written to a .partial file,
+    integrity-checked and only then renamed into place; the newest `keep` backups are
+    kept. `progress` holds (pages copied, total pages) of the running backup and
+    `last_result` the outcome of the previous one.
+
+    Args:
+        db_name (str): Path of the database file.
+        directory (str): Directory for the backups.
+        interval (float): Seconds between scheduled backups.
+        keep (int): Number of backups to keep.
+        pages (int): Pages copied per step.
+        sleep (float): Seconds slept between steps.
+        events (EventSink, optional): Sink for progress and result events.
+    """
+
+    def __init__(self, db_name: str, directory: str, interval: float = 3600.0, keep: int = 7,
+                 pages: int = 256, sleep: float = 0.01, events: EventSink = None):
+        self.db_name = db_name
+        self.directory = directory
+        self.interval = interval
+        self.keep = keep
+        self.pages = pages
+        self.sleep = sleep
+        self._owns_events = events is None
+        self.events = EventSink() if events is None else events
+        self.progress = (0, 0)
+        self.last_result = None
+        self._lock = threading.Lock()  # one backup at a time
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="backup", daemon=True)
+
+    def start(self) -> "BackupScheduler":
+        self._thread.start()
+        return self
+
+    def stop(self, timeout: float = None):
+        self._stopping.set()
+        self._wake.set()
+        self._thread.join(timeout)
+        if self._owns_events:
+            self.events.close()
+
+    def request_backup(self):
+        """Run a backup on the scheduler thread now instead of at the next interval."""
+        self._wake.set()
+
+    def backups(self) -> List[str]:
+        """Paths of the finished backups, oldest first."""
+        stem = pathlib.Path(self.db_name).stem
+        return sorted(str(path) for path in pathlib.Path(self.directory).glob(f"{stem}-*.db"))
+
+    def backup_now(self) -> BackupResult:
+        """Take a backup on the calling thread and rotate old ones."""
+        with self._lock:
+            os.makedirs(self.directory, exist_ok=True)
+            stem = pathlib.Path(self.db_name).stem
+            path = os.path.join(self.directory, f"{stem}-{datetime.now():%Y%m%d-%H%M%S-%f}.db")
+            partial = path + ".partial"
+            start = time.perf_counter()
+            self.progress = (0, 0)
+            try:
+                source = sqlite3.connect(self.db_name)
+                target = sqlite3.connect(partial)
+                try:
+                    source.backup(target, pages=self.pages, progress=self._on_progress, sleep=self.sleep)
+                    status = target.execute("PRAGMA integrity_check").fetchone()[0]
+                finally:
+                    target.close()
+                    source.close()
+                if status != "ok":
+                    raise sqlite3.DatabaseError(f"integrity check failed: {status}")
+                os.replace(partial, path)
+            except sqlite3.Error as e:
+                if os.path.exists(partial):
+                    os.remove(partial)
+                result = BackupResult(path, False, self.progress[1], time.perf_counter() - start, 0, str(e))
+                self.events.emit(ERROR, "backup_failed", db=self.db_name, error=e)
+            else:
+                result = BackupResult(path, True, self.progress[1], time.perf_counter() - start, os.path.getsize(path))
+                self.events.emit(INFO, "backup_completed", db=self.db_name, path=path, pages=result.pages,
+                                 seconds=round(result.seconds, 3), size=result.size)
+                self._rotate()
+            self.last_result = result
+            return result
+
+    def _on_progress(self, status, remaining, total):
+        self.progress = (total - remaining, total)
+        self.events.emit(DEBUG, "backup_progress", db=self.db_name, copied=total - remaining, total=total)
+
+    def _rotate(self):
+        for path in self.backups()[:-self.keep]:
+            os.remove(path)
+            self.events.emit(INFO, "backup_rotated", path=path)
+
+    def _run(self):
+        while not self._stopping.is_set():
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            if not self._stopping.is_set():
+                self.backup_now()
+
+class GroupCommitWriter:
+    """
+    Coalesces purchases from many threads into shared SQLite transactions.
+
+    `submit` queues a purchase and returns a Future at once. A writer thread, which owns
+    its own connection, waits up to `window` seconds after the first queued purchase
+    for more (at most `max_batch`) and records them with Database.record_purchases:
+    one commit, so one fsync, for the whole group. Each Future resolves to its own
+    transaction_id, or raises the error that rejected that purchase alone; a failed
+    commit fails every purchase of the group.
+
+    Args:
+        db_name (str): Path of the database file.
+        window (float): Longest wait, in seconds, for more purchases to join a group. With
+            0 a group is whatever queued while the previous commit ran.
+        max_batch (int): Largest group.
+        events (EventSink, optional): Sink shared with the writer's Database.
+    """
+
+    def __init__(self, db_name: str, window: float = 0.001, max_batch: int = 64, events: EventSink = None):
+        self.db_name = db_name
+        self.window = window
+        self.max_batch = max_batch
+        self.events = events
+        self.groups = 0
+        self.purchases = 0
+        self._queue = queue.SimpleQueue()
+        self._stopping = False
+        self._lock = threading.Lock()   # orders every submit before or after the stop marker
+        self._thread = threading.Thread(target=self._run, name="group-commit", daemon=True)
+
+    def start(self) -> "GroupCommitWriter":
+        self._thread.start()
+        return self
+
+    def submit(self, parts: List[PartSold], store_id: int, employee_id: int = 1, discount_id: int = None,
+               idempotency_key: str = None) -> Future:
+        """Queue a purchase. The Future resolves to its transaction_id."""
+        future = Future()
+        with self._lock:
+            if self._stopping:
+                raise RuntimeError("GroupCommitWriter is stopped")
+            self._queue.put((PurchaseRequest(parts, store_id, employee_id, discount_id, idempotency_key), future))
+        return future
+
+    def stop(self, timeout: float = None):
+        """Record the purchases already queued and stop the writer thread."""
+        with self._lock:
+            self._stopping = True
+            self._queue.put(None)
+        self._thread.join(timeout)
+
+    def _next_group(self) -> list:
+        first = self._queue.get()
+        if first is None:
+            return None
+        group = [first]
+        deadline = time.perf_counter() + self.window
+        while len(group) < self.max_batch:
+            remaining = deadline - time.perf_counter()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                self._queue.put(None)  # finish this group, then stop
+                break
+            group.append(item)
+        return group
+
+    def _run(self):
+        db = Database(self.db_name, events=self.events)
+        try:
+            while True:
+                group = self._next_group()
+                if group is None:
+                    return
+                try:
+                    outcomes = db.record_purchases([request for request, _ in group])
+                except Exception as e:
+                    for _, future in group:
+                        future.set_exception(e)
+                    continue
+                for (_, future), outcome in zip(group, outcomes):
+                    if isinstance(outcome, Exception):
+                        future.set_exception(outcome)
+                    else:
+                        future.set_result(outcome.transaction_id)
+                self.groups += 1
+                self.purchases += len(group)
+                db.events.emit(DEBUG, "group_committed", purchases=len(group))
+        finally:
+            db.close_connection()
@@ -1,10 +1,34 @@
 import tkinter as tk
 from tkinter import ttk, messagebox, simpledialog, filedialog
-from DataBase.Database import Database, Part, PartSold, TransactionDetails
+from DataBase.Database import Cart, Database, LoginService, Part, PartIndex, PartSold, TransactionDetails, ERROR
+from DataBase.Database import downsample_minmax, BackupScheduler, JournalSyncer, SaleJournal, ShardedDatabase
 import matplotlib.pyplot as plt
+import matplotlib.dates as mdates
+import numpy as np
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
 from datetime import datetime
-import pandas as pd
+import itertools
+import queue
+
+# Lines of the detailed sales report shown on screen
+REPORT_PREVIEW_LINES = 1000
+
+# Take sales into a local journal and sync them to the store database in the background,
+# so checkout keeps working while the database is locked or unreachable. Off by default:
+# a journaled sale is only checked against stock when it syncs.
+OFFLINE_REGISTER = False
+SALE_JOURNAL_PATH = "sale_journal.db"
+SYNC_POLL_MS = 1000
+
+# Directory for one database file per store (ShardedDatabase), or None for pos_system.db
+SHARD_DIRECTORY = None
+
+# How often store balances are folded from the sales ledger (Database.rollup_balances)
+BALANCE_ROLLUP_MS = 10 * 60 * 1000
+
+# Online backups of pos_system.db, taken while the registers keep selling
+BACKUP_DIRECTORY = "backups"
+BACKUP_INTERVAL = 60 * 60  # seconds
 
 class POSApp:
     def __init__(self, root):
@@ -12,8 +36,23 @@ class POSApp:
         self.root.title("Point of Sale System")
         self.root.geometry("800x650")
         
-        self.db = Database("pos_system.db")
-        self.cart = {}
+        self.db = ShardedDatabase(SHARD_DIRECTORY) if SHARD_DIRECTORY else Database("pos_system.db")
+        self.login_service = LoginService(self.db)
+        self.session = None
+        self.part_index = PartIndex(self.db)  # Kept current by database change notifications
+        self.inventory_pnos = []  # pno of each inventory listbox row
+        self.cart = Cart()
+        self.journal = None
+        self.syncer = None
+        if OFFLINE_REGISTER:
+            self.journal = SaleJournal(SALE_JOURNAL_PATH)
+            self.syncer = JournalSyncer(self.db.db_name, SALE_JOURNAL_PATH, events=self.db.events).start()
+            self.root.after(SYNC_POLL_MS, self.poll_sync_results)
+        self.root.after(BALANCE_ROLLUP_MS, self.rollup_balances)
+        self.backups = None
+        if not SHARD_DIRECTORY:
+            self.backups = BackupScheduler(self.db.db_name, BACKUP_DIRECTORY, BACKUP_INTERVAL,
+                                           events=self.db.events).start()
         self.store_id = None 
         self.selected_store_id = tk.StringVar(value="")  
         self.selected_employee_id = tk.StringVar(value="")  
@@ -26,6 +65,18 @@ class POSApp:
         self.employee_name_label.pack(anchor="ne", padx=10, pady=2)
         self.create_tabs()
         self.load_items()
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
+
+    def on_close(self):
+        """Stop the background workers and close the database before the window goes."""
+        if self.syncer:
+            self.syncer.stop()
+            self.journal.close()
+        if self.backups:
+            self.backups.stop()
+        self.login_service.shutdown()
+        self.db.close_connection()
+        self.root.destroy()
     
     def create_store_selector(self):
         """Create a dropdown to select the store."""
@@ -64,6 +115,8 @@ class POSApp:
         self.load_employees()  # Update employees for the selected store
         self.load_employee_combobox()  # Update the employee dropdown
         self.load_sales_discounts()
+        self.cart.clear()  # Cart lines are parts of the previous store
+        self.cart.tax_rate = self.db.get_store_tax_rate(self.store_id) or 0.0
         self.update_cart_display()
     
     def create_employee_selector(self):
@@ -85,8 +138,8 @@ class POSApp:
 
     def load_employee_combobox(self):
         """Load employees into the employee selection combobox."""
-        employees = self.db.get_employees()
-        employee_options = {employee[0]: f"{employee[1]} {employee[2]}" for employee in employees if employee[4] == self.store_id}
+        employees = self.db.get_store_employees(self.store_id)
+        employee_options = {employee.id: f"{employee.first_name} {employee.last_name}" for employee in employees}
         self.employee_combobox["values"] = [f"{emp_name} (ID: {emp_id})" for emp_id, emp_name in employee_options.items()]
         self.selected_employee_id.set("")  # No employee displayed initially
 
@@ -110,8 +163,24 @@ class POSApp:
                 return
 
             first, last = employee_name.split(" ", 1)
-            role, emp_id = self.db.employee_login(first, last, password)
-            if emp_id == employee_id:
+            login = self.login_service.login_async(first, last, password)
+            self.employee_combobox.config(state="disabled")
+            self.logged_in_employee_name.set(f"Verifying {employee_name}...")
+            self.finish_authentication(login, employee_id, employee_name)
+        except Exception as e:
+            self.login_failed(e)
+
+    def finish_authentication(self, login, employee_id, employee_name):
+        """Complete a login once the password check has finished off the UI thread."""
+        if not login.done():
+            self.root.after(20, self.finish_authentication, login, employee_id, employee_name)
+            return
+        self.employee_combobox.config(state="readonly")
+        try:
+            session = login.result()
+            self.login_service.apply_rehashes()
+            if session.employee_id == employee_id:
+                self.session = session
                 self.selected_employee_id.set(str(employee_id)) 
                 self.employee_combobox.set(f"{employee_name} (ID: {employee_id})")
                 self.logged_in_employee_name.set(f"Logged in as: {employee_name}")
@@ -119,12 +188,20 @@ class POSApp:
             else:
                 raise Exception("Authentication failed.")
         except Exception as e:
-            messagebox.showerror("Error", str(e))
-            self.employee_combobox.set("") 
-            self.logged_in_employee_name.set("")
+            self.login_failed(e)
+
+    def login_failed(self, error):
+        """Report a failed login and clear the employee selection."""
+        self.employee_combobox.config(state="readonly")
+        messagebox.showerror("Error", str(error))
+        self.employee_combobox.set("") 
+        self.logged_in_employee_name.set("")
 
     def logout_employee(self):
         """Logout the currently selected employee."""
+        # The session stays cached in the login service so the employee can log
+        # back in later in the shift without another bcrypt check
+        self.session = None
         self.selected_employee_id.set("") 
         self.employee_combobox.set("")
         self.logged_in_employee_name.set("")
@@ -181,7 +258,7 @@ class POSApp:
         self.discount_label.pack(pady=5)
         self.discount_combobox = ttk.Combobox(self.sales_frame, textvariable=self.discount_var, state="readonly")
         self.discount_combobox.pack(pady=5)
-        self.discount_combobox.bind("<<ComboboxSelected>>", lambda e: self.update_cart_display())
+        self.discount_combobox.bind("<<ComboboxSelected>>", lambda e: self.apply_sales_discount())
 
         self.add_button = ttk.Button(self.sales_frame, text="Add to Cart", command=self.add_to_cart)
         self.add_button.pack(pady=5)
@@ -199,10 +276,13 @@ class POSApp:
 
     def load_items(self):
         """Load items from the database and populate the combobox."""
-        parts = self.db.get_parts_by_store(self.store_id)
-        self.items = {part.name: (part.price, part.quantity) for part in parts}  # {name: (price, quantity)}
-        self.item_combobox["values"] = list(self.items.keys())
+        self.part_index.load(self.store_id)
+        self.refresh_items()
         self.load_sales_discounts()
+
+    def refresh_items(self):
+        """Refresh the item combobox from the part index."""
+        self.item_combobox["values"] = self.part_index.names()
     
     def load_sales_discounts(self):
         """Load active discounts for the selected store into the sales tab discount combobox."""
@@ -215,6 +295,16 @@ class POSApp:
             discount_display_list.append(display)
         self.discount_combobox["values"] = ["No Discount"] + discount_display_list
         self.discount_var.set("No Discount")
+        self.cart.set_discount(None)
+
+    def apply_sales_discount(self):
+        """Apply the discount selected in the sales tab to the cart."""
+        discount = self.sales_discounts.get(self.discount_var.get())
+        if discount:
+            self.cart.set_discount(discount[0], discount[3], float(discount[4]))
+        else:
+            self.cart.set_discount(None)
+        self.update_cart_totals()
 
     def create_inventory_tab(self):
         self.item_name_label = ttk.Label(self.inventory_frame, text="Item Name:")
@@ -237,6 +327,9 @@ class POSApp:
         
         self.add_inventory_button = ttk.Button(self.inventory_frame, text="Add Item", command=self.add_inventory_item)
         self.add_inventory_button.pack(pady=5)
+
+        self.import_inventory_button = ttk.Button(self.inventory_frame, text="Import Items", command=self.import_inventory_items)
+        self.import_inventory_button.pack(pady=5)
         
         self.inventory_listbox = tk.Listbox(self.inventory_frame)
         self.inventory_listbox.pack(pady=5, fill=tk.BOTH, expand=True)
@@ -284,21 +377,23 @@ class POSApp:
             self.store_context_menu.add_command(label="Set Tax Rate", command=lambda: self.set_store_tax_rate(store_id, store_name))
             self.store_context_menu.post(event.x_root, event.y_root)
         except Exception as e:
-            print(f"Error showing store context menu: {e}")
+            self.db.events.emit(ERROR, "ui_error", action="show_store_context_menu", error=e)
 
     def set_store_tax_rate(self, store_id, store_name):
         """Prompt user to set a new tax rate for the store."""
         try:
             new_tax = simpledialog.askfloat("Set Tax Rate", f"Enter new tax rate for '{store_name}' (as a percentage, e.g., 8.5 for 8.5%):")
             if new_tax is not None and new_tax >= 0:
-                self.db.cursor.execute("UPDATE stores SET tax_rate = ? WHERE store_id = ?", (round(new_tax / 100, 4), store_id))
-                self.db.conn.commit()
+                self.db.set_store_tax_rate(store_id, new_tax / 100)
                 self.load_stores()
+                if store_id == self.store_id:
+                    self.cart.tax_rate = round(new_tax / 100, 4)
+                    self.update_cart_totals()
                 messagebox.showinfo("Success", f"Tax rate for '{store_name}' set to {new_tax:.2f}%.")
             elif new_tax is not None:
                 messagebox.showerror("Error", "Tax rate must be 0 or greater.")
         except Exception as e:
-            print(f"Error setting store tax rate: {e}")
+            self.db.events.emit(ERROR, "ui_error", action="set_store_tax_rate", error=e)
 
     def create_transactions_tab(self):
         """Create the Transactions tab."""
@@ -323,7 +418,7 @@ class POSApp:
                 details += f"- {part.name}: {part.quantity} @ ${part.unit_price:.2f} each (Total: ${part.total_price:.2f})\n"
             messagebox.showinfo("Transaction Details", details)
         except Exception as e:
-            print(f"Error viewing transaction details: {e}")
+            self.db.events.emit(ERROR, "ui_error", action="view_transaction_details", error=e)
 
     def show_transaction_context_menu(self, event):
         """Show a context menu for transactions."""
@@ -336,34 +431,67 @@ class POSApp:
             self.transaction_context_menu = tk.Menu(self.transactions_listbox, tearoff=0)
             self.transaction_context_menu.add_command(label="View Details", command=lambda: self.view_transaction_details(None))
             self.transaction_context_menu.add_command(label="Process Return", command=lambda: self.process_return(transaction.transaction_id))
+            self.transaction_context_menu.add_command(label="Return Items...", command=lambda: self.process_partial_return(transaction.transaction_id))
             self.transaction_context_menu.post(event.x_root, event.y_root)
         except Exception as e:
-            print(f"Error showing transaction context menu: {e}")
+            self.db.events.emit(ERROR, "ui_error", action="show_transaction_context_menu", error=e)
+
+    def returning_employee_id(self):
+        """ID of the selected employee, or None after telling the user to pick one."""
+        combo_val = self.employee_combobox.get()
+        if "(ID:" in combo_val:
+            _, id_part = combo_val.rsplit(" (ID:", 1)
+            return int(id_part.replace(")", "").strip())
+        employee_id = self.selected_employee_id.get()
+        if not employee_id.isdigit():
+            messagebox.showerror("Error", "Please select a valid employee.")
+            return None
+        return int(employee_id)
+
+    def return_processed(self, return_transaction_id):
+        if return_transaction_id:
+            messagebox.showinfo("Success", f"Return processed successfully. Return Transaction ID: {return_transaction_id}")
+            self.load_transactions()  # Update transactions
+            self.load_inventory_list()  # Update inventory
+            self.load_stores()  # Update store balances
+        else:
+            messagebox.showerror("Error", "Failed to process return.")
 
     def process_return(self, transaction_id):
         """Process a return for the selected transaction."""
         try:
-            combo_val = self.employee_combobox.get()
-            if "(ID:" in combo_val:
-                _, id_part = combo_val.rsplit(" (ID:", 1)
-                employee_id = int(id_part.replace(")", "").strip())
-            else:
-                employee_id = self.selected_employee_id.get()
-                if not employee_id.isdigit():
-                    messagebox.showerror("Error", "Please select a valid employee.")
-                    return
-                employee_id = int(employee_id)
+            employee_id = self.returning_employee_id()
+            if employee_id is None:
+                return
+            self.return_processed(self.db.return_by_transaction_id(transaction_id, employee_id))
+        except Exception as e:
+            self.db.events.emit(ERROR, "ui_error", action="process_return", error=e)
+            messagebox.showerror("Error", "Failed to process return. Please ensure you are logged in.")
 
-            return_transaction_id = self.db.return_by_transaction_id(transaction_id, employee_id)
-            if return_transaction_id:
-                messagebox.showinfo("Success", f"Return processed successfully. Return Transaction ID: {return_transaction_id}")
-                self.load_transactions()  # Update transactions
-                self.load_inventory_list()  # Update inventory
-                self.load_stores()  # Update store balances
-            else:
-                messagebox.showerror("Error", "Failed to process return.")
+    def process_partial_return(self, transaction_id):
+        """Return some of the items on the selected transaction, asking a quantity per line."""
+        try:
+            employee_id = self.returning_employee_id()
+            if employee_id is None:
+                return
+            lines = self.db.returnable_lines(transaction_id)
+            if not lines:
+                messagebox.showinfo("Return Items", "Everything on this transaction has been returned.")
+                return
+            quantities = {}
+            for line in lines:
+                quantity = simpledialog.askinteger(
+                    "Return Items", f"Quantity of '{line.name}' to return (0-{line.quantity}):",
+                    minvalue=0, maxvalue=line.quantity
+                )
+                if quantity is None:
+                    return
+                if quantity:
+                    quantities[line.part_id] = quantity
+            if quantities:
+                self.return_processed(self.db.return_lines(transaction_id, quantities, employee_id))
         except Exception as e:
-            print(f"Error processing return: {e}")
+            self.db.events.emit(ERROR, "ui_error", action="process_partial_return", error=e)
             messagebox.showerror("Error", "Failed to process return. Please ensure you are logged in.")
 
     def create_employees_tab(self):
@@ -402,13 +530,11 @@ class POSApp:
     def load_employees(self):
         """Load employees for the selected store."""
         self.employees_listbox.delete(0, tk.END)
-        employees = self.db.get_employees()
-        for employee in employees:
-            if employee[4] == self.store_id:  # Filter by store_id
-                self.employees_listbox.insert(
-                    tk.END,
-                    f"ID: {employee[0]}, Name: {employee[1]} {employee[2]}, Role: {employee[3]}"
-                )
+        for employee in self.db.get_store_employees(self.store_id):
+            self.employees_listbox.insert(
+                tk.END,
+                f"ID: {employee.id}, Name: {employee.first_name} {employee.last_name}, Role: {employee.role}"
+            )
 
     def add_employee(self):
         """Add a new employee to the selected store and update the employee dropdown."""
@@ -426,8 +552,8 @@ class POSApp:
             messagebox.showinfo("Success", f"Employee '{first_name} {last_name}' added successfully.")
             self.load_employees()
             self.load_employee_combobox()  # Refresh the employee dropdown
-            employees = self.db.get_employees()
-            self.selected_employee_id.set(employees[-1][0])  # Select the newly added employee
+            employees = self.db.get_store_employees(self.store_id)
+            self.selected_employee_id.set(employees[-1].id)  # Select the newly added employee
             self.employee_first_name_entry.delete(0, tk.END)
             self.employee_last_name_entry.delete(0, tk.END)
             self.employee_role_entry.delete(0, tk.END)
@@ -438,8 +564,9 @@ class POSApp:
     def load_inventory_list(self):
         """Load inventory items and display them in the listbox."""
         self.inventory_listbox.delete(0, tk.END)
-        parts = self.db.get_parts_by_store(self.store_id)
-        for part in parts:
+        self.inventory_pnos = []
+        for part in self.part_index.parts():
+            self.inventory_pnos.append(part.part_id)
             self.inventory_listbox.insert(tk.END, f"{part.name} - ${part.price:.2f} - {part.quantity} in stock")
     
     def add_inventory_item(self):
@@ -463,7 +590,7 @@ class POSApp:
         if pno:
             messagebox.showinfo("Success", f"Item '{name}' added with quantity {quantity} at ${price:.2f}.")
             self.load_inventory_list()
-            self.load_items()  # Update sales items list
+            self.refresh_items()  # Update sales items list
             self.load_stores()  # Update store inventory total
             self.item_name_entry.delete(0, tk.END)
             self.item_price_entry.delete(0, tk.END)
@@ -471,6 +598,31 @@ class POSApp:
         else:
             messagebox.showerror("Error", "Failed to add item to inventory.")
 
+    def import_inventory_items(self):
+        """Bulk import items into the selected store from a CSV or JSON catalog."""
+        file_path = filedialog.askopenfilename(
+            filetypes=[("Catalogs", "*.csv *.json *.jsonl"), ("All files", "*.*")],
+            title="Import Items"
+        )
+        if not file_path:
+            return
+        try:
+            report = self.db.import_parts(file_path, store_id=self.store_id)
+        except Exception as e:
+            self.db.events.emit(ERROR, "ui_error", action="import_inventory_items", error=e)
+            messagebox.showerror("Error", f"Failed to import items: {str(e)}")
+            return
+        self.load_inventory_list()
+        self.refresh_items()
+        self.load_stores()
+        summary = f"Added {report.inserted} and updated {report.updated} items."
+        if report.rejected:
+            summary += f"\n\n{len(report.rejected)} rows were rejected:\n"
+            summary += "\n".join(f"Line {r.line}: {r.reason}" for r in report.rejected[:10])
+            if len(report.rejected) > 10:
+                summary += "\n..."
+        messagebox.showinfo("Import Items", summary)
+
     def add_store(self):
         """Add a new store and update the store dropdown."""
         store_name = self.store_name_entry.get()
@@ -487,22 +639,12 @@ class POSApp:
     def load_stores(self):
         """Load stores and update the store listbox."""
         self.store_listbox.delete(0, tk.END)
-        stores = self.db.get_stores()
-        for store in stores:
-            store_id = store[0]
-            inventory_value = self.calculate_inventory_value(store_id)
-            # --- Inline tax rate display ---
-            tax_rate = self.db.get_store_tax_rate(store_id)
+        for store in self.db.get_store_summaries():
             self.store_listbox.insert(
                 tk.END,
-                f"{store[1]} - Inventory Value: ${inventory_value:.2f} - Tax Rate: {tax_rate*100:.2f}%"
+                f"{store.store_name} - Inventory Value: ${store.inventory_value:.2f} - Tax Rate: {store.tax_rate*100:.2f}%"
             )
 
-    def calculate_inventory_value(self, store_id):
-        """Calculate the total value of the inventory for a given store."""
-        parts = self.db.get_parts_by_store(store_id)
-        return sum(part.price * part.quantity for part in parts)
-
     def add_to_cart(self):
         """Add an item to the cart."""
         selected_item = self.item_var.get()
@@ -516,64 +658,55 @@ class POSApp:
         quantity = int(quantity)
         
         if item_id.isdigit():
-            item_id = int(item_id)
-            part = self.db.get_part_by_id(item_id)
+            part = self.part_index.get(int(item_id))
             if not part:
                 messagebox.showerror("Error", "Item ID not found.")
                 return
-            if quantity > part.quantity:
-                messagebox.showerror("Error", "Not enough stock available.")
-                return
-            if part.name in self.cart:
-                self.cart[part.name] += quantity
-            else:
-                self.cart[part.name] = quantity
-            self.items[part.name] = (part.price, part.quantity)
         elif selected_item:
-            available_quantity = self.items[selected_item][1]
-            if quantity > available_quantity:
-                messagebox.showerror("Error", "Not enough stock available.")
+            part = self.part_index.find(selected_item)
+            if not part:
+                messagebox.showerror("Error", "Item not found.")
                 return
-            if selected_item in self.cart:
-                self.cart[selected_item] += quantity
-            else:
-                self.cart[selected_item] = quantity
         else:
             messagebox.showerror("Error", "Please select an item or enter a valid item ID.")
             return
+
+        try:
+            self.cart.add(part, quantity)
+        except ValueError as e:
+            messagebox.showerror("Error", str(e))
+            return
         
-        self.update_cart_display()
+        self.update_cart_line(part.part_id)
 
     def update_cart_display(self):
-        """Update the cart listbox and subtotal/total labels."""
+        """Repaint the whole cart listbox and the subtotal/total labels."""
         self.cart_listbox.delete(0, tk.END)
-        subtotal = 0
-        for item, quantity in self.cart.items():
-            total_price = self.items[item][0] * quantity
-            subtotal += total_price
-            self.cart_listbox.insert(tk.END, f"{item} x{quantity} - ${total_price:.2f}")
-        discount_display = self.discount_var.get()
-        discount_amount = 0
-        if hasattr(self, "sales_discounts") and discount_display and discount_display != "No Discount":
-            discount = self.sales_discounts.get(discount_display)
-            if discount:
-                dtype = discount[3]
-                dval = float(discount[4])
-                if dtype.lower() == "percentage":
-                    discount_amount = round(subtotal * (dval / 100), 2)
-                elif dtype.lower() == "fixed":
-                    discount_amount = min(round(dval, 2), subtotal)
-        discounted_subtotal = max(subtotal - discount_amount, 0)
-        tax_rate = self.db.get_store_tax_rate(self.store_id) or 0.0
-        tax_amount = round(discounted_subtotal * tax_rate, 2)
-        total = round(discounted_subtotal + tax_amount, 2)
-        if discount_amount > 0:
+        for line in self.cart:
+            self.cart_listbox.insert(tk.END, self.format_cart_line(line))
+        self.update_cart_totals()
+
+    def update_cart_line(self, pno):
+        """Repaint the listbox row of one cart line and the totals."""
+        row = self.cart.position(pno)
+        if row < self.cart_listbox.size():
+            self.cart_listbox.delete(row)
+        self.cart_listbox.insert(row, self.format_cart_line(self.cart.lines[pno]))
+        self.update_cart_totals()
+
+    def format_cart_line(self, line):
+        return f"{line.part.name} x{line.quantity} - ${line.total:.2f}"
+
+    def update_cart_totals(self):
+        """Update the subtotal/total label from the cart's running totals."""
+        totals = self.cart.totals()
+        if totals.discount > 0:
             self.total_label.config(
-                text=f"Subtotal: ${subtotal:.2f}   Discount: -${discount_amount:.2f}   Tax: ${tax_amount:.2f}   Total: ${total:.2f}"
+                text=f"Subtotal: ${totals.subtotal:.2f}   Discount: -${totals.discount:.2f}   Tax: ${totals.tax:.2f}   Total: ${totals.total:.2f}"
             )
         else:
             self.total_label.config(
-                text=f"Subtotal: ${subtotal:.2f}   Tax: ${tax_amount:.2f}   Total: ${total:.2f}"
+                text=f"Subtotal: ${totals.subtotal:.2f}   Tax: ${totals.tax:.2f}   Total: ${totals.total:.2f}"
             )
 
     def checkout(self):
@@ -595,45 +728,34 @@ class POSApp:
                 return
 
         except Exception as e:
-            print("DEBUG Exception in checkout employee_id:", e)
+            self.db.events.emit(ERROR, "ui_error", action="checkout", error=e)
             messagebox.showerror("Error", "Please select a valid employee.")
             return
 
-        parts_sold = []
-        for item, quantity in self.cart.items():
-            price = self.items[item][0]
-            parts_sold.append(PartSold(name=item, quantity=quantity, unit_price=price, total_price=price * quantity))
-        
-        # --- Calculate discount ---
-        subtotal = sum(part.total_price for part in parts_sold)
-        discount_display = self.discount_var.get()
-        discount_amount = 0
-        discount_id = None
-        if hasattr(self, "sales_discounts") and discount_display and discount_display != "No Discount":
-            discount = self.sales_discounts.get(discount_display)
-            if discount:
-                discount_id = discount[0]
-                dtype = discount[3]
-                dval = float(discount[4])
-                if dtype.lower() == "percentage":
-                    discount_amount = round(subtotal * (dval / 100), 2)
-                elif dtype.lower() == "fixed":
-                    discount_amount = min(round(dval, 2), subtotal)
-        discounted_subtotal = max(subtotal - discount_amount, 0)
-        tax_rate = self.db.get_store_tax_rate(self.store_id) or 0.0 # Default to 0.0
-        tax_amount = round(discounted_subtotal * tax_rate, 2)
-        total = round(discounted_subtotal + tax_amount, 2)
-
-        transaction_id = self.db.create_purchase(parts_sold, self.store_id, employee_id=employee_id, discount_id=discount_id)
+        totals = self.cart.totals()
+        if self.journal:
+            # Durable locally; the syncer turns it into a transaction
+            try:
+                transaction_id = self.journal.record(
+                    self.cart.to_parts_sold(), self.store_id, employee_id=employee_id, discount_id=self.cart.discount_id
+                )
+            except Exception as e:
+                self.db.events.emit(ERROR, "ui_error", action="checkout", error=e)
+                transaction_id = None
+            else:
+                self.syncer.wake()
+        else:
+            transaction_id = self.db.create_purchase(
+                self.cart.to_parts_sold(), self.store_id, employee_id=employee_id, discount_id=self.cart.discount_id
+            )
         if transaction_id:
-            receipt = f"Subtotal: ${subtotal:.2f}\n"
-            if discount_amount > 0:
-                receipt += f"Discount: -${discount_amount:.2f}\n"
-            receipt += f"Tax: ${tax_amount:.2f}\nTotal: ${total:.2f}"
+            receipt = f"Subtotal: ${totals.subtotal:.2f}\n"
+            if totals.discount > 0:
+                receipt += f"Discount: -${totals.discount:.2f}\n"
+            receipt += f"Tax: ${totals.tax:.2f}\nTotal: ${totals.total:.2f}"
             messagebox.showinfo("Total", receipt)
             self.cart.clear()
             self.update_cart_display()
-            self.load_items()  # Update items after purchase
             self.load_inventory_list()  # Update inventory tab after checkout
             self.load_transactions()  # Update transactions tab after checkout
             self.load_stores()  # Update store tab after checkout
@@ -641,37 +763,49 @@ class POSApp:
         else:
             messagebox.showerror("Error", "Checkout failed.")
 
+    def poll_sync_results(self):
+        """Refresh the views with sales the journal syncer has written to the database."""
+        synced = False
+        rejected = []
+        while True:
+            try:
+                result = self.syncer.results.get_nowait()
+            except queue.Empty:
+                break
+            synced = synced or bool(result.synced)
+            rejected += result.rejected
+            self.db.refresh_parts(result.pnos)
+        if synced:
+            self.load_inventory_list()
+            self.load_transactions()
+            self.load_stores()
+        if rejected:
+            details = "\n".join(f"Sale {seq}: {error}" for seq, error in rejected[:10])
+            messagebox.showwarning("Offline Sales Rejected",
+                                   f"{len(rejected)} offline sale(s) could not be recorded:\n{details}")
+        self.root.after(SYNC_POLL_MS, self.poll_sync_results)
+
+    def rollup_balances(self):
+        """Fold the sales ledger into the store balances, so balance reads stay short."""
+        self.db.rollup_balances()
+        self.root.after(BALANCE_ROLLUP_MS, self.rollup_balances)
+
     def generate_sales_report(self):
         """Generate a sales report with visualizations for the selected store."""
         try:
-            sales_report = self.db.SalesReport(self.store_id)
-            if not sales_report:
+            store_id = self.store_id
+            reports = self.db.reporting()  # Snapshot, so the report does not hold up checkouts
+            # Only a preview of the report is held; Save Report streams the full text
+            lines = reports.sales_report_lines(store_id)
+            preview = list(itertools.islice(lines, REPORT_PREVIEW_LINES + 1))
+            lines.close()
+            if len(preview) <= 1:
                 messagebox.showinfo("Sales Report", "No transactions found for this store.")
                 return
-
-            report = f"Sales Report for Store ID {self.store_id}\n\n"
-            dates = []
-            totals = []
-            items_sold = {}
-            
-            for transaction in sales_report:
-                report += f"Transaction ID: {transaction.transaction_id}, Date: {transaction.date}, Total: ${transaction.total_price:.2f}, Employee: {transaction.employee}\n"
-                if getattr(transaction, "discount_name", None):
-                    report += f"  Discount: {transaction.discount_name} (-${transaction.discount_amount:.2f})\n"
-                for part in transaction.parts_sold:
-                    report += f"  - {part.name}: {part.quantity} @ ${part.unit_price:.2f} each (Total: ${part.total_price:.2f})\n"
-                report += "\n"
-                
-                date = datetime.strptime(transaction.date, '%Y-%m-%d %H:%M:%S')
-                dates.append(date)
-                totals.append(transaction.total_price)
-                
-                for part in transaction.parts_sold:
-                    quantity = abs(part.quantity)
-                    if part.name in items_sold:
-                        items_sold[part.name] += quantity
-                    else:
-                        items_sold[part.name] = quantity
+            if len(preview) > REPORT_PREVIEW_LINES:
+                preview[REPORT_PREVIEW_LINES:] = [
+                    f"... preview limited to {REPORT_PREVIEW_LINES} lines, use Save Report for the full report.\n"
+                ]
 
             viz_window = tk.Toplevel(self.root)
             viz_window.title("Sales Report Visualization")
@@ -680,25 +814,41 @@ class POSApp:
             notebook = ttk.Notebook(viz_window)
             notebook.pack(fill='both', expand=True)
 
-            fig1, ax1 = plt.subplots(figsize=(10, 5))
-            ax1.plot(dates, totals, marker='o')
-            ax1.set_title('Sales Over Time')
-            ax1.set_xlabel('Date')
-            ax1.set_ylabel('Sales ($)')
-            plt.xticks(rotation=45)
-            plt.tight_layout()
-            
             time_frame = ttk.Frame(notebook)
             notebook.add(time_frame, text='Sales Over Time')
+            granularity_var = tk.StringVar(value="daily")
+            granularity_combobox = ttk.Combobox(
+                time_frame, textvariable=granularity_var, values=list(self.db.TIME_BUCKETS), state="readonly"
+            )
+            granularity_combobox.pack(pady=5)
+
+            fig1, ax1 = plt.subplots(figsize=(10, 5))
             canvas1 = FigureCanvasTkAgg(fig1, time_frame)
-            canvas1.draw()
             canvas1.get_tk_widget().pack(fill='both', expand=True)
 
+            def draw_sales_over_time():
+                buckets = reports.sales_over_time(store_id, granularity_var.get())
+                ax1.clear()
+                self.plot_downsampled(
+                    ax1, canvas1,
+                    mdates.date2num([datetime.fromisoformat(b.period) for b in buckets]),
+                    np.array([b.total for b in buckets])
+                )
+                ax1.xaxis_date()
+                ax1.set_title(f'Sales Over Time ({granularity_var.get()})')
+                ax1.set_xlabel('Date')
+                ax1.set_ylabel('Sales ($)')
+                ax1.tick_params(axis='x', labelrotation=45)
+                fig1.tight_layout()
+                canvas1.draw()
+
+            granularity_combobox.bind("<<ComboboxSelected>>", lambda e: draw_sales_over_time())
+            draw_sales_over_time()
+
             fig2, ax2 = plt.subplots(figsize=(10, 5))
-            items_df = pd.DataFrame(list(items_sold.items()), columns=['Item', 'Quantity'])
-            items_df = items_df.nlargest(10, 'Quantity')  # Get top 10 by quantity
+            top_items = reports.top_items(store_id, limit=10)[::-1]  # Largest bar on top
             
-            bars = ax2.barh(items_df['Item'], items_df['Quantity'], color='steelblue')
+            bars = ax2.barh([item.name for item in top_items], [item.quantity for item in top_items], color='steelblue')
             
             ax2.set_title('Top 10 Items Sold by Quantity')
             ax2.set_xlabel('Quantity Sold')
@@ -726,21 +876,50 @@ class POSApp:
             save_button = ttk.Button(
                 button_frame, 
                 text="Save Report", 
-                command=lambda: self.save_report(report)
+                command=lambda: self.save_report(store_id)
             )
             save_button.pack(side='left', padx=5)
             
             report_text = tk.Text(text_frame, wrap=tk.WORD)
-            report_text.insert(tk.END, report)
+            report_text.insert(tk.END, "".join(preview))
             report_text.pack(expand=True, fill=tk.BOTH)
             report_text.config(state=tk.DISABLED)
 
         except Exception as e:
-            print(f"Error generating sales report: {e}")
+            self.db.events.emit(ERROR, "ui_error", action="generate_sales_report", error=e)
             messagebox.showerror("Error", f"Failed to generate sales report: {str(e)}")
 
-    def save_report(self, report_text):
-        """Save the sales report to a text file."""
+    def plot_downsampled(self, ax, canvas, x, y, max_markers=200):
+        """
+        Plot a long series with at most two points per horizontal pixel.
+
+        Only the visible x range is downsampled (min/max per pixel bucket), and the line
+        is re-sampled whenever the view is zoomed or panned, so detail appears on zoom.
+        """
+        line, = ax.plot([], [])
+
+        def resample(ax):
+            if len(x) == 0:
+                return
+            low, high = ax.get_xlim()
+            start = max(np.searchsorted(x, low) - 1, 0)
+            end = min(np.searchsorted(x, high) + 1, len(x))
+            pixels = max(int(ax.bbox.width), 1)
+            vx, vy = downsample_minmax(x[start:end], y[start:end], pixels)
+            line.set_data(vx, vy)
+            line.set_marker('o' if len(vx) <= max_markers else '')
+            canvas.draw_idle()
+
+        if len(x):
+            pad = 0.5 if x[0] == x[-1] else 0
+            ax.set_xlim(x[0] - pad, x[-1] + pad)
+            ax.set_ylim(min(y.min(), 0), max(y.max(), 0) * 1.05 or 1)
+        resample(ax)
+        ax.callbacks.connect('xlim_changed', resample)
+        return line
+
+    def save_report(self, store_id):
+        """Stream the full sales report of a store to a text file."""
         try:
             file_path = filedialog.asksaveasfilename(
                 defaultextension=".txt",
@@ -748,8 +927,8 @@ class POSApp:
                 title="Save Sales Report"
             )
             if file_path:
-                with open(file_path, 'w') as file:
-                    file.write(report_text)
+                with open(file_path, 'w', buffering=1 << 16) as file:
+                    file.writelines(self.db.reporting().sales_report_lines(store_id))
                 messagebox.showinfo("Success", "Report saved successfully!")
         except Exception as e:
             messagebox.showerror("Error", f"Failed to save report: {str(e)}")
@@ -869,14 +1048,10 @@ class POSApp:
 
     def populate_item_id(self, event):
         """Populate the item ID entry box based on the selected item in the dropdown."""
-        selected_item = self.item_var.get()
-        if selected_item in self.items:
-            parts = self.db.get_parts_by_store(self.store_id)
-            for part in parts:
-                if part.name == selected_item:
-                    self.item_id_entry.delete(0, tk.END)
-                    self.item_id_entry.insert(0, part.part_id)
-                    break
+        part = self.part_index.find(self.item_var.get())
+        if part:
+            self.item_id_entry.delete(0, tk.END)
+            self.item_id_entry.insert(0, part.part_id)
 
     def show_cart_context_menu(self, event):
         """Show a context menu to manage items in the cart."""
@@ -884,43 +1059,45 @@ class POSApp:
             selected_index = self.cart_listbox.nearest(event.y)
             self.cart_listbox.selection_clear(0, tk.END)
             self.cart_listbox.selection_set(selected_index)
-            selected_item = self.cart_listbox.get(selected_index)
-            item_name = selected_item.split(" x")[0]
+            pno = self.cart.pno_at(selected_index)
 
             self.cart_context_menu = tk.Menu(self.cart_listbox, tearoff=0)
-            self.cart_context_menu.add_command(label="Remove Item", command=lambda: self.remove_from_cart(item_name))
-            self.cart_context_menu.add_command(label="Change Quantity", command=lambda: self.change_cart_quantity(item_name))
+            self.cart_context_menu.add_command(label="Remove Item", command=lambda: self.remove_from_cart(pno))
+            self.cart_context_menu.add_command(label="Change Quantity", command=lambda: self.change_cart_quantity(pno))
             self.cart_context_menu.post(event.x_root, event.y_root)
         except Exception as e:
-            print(f"Error showing cart context menu: {e}")
+            self.db.events.emit(ERROR, "ui_error", action="show_cart_context_menu", error=e)
 
-    def remove_from_cart(self, item_name):
+    def remove_from_cart(self, pno):
         """Remove the specified item from the cart."""
         try:
-            if item_name in self.cart:
-                del self.cart[item_name]
-                self.update_cart_display()
+            if pno in self.cart:
+                item_name = self.cart.lines[pno].part.name
+                self.cart_listbox.delete(self.cart.position(pno))
+                self.cart.remove(pno)
+                self.update_cart_totals()
                 messagebox.showinfo("Success", f"Removed '{item_name}' from the cart.")
         except Exception as e:
-            print(f"Error removing item from cart: {e}")
+            self.db.events.emit(ERROR, "ui_error", action="remove_from_cart", error=e)
 
-    def change_cart_quantity(self, item_name):
+    def change_cart_quantity(self, pno):
         """Change the quantity of the specified item in the cart."""
         try:
-            if item_name in self.cart:
+            if pno in self.cart:
+                part = self.part_index.get(pno) or self.cart.lines[pno].part
+                item_name = part.name
                 new_quantity = tk.simpledialog.askinteger("Change Quantity", f"Enter new quantity for '{item_name}':")
                 if new_quantity is not None and new_quantity > 0:
-                    available_quantity = self.items[item_name][1]
-                    if new_quantity > available_quantity:
-                        messagebox.showerror("Error", f"Not enough stock available. Max available: {available_quantity}.")
+                    if new_quantity > part.quantity:
+                        messagebox.showerror("Error", f"Not enough stock available. Max available: {part.quantity}.")
                     else:
-                        self.cart[item_name] = new_quantity
-                        self.update_cart_display()
+                        self.cart.set_quantity(part, new_quantity)
+                        self.update_cart_line(pno)
                         messagebox.showinfo("Success", f"Updated quantity of '{item_name}' to {new_quantity}.")
                 elif new_quantity is not None:
                     messagebox.showerror("Error", "Quantity must be greater than 0.")
         except Exception as e:
-            print(f"Error changing item quantity: {e}")
+            self.db.events.emit(ERROR, "ui_error", action="change_cart_quantity", error=e)
 
     def show_inventory_context_menu(self, event):
         """Show a context menu to manage items in the inventory."""
@@ -928,69 +1105,87 @@ class POSApp:
             selected_index = self.inventory_listbox.nearest(event.y)
             self.inventory_listbox.selection_clear(0, tk.END)
             self.inventory_listbox.selection_set(selected_index)
-            selected_item = self.inventory_listbox.get(selected_index)
-            item_name = selected_item.split(" - ")[0]
+            pno = self.inventory_pnos[selected_index]
 
             self.inventory_context_menu = tk.Menu(self.inventory_listbox, tearoff=0)
-            self.inventory_context_menu.add_command(label="Remove Item", command=lambda: self.remove_inventory_item(item_name))
-            self.inventory_context_menu.add_command(label="Update Price", command=lambda: self.update_inventory_price(item_name))
-            self.inventory_context_menu.add_command(label="Update Stock", command=lambda: self.update_inventory_stock(item_name))
-            self.inventory_context_menu.add_command(label="Change Name", command=lambda: self.change_inventory_name(item_name))
+            self.inventory_context_menu.add_command(label="Remove Item", command=lambda: self.remove_inventory_item(pno))
+            self.inventory_context_menu.add_command(label="Update Price", command=lambda: self.update_inventory_price(pno))
+            self.inventory_context_menu.add_command(label="Update Stock", command=lambda: self.update_inventory_stock(pno))
+            self.inventory_context_menu.add_command(label="Change Name", command=lambda: self.change_inventory_name(pno))
+            self.inventory_context_menu.add_separator()
+            self.inventory_context_menu.add_command(label="Adjust All Prices...", command=self.adjust_inventory_prices)
             self.inventory_context_menu.post(event.x_root, event.y_root)
         except Exception as e:
-            print(f"Error showing inventory context menu: {e}")
+            self.db.events.emit(ERROR, "ui_error", action="show_inventory_context_menu", error=e)
+
+    def adjust_inventory_prices(self):
+        """Raise or lower the price of every item in the selected store by a percentage."""
+        try:
+            percent = simpledialog.askfloat("Adjust All Prices", "Enter the price change in percent (e.g., 5 or -10):")
+            if percent is None:
+                return
+            if percent <= -100:
+                messagebox.showerror("Error", "Prices cannot be lowered by 100% or more.")
+                return
+            repriced = self.db.adjust_prices(percent, store_id=self.store_id)
+            self.load_inventory_list()
+            self.load_stores()
+            messagebox.showinfo("Success", f"Adjusted the price of {repriced} items by {percent:+.2f}%.")
+        except Exception as e:
+            self.db.events.emit(ERROR, "ui_error", action="adjust_inventory_prices", error=e)
+            messagebox.showerror("Error", f"Failed to adjust prices: {str(e)}")
 
-    def remove_inventory_item(self, item_name):
+    def remove_inventory_item(self, pno):
         """Remove the specified item from the inventory."""
         try:
-            part = next((p for p in self.db.get_parts_by_store(self.store_id) if p.name == item_name), None)
-            if part:
-                self.db.cursor.execute("DELETE FROM parts WHERE pno = ?", (part.part_id,))
-                self.db.conn.commit()
+            part = self.part_index.get(pno)
+            if part and self.db.remove_part(pno):
                 self.load_inventory_list()
-                messagebox.showinfo("Success", f"Removed '{item_name}' from inventory.")
+                self.refresh_items()
+                messagebox.showinfo("Success", f"Removed '{part.name}' from inventory.")
         except Exception as e:
-            print(f"Error removing inventory item: {e}")
+            self.db.events.emit(ERROR, "ui_error", action="remove_inventory_item", error=e)
 
-    def update_inventory_price(self, item_name):
+    def update_inventory_price(self, pno):
         """Update the price of the specified item in the inventory."""
         try:
+            item_name = self.part_index.get(pno).name
             new_price = simpledialog.askfloat("Update Price", f"Enter new price for '{item_name}':")
             if new_price is not None and new_price > 0:
-                self.db.cursor.execute("UPDATE parts SET price = ? WHERE name = ?", (new_price, item_name))
-                self.db.conn.commit()
+                self.db.update_part(pno, price=new_price)
                 self.load_inventory_list()
                 messagebox.showinfo("Success", f"Updated price of '{item_name}' to ${new_price:.2f}.")
             elif new_price is not None:
                 messagebox.showerror("Error", "Price must be greater than 0.")
         except Exception as e:
-            print(f"Error updating inventory price: {e}")
+            self.db.events.emit(ERROR, "ui_error", action="update_inventory_price", error=e)
 
-    def update_inventory_stock(self, item_name):
+    def update_inventory_stock(self, pno):
         """Update the stock of the specified item in the inventory."""
         try:
+            item_name = self.part_index.get(pno).name
             new_stock = simpledialog.askinteger("Update Stock", f"Enter new stock quantity for '{item_name}':")
             if new_stock is not None and new_stock >= 0:
-                self.db.cursor.execute("UPDATE parts SET quantity = ? WHERE name = ?", (new_stock, item_name))
-                self.db.conn.commit()
+                self.db.update_part(pno, quantity=new_stock)
                 self.load_inventory_list()
                 messagebox.showinfo("Success", f"Updated stock of '{item_name}' to {new_stock}.")
             elif new_stock is not None:
                 messagebox.showerror("Error", "Stock must be 0 or greater.")
         except Exception as e:
-            print(f"Error updating inventory stock: {e}")
+            self.db.events.emit(ERROR, "ui_error", action="update_inventory_stock", error=e)
 
-    def change_inventory_name(self, item_name):
+    def change_inventory_name(self, pno):
         """Change the name of the specified item in the inventory."""
         try:
+            item_name = self.part_index.get(pno).name
             new_name = simpledialog.askstring("Change Name", f"Enter new name for '{item_name}':")
             if new_name:
-                self.db.cursor.execute("UPDATE parts SET name = ? WHERE name = ?", (new_name, item_name))
-                self.db.conn.commit()
+                self.db.update_part(pno, name=new_name)
                 self.load_inventory_list()
+                self.refresh_items()
                 messagebox.showinfo("Success", f"Changed name of '{item_name}' to '{new_name}'.")
         except Exception as e:
-            print(f"Error changing inventory name: {e}")
+            self.db.events.emit(ERROR, "ui_error", action="change_inventory_name", error=e)
 
     def show_discount_context_menu(self, event):
         """Show a context menu for discounts to allow deletion."""
@@ -1015,18 +1210,17 @@ class POSApp:
             )
             self.discount_context_menu.post(event.x_root, event.y_root)
         except Exception as e:
-            print(f"Error showing discount context menu: {e}")
+            self.db.events.emit(ERROR, "ui_error", action="show_discount_context_menu", error=e)
 
     def delete_discount(self, discount_id, discount_name):
         """Delete the specified discount from the database."""
         try:
             if messagebox.askyesno("Delete Discount", f"Are you sure you want to delete '{discount_name}'?"):
-                self.db.cursor.execute("DELETE FROM discounts WHERE discount_id = ?", (discount_id,))
-                self.db.conn.commit()
+                self.db.remove_discount(discount_id)
                 self.load_discounts()
                 messagebox.showinfo("Success", f"Discount '{discount_name}' deleted.")
         except Exception as e:
-            print(f"Error deleting discount: {e}")
+            self.db.events.emit(ERROR, "ui_error", action="delete_discount", error=e)
 
 if __name__ == "__main__":
     root = tk.Tk()